@@ -4,4 +4,25 @@
 
 __version__ = '4.0.1'
 
-from pyslip.pyslip import *
+# The widget module needs wx and opens the log file, so it's imported
+# when one of its names is first used.  Importing a pyslip submodule,
+# as a tile decode pool process does, then doesn't import the widget.
+
+def __getattr__(name):
+    import importlib
+
+    if name.startswith('__'):
+        # a special name looked for by tools, not a widget name
+        raise AttributeError("module 'pyslip' has no attribute '%s'" % name)
+    widget = importlib.import_module('pyslip.pyslip')
+    try:
+        return getattr(widget, name)
+    except AttributeError:
+        raise AttributeError("module 'pyslip' has no attribute '%s'"
+                             % name) from None
+
+def __dir__():
+    import importlib
+
+    widget = importlib.import_module('pyslip.pyslip')
+    return sorted(set(globals()) | set(dir(widget)))
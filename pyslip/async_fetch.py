@@ -0,0 +1,539 @@
+"""
+An asyncio tile fetch engine.
+
+One background thread runs an asyncio event loop that fetches tiles for
+any number of tile sources and servers, instead of each tile source
+running a set of TileWorker threads.
+
+A tile source registers with the engine by calling add_source(), giving
+its request queue (a queue.Queue of (level, x, y) keys), its servers and
+a 'done' function.  The engine makes a few request coroutines for each
+server of the source, which take keys from the queue, fetch the tiles
+from the server the source's server_balance.ServerBalancer picks over
+keep-alive HTTP/1.1 connections and pass the results to 'done'.
+'done' is called in an executor thread, so it may take time to decode
+the tile.  The source calls wake() after putting a key on the queue.
+
+The number of concurrent requests to one host is limited over all
+sources, see set_host_limit().  A request coroutine takes a key from
+the queue and then waits for the balancer to pick a server, which may be
+throttled, so idle coroutines don't hold a server slot.  If the source
+gives a hedge.HedgePolicy, slow requests are hedged with a request to
+another server.  The first good response is used and the other request
+is cancelled.
+
+Use get_engine() to get the engine shared by all tile sources.
+"""
+
+import io
+import ssl
+import time
+import queue
+import asyncio
+import threading
+import traceback
+import http.client
+import urllib.parse
+import pyslip.rate_limit as rate_limit
+import pyslip.server_balance as server_balance
+import pyslip.hedge as hedge
+import pyslip.log as log
+
+try:
+    log = log.Log('pyslip.log')
+except AttributeError:
+    # means log already set up
+    pass
+
+
+class FetchSource(object):
+    """A tile source registered with the FetchEngine."""
+
+    def __init__(self, engine, requests, servers, url_path, headers, done,
+                 server_requests, balancer, hedge):
+        """Prepare the source.
+
+        engine           the owning FetchEngine
+        requests         queue of (level, x, y) tile keys to fetch
+        servers          list of server URLs
+        url_path         path on server to each tile, with {Z}, {X} and {Y}
+        headers          function returning the dictionary of extra
+                         request headers for a tile key
+        done             function called with each result
+        server_requests  number of request coroutines for each server
+        balancer         the server_balance.ServerBalancer picking the
+                         server for each request
+        hedge            the hedge.HedgePolicy, None means don't hedge
+        """
+
+        self.engine = engine
+        self.requests = requests
+        self.servers = servers
+        self.url_path = url_path
+        self.headers = headers
+        self.done = done
+        self.server_requests = server_requests
+        self.balancer = balancer
+        self.hedge = hedge
+
+        self._event = None
+        self._tasks = []
+
+    def wake(self):
+        """Tell the engine there are new requests in the queue."""
+
+        self.engine.loop.call_soon_threadsafe(self._event.set)
+
+    def close(self):
+        """Stop fetching tiles for this source."""
+
+        def cancel():
+            for task in self._tasks:
+                task.cancel()
+        self.engine.loop.call_soon_threadsafe(cancel)
+
+    def _start(self):
+        """Start the request coroutines, called in the engine thread."""
+
+        self._event = asyncio.Event()
+        num_tasks = self.server_requests * len(self.balancer.servers)
+        for _ in range(num_tasks):
+            self._tasks.append(self.engine.loop.create_task(
+                                                self._fetch_tiles()))
+
+    async def _fetch_tiles(self):
+        """Fetch tiles until cancelled."""
+
+        while True:
+            try:
+                key = self.requests.get_nowait()
+            except queue.Empty:
+                self._event.clear()
+                await self._event.wait()
+                continue
+
+            try:
+                await self._fetch(key)
+            finally:
+                self.requests.task_done()
+
+    async def _fetch(self, key):
+        """Fetch one tile and pass the result to 'done'."""
+
+        loop = self.engine.loop
+
+        # wait for a server that may be sent the request
+        (server, wait) = self.balancer.try_acquire()
+        while server is None:
+            await asyncio.sleep(self.engine.AcquirePoll
+                                    if wait is None else wait)
+            (server, wait) = self.balancer.try_acquire()
+
+        # a request that can't be made is passed to 'done' as failed
+        try:
+            headers = await loop.run_in_executor(None, self.headers, key)
+        except Exception as e:
+            self.balancer.cancel(server)
+            log('%s exception getting headers for tile %s'
+                    % (type(e).__name__, str(key)))
+            result = (None, None, None, e, 0.0)
+        except BaseException:
+            self.balancer.cancel(server)
+            raise
+        else:
+            if self.hedge is None:
+                result = await self._request(server, key, headers)
+            else:
+                (server, result) = await self._hedged_request(server, key,
+                                                              headers)
+
+        try:
+            await loop.run_in_executor(None, self.done, key, server, *result)
+        except Exception:
+            # the coroutine must keep going whatever happens
+            log('Unexpected exception handling tile %s' % str(key))
+            log(''.join(traceback.format_exc()))
+
+    async def _request(self, server, key, headers):
+        """Fetch a tile from a server the balancer picked.
+
+        Returns (status, info, data, exception, elapsed).
+        """
+
+        (level, x, y) = key
+        path = self.url_path.format(Z=level, X=x, Y=y)
+        start = time.perf_counter()
+        try:
+            (status, info, data) = await self.engine.request(server, path,
+                                                             headers)
+            result = (status, info, data, None)
+        except asyncio.CancelledError:
+            self.balancer.cancel(server, time.perf_counter() - start)
+            raise
+        except Exception as e:
+            result = (None, None, None, e)
+        elapsed = time.perf_counter() - start
+
+        (status, info, _, exception) = result
+        self.balancer.release(server, rate_limit.outcome(status, exception),
+                              elapsed, rate_limit.retry_after(info, time.time()))
+        if self.hedge is not None and exception is None:
+            self.hedge.observe(elapsed)
+
+        return result + (elapsed,)
+
+    async def _hedged_request(self, server, key, headers):
+        """Fetch a tile, hedging with another server if it's slow.
+
+        Returns (server, result) for the first good response to arrive,
+        where 'result' is as for _request(), or the failure of the first
+        request if both fail.
+        """
+
+        loop = self.engine.loop
+        first = loop.create_task(self._request(server, key, headers))
+        tasks = {first: server}
+        try:
+            delay = self.hedge.start()
+            if delay is not None:
+                (done, _) = await asyncio.wait([first], timeout=delay)
+                if not done and self.hedge.try_hedge():
+                    # hedge as soon as another server is free, unless the
+                    # request finishes first
+                    other = None
+                    while not first.done():
+                        (other, wait) = self.balancer.try_acquire(
+                                                            exclude=server)
+                        if other is not None:
+                            break
+                        await asyncio.wait([first],
+                                           timeout=(self.engine.AcquirePoll
+                                                    if wait is None else wait))
+                    if other is None:
+                        self.hedge.cancel()
+                    else:
+                        task = loop.create_task(self._request(other, key,
+                                                              headers))
+                        tasks[task] = other
+
+            # wait for a good response, a fast failure from one server
+            # mustn't beat a slower tile from the other
+            pending = set(tasks)
+            good = []
+            while pending and not good:
+                (done, pending) = await asyncio.wait(pending,
+                                        return_when=asyncio.FIRST_COMPLETED)
+                good = [t for t in done if hedge.succeeded(t.result())]
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        if not good:
+            return (server, first.result())
+        winner = first if first in good else good[0]
+        if winner is not first:
+            self.hedge.won()
+        return (tasks[winner], winner.result())
+
+
+class FetchEngine(object):
+    """Fetch tiles for many sources from an asyncio loop in one thread."""
+
+    # default maximum number of concurrent requests to one host
+    HostRequests = 4
+
+    # seconds to wait for a connection or response
+    Timeout = 30
+
+    # maximum number of idle connections kept open to one host
+    MaxIdle = 8
+
+    # seconds between checks of a balancer waiting for a request to finish
+    AcquirePoll = 0.05
+
+    def __init__(self, host_requests=HostRequests, timeout=Timeout):
+        """Start the engine thread.
+
+        host_requests  default maximum concurrent requests to one host
+        timeout        seconds to wait for a connection or response
+        """
+
+        self.host_requests = host_requests
+        self.timeout = timeout
+
+        self._host_limits = {}
+        self._semaphores = {}
+        self._idle = {}
+        self._ssl_context = None
+
+        # number of connections opened, useful for seeing reuse
+        self.connects = 0
+
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def add_source(self, requests, servers, url_path, done, headers=None,
+                   server_requests=2, balancer=None, hedge=None):
+        """Register a tile source with the engine.
+
+        requests         queue of (level, x, y) tile keys to fetch
+        servers          list of server URLs
+        url_path         path on server to each tile, with {Z}, {X} and {Y}
+        done             function called as done(key, server, status, info,
+                         data, exception, elapsed) for each request,
+                         'exception' is None if the request succeeded
+        headers          function returning the dictionary of extra request
+                         headers for a tile key, called in an executor
+                         thread
+        server_requests  number of concurrent requests per server for
+                         this source, still limited by the host limit
+        balancer         the server_balance.ServerBalancer picking the
+                         server for each request, None means balance
+                         over 'servers' with no throttles
+        hedge            the hedge.HedgePolicy deciding when to hedge slow
+                         requests, None means don't hedge
+
+        Returns the FetchSource object.
+        """
+
+        source = FetchSource(self, requests, servers, url_path,
+                             headers or (lambda key: {}), done,
+                             server_requests,
+                             balancer or server_balance.ServerBalancer(servers),
+                             hedge)
+        ready = threading.Event()
+
+        def start():
+            source._start()
+            ready.set()
+        self.loop.call_soon_threadsafe(start)
+        ready.wait()
+
+        return source
+
+    def set_host_limit(self, server, limit):
+        """Set the maximum number of concurrent requests to a server's host.
+
+        server  a server URL
+        limit   the maximum number of concurrent requests
+        """
+
+        host = self._parse(server)[:3]
+
+        def set_limit():
+            self._host_limits[host] = limit
+            self._semaphores.pop(host, None)
+        self.loop.call_soon_threadsafe(set_limit)
+
+    def close(self):
+        """Close idle connections and stop the engine thread."""
+
+        async def stop():
+            tasks = [task for task in asyncio.all_tasks(self.loop)
+                     if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for conns in self._idle.values():
+                for (_, writer) in conns:
+                    writer.close()
+            self._idle.clear()
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def request(self, server, path, headers):
+        """Make a GET request to a server.
+
+        server   the server URL
+        path     the path on the server
+        headers  dictionary of extra request headers
+
+        Returns (status, headers, data) where 'headers' is a
+        http.client.HTTPMessage and 'data' the response body bytes.
+        """
+
+        (scheme, host, port, base_path) = self._parse(server)
+        key = (scheme, host, port)
+        async with self._semaphore(key):
+            (conn, reused) = self._get_connection(key)
+            if conn is None:
+                conn = await self._connect(key)
+            try:
+                result = await asyncio.wait_for(
+                                self._exchange(conn, key, base_path + path,
+                                               headers),
+                                self.timeout)
+            except (http.client.RemoteDisconnected, ConnectionError,
+                    asyncio.IncompleteReadError):
+                conn[1].close()
+                if not reused:
+                    raise
+                # the server closed an idle connection, try a fresh one
+                conn = await self._connect(key)
+                try:
+                    result = await asyncio.wait_for(
+                                    self._exchange(conn, key, base_path + path,
+                                                   headers),
+                                    self.timeout)
+                except BaseException:
+                    conn[1].close()
+                    raise
+            except BaseException:
+                conn[1].close()
+                raise
+
+        (status, info, data, keep_alive) = result
+        if keep_alive:
+            self._put_connection(key, conn)
+        else:
+            conn[1].close()
+
+        return (status, info, data)
+
+    @staticmethod
+    def _parse(server):
+        """Return (scheme, host, port, base_path) for a server URL."""
+
+        url = urllib.parse.urlsplit(server)
+        if url.scheme not in ('http', 'https'):
+            raise ValueError("Bad server URL '%s', expected http or https"
+                             % server)
+        port = url.port or (443 if url.scheme == 'https' else 80)
+        return (url.scheme, url.hostname, port, url.path.rstrip('/'))
+
+    def _semaphore(self, key):
+        """Return the semaphore limiting requests to a host."""
+
+        try:
+            return self._semaphores[key]
+        except KeyError:
+            limit = self._host_limits.get(key, self.host_requests)
+            sem = self._semaphores[key] = asyncio.Semaphore(limit)
+            return sem
+
+    def _get_connection(self, key):
+        """Return (connection, reused), connection None if none idle."""
+
+        conns = self._idle.get(key)
+        while conns:
+            conn = conns.pop()
+            if not conn[0].at_eof():
+                return (conn, True)
+            conn[1].close()
+        return (None, False)
+
+    def _put_connection(self, key, conn):
+        """Keep a connection for reuse, or close it if enough are idle."""
+
+        conns = self._idle.setdefault(key, [])
+        if len(conns) < self.MaxIdle:
+            conns.append(conn)
+        else:
+            conn[1].close()
+
+    async def _connect(self, key):
+        """Return a new (reader, writer) connection to a host."""
+
+        (scheme, host, port) = key
+        context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            context = self._ssl_context
+        self.connects += 1
+        return await asyncio.wait_for(asyncio.open_connection(host, port,
+                                                              ssl=context),
+                                      self.timeout)
+
+    async def _exchange(self, conn, key, path, headers):
+        """Send a GET on a connection and read the response.
+
+        Returns (status, headers, data, keep_alive).
+        """
+
+        (reader, writer) = conn
+        (scheme, host, port) = key
+        if port != (443 if scheme == 'https' else 80):
+            host = '%s:%d' % (host, port)
+
+        lines = ['GET %s HTTP/1.1' % path, 'Host: %s' % host,
+                 'Accept-Encoding: identity']
+        lines.extend('%s: %s' % item for item in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected('Remote end closed connection '
+                                                 'without response')
+        try:
+            (version, status) = status_line.split(None, 2)[:2]
+            status = int(status)
+        except ValueError:
+            raise http.client.BadStatusLine(str(status_line))
+
+        header_lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            header_lines.append(line)
+        info = http.client.parse_headers(io.BytesIO(b''.join(header_lines)
+                                                    + b'\r\n'))
+
+        keep_alive = (version == b'HTTP/1.1'
+                      and info.get('Connection', '').lower() != 'close')
+        length = info.get('Content-Length')
+        if status in (204, 304) or 100 <= status < 200:
+            data = b''
+        elif 'chunked' in info.get('Transfer-Encoding', '').lower():
+            data = await self._read_chunked(reader)
+        elif length is not None:
+            data = await reader.readexactly(int(length))
+        else:
+            # body ends when the server closes the connection
+            data = await reader.read()
+            keep_alive = False
+
+        return (status, info, data, keep_alive)
+
+    @staticmethod
+    async def _read_chunked(reader):
+        """Return the body of a chunked response."""
+
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b';', 1)[0], 16)
+            if size == 0:
+                # skip any trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+
+# the engine shared by all tile sources
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Return the shared FetchEngine, starting it if required."""
+
+    global _engine
+
+    with _engine_lock:
+        if _engine is None:
+            _engine = FetchEngine()
+        return _engine
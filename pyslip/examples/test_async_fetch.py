@@ -0,0 +1,185 @@
+"""
+Test the asyncio tile fetch engine against a local HTTP server.
+"""
+
+import queue
+import threading
+import unittest
+import pyslip.async_fetch as async_fetch
+import pyslip.rate_limit as rate_limit
+import pyslip.server_balance as server_balance
+from tile_server import TileServer
+
+
+class TestAsyncFetch(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = async_fetch.FetchEngine()
+        self.servers = []
+
+    def tearDown(self):
+        self.engine.close()
+        for server in self.servers:
+            server.stop()
+
+    def start_server(self, delay=0.0):
+        """Start a local tile server, return (server, URL)."""
+
+        server = TileServer(delay)
+        self.servers.append(server)
+        return (server, server.start())
+
+    def fetch(self, url_path, keys, servers, server_requests=2,
+              balancer=None):
+        """Fetch 'keys' through a new source, return {key: result}."""
+
+        results = {}
+        finished = threading.Event()
+
+        def done(key, server, status, info, data, exception, elapsed):
+            results[key] = (server, status, info, data, exception)
+            if len(results) == len(keys):
+                finished.set()
+
+        requests = queue.Queue()
+        source = self.engine.add_source(requests, servers, url_path, done,
+                                        lambda key: {'User-Agent': 'test'},
+                                        server_requests, balancer)
+        for key in keys:
+            requests.put(key)
+            source.wake()
+        self.assertTrue(finished.wait(10))
+        requests.join()
+        source.close()
+        return results
+
+    def test_fetch(self):
+        """Check tiles are fetched over reused connections."""
+
+        (server, url) = self.start_server()
+        keys = [(2, x, y) for x in range(4) for y in range(4)]
+        results = self.fetch('/{Z}/{X}/{Y}.png', keys, [url])
+        for (key, (_, status, info, data, exception)) in results.items():
+            self.assertEqual(exception, None)
+            self.assertEqual(status, 200)
+            self.assertEqual(info.get_content_type(), 'image/png')
+            self.assertEqual(data, b'/%d/%d/%d.png' % key)
+        self.assertTrue(server.connections <= 2)
+
+    def test_responses(self):
+        """Check chunked, error and connection closing responses."""
+
+        (server, url) = self.start_server()
+        results = self.fetch('/chunked/{Z}/{X}/{Y}.png', [(1, 0, 1)], [url])
+        self.assertEqual(results[(1, 0, 1)][3], b'/chunked/1/0/1.png')
+
+        results = self.fetch('/missing/{Z}/{X}/{Y}.png', [(1, 0, 1)], [url])
+        self.assertEqual(results[(1, 0, 1)][1], 404)
+
+        connections = server.connections
+        keys = [(3, x, 0) for x in range(4)]
+        results = self.fetch('/close/{Z}/{X}/{Y}.png', keys, [url], 1)
+        self.assertEqual([results[k][1] for k in keys], [200]*4)
+        # the first reuses the idle connection, the others need new ones
+        self.assertEqual(server.connections - connections, 3)
+
+        # a server that isn't there gives an exception
+        results = self.fetch('/{Z}/{X}/{Y}.png', [(0, 0, 0)],
+                             ['http://127.0.0.1:1'])
+        self.assertTrue(isinstance(results[(0, 0, 0)][4], OSError))
+
+    def test_host_limit(self):
+        """Check concurrent requests to one host are limited over sources."""
+
+        (server, url) = self.start_server(delay=0.05)
+        self.engine.set_host_limit(url, 3)
+        keys = [(4, x, 0) for x in range(12)]
+        results = {}
+
+        def fetch(path):
+            results[path] = self.fetch(path, keys, [url, url], 4)
+
+        threads = [threading.Thread(target=fetch, args=(path,))
+                   for path in ('/a/{Z}/{X}/{Y}.png', '/b/{Z}/{X}/{Y}.png')]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(server.max_in_flight, 3)
+
+    def test_throttle(self):
+        """Check a server throttle limits the request coroutines."""
+
+        (server, url) = self.start_server(delay=0.02)
+        throttle = rate_limit.ServerThrottle(2)
+        keys = [(5, x, 0) for x in range(8)]
+        balancer = server_balance.ServerBalancer([url], {url: throttle})
+        results = self.fetch('/{Z}/{X}/{Y}.png', keys, [url], 4, balancer)
+        self.assertEqual([results[k][1] for k in keys], [200]*8)
+        self.assertEqual(server.max_in_flight, 2)
+
+        # idle request coroutines don't hold a slot
+        self.assertEqual(throttle.in_flight, 0)
+        self.assertEqual(balancer.info()[url]['in_flight'], 0)
+
+    def test_balance(self):
+        """Check most requests go to the faster server."""
+
+        (_, fast) = self.start_server(delay=0.005)
+        (_, slow) = self.start_server(delay=0.1)
+        keys = [(6, x, 0) for x in range(40)]
+        results = self.fetch('/{Z}/{X}/{Y}.png', keys, [slow, fast], 1)
+        servers = [results[k][0] for k in keys]
+        self.assertTrue(servers.count(fast) > 3*servers.count(slow),
+                        (servers.count(fast), servers.count(slow)))
+
+    def test_errors(self):
+        """Check failing header and done functions don't stop fetching."""
+
+        (server, url) = self.start_server()
+        balancer = server_balance.ServerBalancer([url])
+        keys = [(7, x, 0) for x in range(6)]
+        results = {}
+        finished = threading.Event()
+
+        def headers(key):
+            if key[1] == 1:
+                raise ValueError('no headers')
+            return {}
+
+        def done(key, server, status, info, data, exception, elapsed):
+            results[key] = (status, exception)
+            if len(results) == len(keys):
+                finished.set()
+            if key[1] == 2:
+                raise ValueError('bad tile')
+
+        # one request coroutine, so it must survive the errors
+        requests = queue.Queue()
+        source = self.engine.add_source(requests, [url], '/{Z}/{X}/{Y}.png',
+                                        done, headers, 1, balancer)
+        for key in keys:
+            requests.put(key)
+            source.wake()
+        self.assertTrue(finished.wait(10))
+        requests.join()
+        source.close()
+
+        self.assertEqual(results[(7, 1, 0)][0], None)
+        self.assertTrue(isinstance(results[(7, 1, 0)][1], ValueError))
+        self.assertEqual([results[k][0] for k in keys if k[1] != 1], [200]*5)
+        self.assertEqual(balancer.info()[url]['in_flight'], 0)
+
+    def test_shared_engine(self):
+        """Check all users get the same engine."""
+
+        self.assertTrue(async_fetch.get_engine() is async_fetch.get_engine())
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestAsyncFetch, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,249 @@
+"""
+Test hedging slow tile requests with a request to another server.
+"""
+
+import queue
+import itertools
+import threading
+import unittest
+import importlib.util
+import concurrent.futures
+import pyslip.hedge as hedge
+import pyslip.http_pool as http_pool
+import pyslip.rate_limit as rate_limit
+import pyslip.async_fetch as async_fetch
+import pyslip.server_balance as server_balance
+from tile_server import TileServer
+
+
+# the TileWorker threads are in tiles_net, which needs wxPython
+HaveWx = importlib.util.find_spec('wx') is not None
+
+
+def slow_every(num):
+    """Return a TileServer delay function slow for every 'num'th request."""
+
+    requests = itertools.count(1)
+    return lambda path: 0.5 if next(requests) % num == 0 else 0.01
+
+
+class TestHedge(unittest.TestCase):
+
+    def test_delay(self):
+        """Check the hedge delay is the percentile of recent latencies."""
+
+        policy = hedge.HedgePolicy(percentile=90)
+        for i in range(policy.MinSamples - 1):
+            policy.observe(0.1)
+        self.assertEqual(policy.start(), None)
+
+        policy = hedge.HedgePolicy(percentile=90)
+        for i in range(100):
+            policy.observe(i / 100)
+        self.assertAlmostEqual(policy.start(), 0.89)
+
+        # only recent latencies count
+        for i in range(policy.Window):
+            policy.observe(1.0)
+        self.assertEqual(policy.start(), 1.0)
+
+        policy = hedge.HedgePolicy()
+        for i in range(policy.MinSamples):
+            policy.observe(0.0)
+        self.assertEqual(policy.start(), policy.MinDelay)
+
+    def test_budget(self):
+        """Check hedged requests are limited to the budget."""
+
+        policy = hedge.HedgePolicy(budget=0.1)
+        hedged = 0
+        for i in range(1000):
+            policy.start()
+            if policy.try_hedge():
+                hedged += 1
+        self.assertEqual(hedged, 100)
+
+        policy.won()
+        info = policy.info()
+        self.assertEqual((info['requests'], info['hedges'], info['wins']),
+                         (1000, 100, 1))
+
+        # a hedge not sent goes back to the budget
+        policy.cancel()
+        self.assertTrue(policy.try_hedge())
+        self.assertFalse(policy.try_hedge())
+
+    def setUp(self):
+        self.servers = [TileServer(slow_every(3)), TileServer(0.01)]
+        self.urls = [server.start() for server in self.servers]
+        self.keys = [(1, x, 0) for x in range(40)]
+        self.results = {}
+        self.finished = threading.Event()
+
+        # each server is throttled, as in a tile source
+        self.throttles = {url: rate_limit.ServerThrottle(2, rate=100, burst=20)
+                              for url in self.urls}
+        self.balancer = server_balance.ServerBalancer(self.urls,
+                                                      self.throttles)
+
+        # keep using the slow server so it gets slow requests to hedge
+        self.balancer.SlowFactor = 1000
+        self.policy = hedge.HedgePolicy(percentile=50, budget=0.5)
+        self.policy.MinSamples = 4
+
+    def tearDown(self):
+        for server in self.servers:
+            server.stop()
+
+    def done(self, key, server, status, info, data, exception, elapsed):
+        self.results[key] = (server, status, data, elapsed)
+        if len(self.results) == len(self.keys):
+            self.finished.set()
+
+    def check_results(self):
+        """Check the tiles were fetched and slow requests hedged."""
+
+        for (key, (server, status, data, elapsed)) in self.results.items():
+            self.assertEqual(status, 200)
+            self.assertEqual(data, b'/%d/%d/%d.png' % key)
+
+        # some slow requests were beaten by their hedge
+        info = self.policy.info()
+        self.assertTrue(info['hedges'] > 0, info)
+        self.assertTrue(info['wins'] > 0, info)
+        self.assertTrue(info['hedges'] <= 0.5 * info['requests'], info)
+
+        # nothing is left holding a server
+        for server_info in self.balancer.info().values():
+            self.assertEqual(server_info['in_flight'], 0)
+        for throttle in self.throttles.values():
+            self.assertEqual(throttle.in_flight, 0)
+
+    def test_fetch(self):
+        """Check the async engine hedges slow requests."""
+
+        engine = async_fetch.FetchEngine()
+        requests = queue.Queue()
+        source = engine.add_source(requests, self.urls, '/{Z}/{X}/{Y}.png',
+                                   self.done, server_requests=2,
+                                   balancer=self.balancer, hedge=self.policy)
+        try:
+            for key in self.keys:
+                requests.put(key)
+            source.wake()
+            self.assertTrue(self.finished.wait(30))
+            requests.join()
+        finally:
+            engine.close()
+
+        self.check_results()
+
+    @unittest.skipUnless(HaveWx, 'needs wxPython for tiles_net')
+    def test_threads(self):
+        """Check TileWorker threads hedge slow requests."""
+
+        import pyslip.tiles_net as tiles_net
+
+        pools = {url: http_pool.ConnectionPool(url, max_idle=2)
+                     for url in self.urls}
+        executor = concurrent.futures.ThreadPoolExecutor(12)
+        requests = queue.Queue()
+        for num in range(4):
+            worker = tiles_net.TileWorker(num, self.balancer,
+                                          '/{Z}/{X}/{Y}.png', requests,
+                                          self.done, None, 'image/png', None,
+                                          None, lambda key: {}, pools,
+                                          self.policy, executor)
+            worker.start()
+        try:
+            for key in self.keys:
+                requests.put(key)
+            self.assertTrue(self.finished.wait(30))
+            requests.join()
+        finally:
+            executor.shutdown()
+            for pool in pools.values():
+                pool.close()
+
+        self.check_results()
+
+    def fail_fast(self):
+        """Make the hedge server fail fast while the first server is slow.
+
+        Returns the URL of the slow server the request goes to first.
+        """
+
+        for server in self.servers:
+            server.stop()
+        self.servers = [TileServer(0.5), TileServer(0.0, status=503)]
+        self.urls = [server.start() for server in self.servers]
+        self.keys = [(1, 0, 0)]
+        self.throttles = {url: rate_limit.ServerThrottle(2) for url in self.urls}
+        self.balancer = server_balance.ServerBalancer(self.urls, self.throttles)
+
+        # hedge any request after the shortest delay
+        self.policy = hedge.HedgePolicy(budget=1.0)
+        self.policy.MinSamples = 1
+        self.policy.observe(0.0)
+        return self.urls[0]
+
+    def check_slow_success(self, slow_url):
+        """Check the slow tile beat the fast failure of the hedge."""
+
+        (server, status, data, elapsed) = self.results[(1, 0, 0)]
+        self.assertEqual((server, status, data), (slow_url, 200, b'/1/0/0.png'))
+        info = self.policy.info()
+        self.assertEqual((info['hedges'], info['wins']), (1, 0))
+        self.assertEqual(self.servers[1].requests, 1)
+
+    def test_fetch_failed_hedge(self):
+        """Check the async engine waits for a good response to a hedge."""
+
+        slow_url = self.fail_fast()
+        engine = async_fetch.FetchEngine()
+        requests = queue.Queue()
+        source = engine.add_source(requests, self.urls, '/{Z}/{X}/{Y}.png',
+                                   self.done, server_requests=1,
+                                   balancer=self.balancer, hedge=self.policy)
+        try:
+            requests.put((1, 0, 0))
+            source.wake()
+            self.assertTrue(self.finished.wait(10))
+            requests.join()
+        finally:
+            engine.close()
+
+        self.check_slow_success(slow_url)
+
+    @unittest.skipUnless(HaveWx, 'needs wxPython for tiles_net')
+    def test_threads_failed_hedge(self):
+        """Check TileWorker threads wait for a good response to a hedge."""
+
+        import pyslip.tiles_net as tiles_net
+
+        slow_url = self.fail_fast()
+        pools = {url: http_pool.ConnectionPool(url) for url in self.urls}
+        executor = concurrent.futures.ThreadPoolExecutor(2)
+        requests = queue.Queue()
+        worker = tiles_net.TileWorker(0, self.balancer, '/{Z}/{X}/{Y}.png',
+                                      requests, self.done, None, 'image/png',
+                                      None, None, lambda key: {}, pools,
+                                      self.policy, executor)
+        worker.start()
+        try:
+            requests.put((1, 0, 0))
+            self.assertTrue(self.finished.wait(10))
+            requests.join()
+        finally:
+            executor.shutdown()
+            for pool in pools.values():
+                pool.close()
+
+        self.check_slow_success(slow_url)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestHedge, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
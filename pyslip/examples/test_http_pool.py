@@ -0,0 +1,121 @@
+"""
+Test the keep-alive HTTP connection pool.
+
+Also benchmarks fetching tiles from a local HTTP server with a new
+connection per tile (urllib.request.urlopen) against the pool.
+"""
+
+import time
+import threading
+import unittest
+import urllib.request
+import pyslip.http_pool as http_pool
+from tile_server import TileServer
+
+
+# the fake tile returned by the test server
+TileData = b'\x89PNG' + b'x' * 20000
+
+
+class TestHTTPPool(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TileServer(data=TileData)
+        self.url = self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_reuse(self):
+        """Check many requests share one connection."""
+
+        pool = http_pool.ConnectionPool(self.url)
+        for i in range(20):
+            (status, info, data) = pool.request('/0/0/%d.png' % i)
+            self.assertEqual(status, 200)
+            self.assertEqual(info.get_content_type(), 'image/png')
+            self.assertEqual(data, TileData)
+        self.assertEqual(pool.connects, 1)
+        self.assertEqual(self.server.connections, 1)
+
+        (status, _, data) = pool.request('/missing.png')
+        self.assertEqual(status, 404)
+        self.assertEqual(data, b'')
+        self.assertEqual(pool.connects, 1)
+        pool.close()
+
+    def test_reconnect(self):
+        """Check a connection closed by the server is replaced."""
+
+        pool = http_pool.ConnectionPool(self.url)
+        (status, _, _) = pool.request('/close/0/0/0.png')
+        self.assertEqual(status, 200)
+        (status, _, data) = pool.request('/0/0/0.png')
+        self.assertEqual(status, 200)
+        self.assertEqual(data, TileData)
+        self.assertEqual(pool.connects, 2)
+
+        # an idle connection the server dropped is retried
+        pool.request('/drop/0/0/1.png')
+        time.sleep(0.1)
+        (status, _, data) = pool.request('/0/0/1.png')
+        self.assertEqual(status, 200)
+        self.assertEqual(data, TileData)
+        self.assertEqual(pool.connects, 3)
+        pool.close()
+
+    def test_bad_url(self):
+        """Check only http and https servers are accepted."""
+
+        with self.assertRaises(ValueError):
+            http_pool.ConnectionPool('ftp://tiles.example.com')
+
+    def test_benchmark(self):
+        """Compare tiles/second for urlopen() and the pool from 4 threads."""
+
+        NumThreads = 4
+        NumTiles = 200
+
+        def run(fetch):
+            def worker():
+                for i in range(NumTiles // NumThreads):
+                    fetch('/1/0/%d.png' % i)
+            threads = [threading.Thread(target=worker)
+                       for _ in range(NumThreads)]
+            start = time.time()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            return NumTiles / (time.time() - start)
+
+        def fetch_urlopen(path):
+            with urllib.request.urlopen(self.url + path) as response:
+                response.read()
+
+        pool = http_pool.ConnectionPool(self.url, max_idle=NumThreads)
+
+        def fetch_pool(path):
+            pool.request(path)
+
+        before = self.server.connections
+        urlopen_rate = run(fetch_urlopen)
+        urlopen_connects = self.server.connections - before
+        before = self.server.connections
+        pool_rate = run(fetch_pool)
+        pool_connects = self.server.connections - before
+        pool.close()
+
+        print('urlopen: %.0f tiles/s, %d connections; '
+              'pool: %.0f tiles/s, %d connections'
+              % (urlopen_rate, urlopen_connects, pool_rate, pool_connects))
+        self.assertEqual(urlopen_connects, NumTiles)
+        self.assertTrue(pool_connects <= NumThreads)
+        self.assertTrue(pool_rate > urlopen_rate)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestHTTPPool, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,124 @@
+"""
+Test and benchmark converting many geo points to view coordinates at once.
+
+The array conversion needs NumPy, the tests are skipped if it isn't
+installed.  Tile sources and the widget are made without running their
+__init__() as only the coordinate conversion is used, so no tiles or
+wxPython application are needed.
+"""
+
+import math
+import time
+import unittest
+import pyslip
+import pyslip.gmt_local as gmt_local
+import pyslip.open_street_map as open_street_map
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def osm_tiles(level):
+    """Return an OSM tile source that can only convert coordinates."""
+
+    tiles = object.__new__(open_street_map.Tiles)
+    tiles.level = level
+    tiles.tile_size_x = tiles.tile_size_y = 256
+    return tiles
+
+
+def gmt_tiles():
+    """Return a GMT tile source that can only convert coordinates."""
+
+    tiles = object.__new__(gmt_local.Tiles)
+    tiles.extent = (-65.0, 295.0, -66.0, 66.0)
+    tiles.ppd_x = tiles.ppd_y = 12.8
+    tiles.tile_size_x = tiles.tile_size_y = 256
+    return tiles
+
+
+def view(tiles, offset_x, offset_y):
+    """Return a pySlip widget with a 800x600 view at the given offset."""
+
+    widget = object.__new__(pyslip.pySlip)
+    widget.tile_src = tiles
+    widget.view_offset_x = offset_x
+    widget.view_offset_y = offset_y
+    widget.view_width = 800
+    widget.view_height = 600
+    return widget
+
+
+def coastline(num_points):
+    """Return a wiggly line of geo points across western Europe."""
+
+    return [(-10.0 + 20.0*i/num_points, 50.0 + 2.0*math.sin(i/50))
+                for i in range(num_points)]
+
+
+@unittest.skipUnless(numpy is not None, 'needs NumPy')
+class TestProjection(unittest.TestCase):
+
+    def test_tiles(self):
+        """Check tile sources convert arrays as they convert points."""
+
+        geos = [(lon, lat) for lon in range(-180, 181, 15)
+                               for lat in range(-80, 81, 10)]
+        for tiles in [osm_tiles(level) for level in (0, 5, 17)] + [gmt_tiles()]:
+            tile = tiles.Geo2TileArray(numpy.array(geos, dtype=float))
+            self.assertEqual(tile.shape, (len(geos), 2))
+            for (geo, xy) in zip(geos, tile.tolist()):
+                (x, y) = tiles.Geo2Tile(geo)
+                self.assertAlmostEqual(xy[0], x, places=6)
+                self.assertAlmostEqual(xy[1], y, places=6)
+
+    def test_polygon(self):
+        """Check a long polygon gets the same view points and extent."""
+
+        geos = coastline(1000)
+        widget = view(osm_tiles(6), 7800, 5200)
+        (points, extent) = widget.PexPolygon('nw', geos, 3, 4)
+
+        # the same polygon a point at a time
+        widget.ArrayMinPoints = len(geos) + 1
+        (slow_points, slow_extent) = widget.PexPolygon('nw', geos, 3, 4)
+        self.assertIsNotNone(slow_points)
+        for (p, s) in zip(points, slow_points):
+            self.assertAlmostEqual(p[0], s[0], places=6)
+            self.assertAlmostEqual(p[1], s[1], places=6)
+        for (e, s) in zip(extent, slow_extent):
+            self.assertAlmostEqual(e, s, places=6)
+
+        # off the view either way
+        del widget.ArrayMinPoints
+        widget.view_offset_x = 0
+        self.assertEqual(widget.PexPolygon('nw', geos, 3, 4), (None, None))
+
+    def test_benchmark(self):
+        """Compare converting a 200000 point coastline both ways."""
+
+        geos = coastline(200000)
+        widget = view(osm_tiles(6), 7800, 5200)
+
+        start = time.time()
+        (points, _) = widget.PexPolygon('cc', geos, 0, 0)
+        array_time = time.time() - start
+
+        widget.ArrayMinPoints = len(geos) + 1
+        start = time.time()
+        (slow_points, _) = widget.PexPolygon('cc', geos, 0, 0)
+        point_time = time.time() - start
+
+        self.assertEqual(len(points), len(slow_points))
+        print('\n%d points: per-point %.3fs, array %.3fs (%.1f times faster)'
+              % (len(geos), point_time, array_time, point_time/array_time))
+        self.assertTrue(array_time < point_time)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestProjection, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
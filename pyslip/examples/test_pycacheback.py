@@ -0,0 +1,277 @@
+"""
+Test the pyCacheBack LRU cache.
+
+Also benchmarks the OrderedDict LRU bookkeeping against the previous
+list-based implementation for 1k, 10k and 100k entry caches.
+"""
+
+import sys
+import time
+import random
+import threading
+import unittest
+import pyslip.pycacheback as pycacheback
+
+
+class ListLRUCacheBack(dict):
+    """The previous list-based pyCacheBack, kept for benchmark comparison."""
+
+    def __init__(self, *args, **kwargs):
+        self._lru_list = []
+        self._max_lru = kwargs.pop('max_lru', 1000)
+        super().__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self._reorder_lru(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._reorder_lru(key)
+        self._enforce_lru_size()
+
+    def _reorder_lru(self, key):
+        try:
+            self._lru_list.remove(key)
+        except ValueError:
+            pass
+        self._lru_list.insert(0, key)
+
+    def _enforce_lru_size(self):
+        if self._max_lru and len(self) > self._max_lru:
+            for key in self._lru_list[self._max_lru:]:
+                super().__delitem__(key)
+            self._lru_list = self._lru_list[:self._max_lru]
+
+
+class BackedCache(pycacheback.pyCacheBack):
+    """A pyCacheBack with a dictionary as the backing store."""
+
+    def __init__(self, *args, **kwargs):
+        self.back = {}
+        super().__init__(*args, **kwargs)
+
+    def _put_to_back(self, key, value):
+        self.back[key] = value
+
+    def _get_from_back(self, key):
+        return self.back[key]
+
+
+class TestPyCacheBack(unittest.TestCase):
+
+    def test_lru_limit(self):
+        """Check the in-memory size never exceeds the LRU limit."""
+
+        cache = pycacheback.pyCacheBack(max_lru=10)
+        for i in range(100):
+            cache[i] = i
+            self.assertTrue(len(cache) <= 10)
+        self.assertEqual(sorted(cache.keys()), list(range(90, 100)))
+
+    def test_lru_order(self):
+        """Check the least recently used entry is evicted first."""
+
+        cache = pycacheback.pyCacheBack(max_lru=3)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['c'] = 3
+        cache['a']              # 'b' is now least recently used
+        cache['d'] = 4
+        self.assertFalse('b' in cache)
+        self.assertTrue('a' in cache)
+        self.assertTrue('c' in cache)
+        self.assertTrue('d' in cache)
+
+    def test_delete(self):
+        """Check del, pop, popitem and clear keep the LRU consistent."""
+
+        cache = pycacheback.pyCacheBack(max_lru=3)
+        for key in 'abc':
+            cache[key] = key
+        del cache['a']
+        self.assertEqual(cache.pop('b'), 'b')
+        self.assertEqual(cache.popitem(), ('c', 'c'))
+        self.assertEqual(len(cache._lru), 0)
+        for key in 'defg':
+            cache[key] = key
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(len(cache._lru), 0)
+
+    def test_backing_store(self):
+        """Check evicted entries come back from the backing store."""
+
+        cache = BackedCache(max_lru=2)
+        for i in range(5):
+            cache[i] = i * 10
+        self.assertFalse(0 in cache)
+        self.assertEqual(cache[0], 0)
+        self.assertTrue(0 in cache)
+        self.assertTrue(len(cache) <= 2)
+        with self.assertRaises(KeyError):
+            cache[99]
+
+    def test_byte_budget(self):
+        """Check the byte limit evicts and the usage figures are correct."""
+
+        class SizedCache(pycacheback.pyCacheBack):
+            def _sizeof(self, value):
+                return len(value)
+
+        cache = SizedCache(max_lru=None, max_bytes=100)
+        for i in range(10):
+            cache[i] = 'x' * 30
+        info = cache.info()
+        self.assertEqual(info['entries'], 3)
+        self.assertEqual(info['bytes'], 90)
+        self.assertEqual(info['high_bytes'], 90)
+        self.assertEqual(sorted(cache.keys()), [7, 8, 9])
+
+        # replacing a value changes the size
+        cache[9] = 'x' * 5
+        self.assertEqual(cache.info()['bytes'], 65)
+        del cache[8]
+        self.assertEqual(cache.info()['bytes'], 35)
+
+        # an entry bigger than the budget is kept until the next insert
+        cache['big'] = 'x' * 200
+        self.assertEqual(list(cache.keys()), ['big'])
+        self.assertEqual(cache.info()['high_bytes'], 200)
+
+        cache.set_max_bytes(10)
+        cache['a'] = 'x' * 5
+        cache['b'] = 'x' * 5
+        self.assertEqual(sorted(cache.keys()), ['a', 'b'])
+        self.assertEqual(cache.info()['bytes'], 10)
+
+    def test_stats(self):
+        """Check hit, miss and eviction counting and latency histograms."""
+
+        cache = BackedCache(max_lru=2)
+        for i in range(3):
+            cache[i] = i                # evicts 0
+        cache[1]                        # memory hit
+        cache[0]                        # backing store hit, evicts 2
+        with self.assertRaises(KeyError):
+            cache[99]                   # miss
+
+        snap = cache.stats.snapshot()
+        counters = snap['counters']
+        self.assertEqual(counters['memory_hits'], 1)
+        self.assertEqual(counters['back_hits'], 1)
+        self.assertEqual(counters['misses'], 1)
+        self.assertEqual(counters['evictions'], 2)
+        latency = snap['latency']['get_from_back']
+        self.assertEqual(latency['count'], 1)
+        self.assertEqual(sum(n for (_, n) in latency['buckets']), 1)
+        self.assertEqual(latency['buckets'][-1][0], None)
+
+        # a snapshot is a copy
+        cache[1]
+        self.assertEqual(snap['counters']['memory_hits'], 1)
+
+        cache.stats.reset()
+        snap = cache.stats.snapshot()
+        self.assertEqual(snap['counters'], {})
+        self.assertEqual(snap['latency'], {})
+
+    def test_threads(self):
+        """Hammer one cache from many threads, then check it's consistent."""
+
+        NumThreads = 16
+        Loops = 5000
+
+        class SizedBackedCache(BackedCache):
+            def _sizeof(self, value):
+                return value[1]
+
+        cache = SizedBackedCache(max_lru=200, max_bytes=5000)
+        errors = []
+
+        def hammer(tid):
+            rand = random.Random(tid)
+            try:
+                for i in range(Loops):
+                    key = rand.randrange(500)
+                    op = rand.random()
+                    if op < 0.5:
+                        try:
+                            value = cache[key]
+                            if value[0] != key:
+                                errors.append('key %d got value %s' % (key, value))
+                        except KeyError:
+                            pass
+                    elif op < 0.9:
+                        cache[key] = (key, rand.randrange(1, 50))
+                    elif op < 0.95:
+                        cache.pop(key, None)
+                    else:
+                        cache.info()
+            except Exception as e:
+                errors.append('%s: %s' % (type(e).__name__, str(e)))
+
+        # switch threads often to shake out races
+        old_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=hammer, args=(tid,))
+                       for tid in range(NumThreads)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            sys.setswitchinterval(old_interval)
+
+        self.assertEqual(errors, [])
+        info = cache.info()
+        self.assertEqual(set(cache.keys()), set(cache._lru.keys()))
+        self.assertEqual(info['entries'], len(cache))
+        self.assertTrue(info['entries'] <= 200)
+        self.assertTrue(info['bytes'] <= 5000)
+        self.assertEqual(info['bytes'],
+                         sum(dict.__getitem__(cache, k)[1] for k in cache.keys()))
+
+    def test_benchmark(self):
+        """Time LRU hits and inserts against the old list implementation."""
+
+        Lookups = 2000
+
+        for size in (1000, 10000, 100000):
+            results = []
+            for klass in (ListLRUCacheBack, pycacheback.pyCacheBack):
+                cache = klass(max_lru=size)
+                for i in range(size):
+                    dict.__setitem__(cache, i, i)
+                if klass is ListLRUCacheBack:
+                    cache._lru_list = list(reversed(range(size)))
+                else:
+                    cache._lru.update((i, 0) for i in range(size))
+
+                # hits on the least recently used end, then inserts
+                # that each force an eviction
+                start = time.time()
+                for i in range(Lookups):
+                    cache[i % size]
+                for i in range(Lookups):
+                    cache[size + i] = i
+                results.append(time.time() - start)
+
+            (list_delta, odict_delta) = results
+            print('%6d entries: list=%.4fs, ordereddict=%.4fs (%.1f times faster)'
+                  % (size, list_delta, odict_delta,
+                     list_delta / max(odict_delta, 1e-9)))
+            if size >= 10000:
+                msg = ('OrderedDict LRU is slower than list LRU for %d entries?\n'
+                       'list=%.4fs, ordereddict=%.4fs'
+                       % (size, list_delta, odict_delta))
+                self.assertTrue(odict_delta < list_delta, msg)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestPyCacheBack, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,171 @@
+"""
+Test the per-server request throttle.
+"""
+
+import time
+import threading
+import unittest
+import email.utils
+import http.client
+import pyslip.rate_limit as rate_limit
+
+
+def headers(**kwargs):
+    """Return an HTTPMessage with the given headers."""
+
+    msg = http.client.HTTPMessage()
+    for (name, value) in kwargs.items():
+        msg[name.replace('_', '-')] = value
+    return msg
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_outcome(self):
+        """Check responses are sorted into outcomes."""
+
+        self.assertEqual(rate_limit.outcome(200, None), rate_limit.OK)
+        self.assertEqual(rate_limit.outcome(304, None), rate_limit.OK)
+        self.assertEqual(rate_limit.outcome(404, None), rate_limit.OK)
+        self.assertEqual(rate_limit.outcome(429, None), rate_limit.Throttled)
+        self.assertEqual(rate_limit.outcome(503, None), rate_limit.Throttled)
+        self.assertEqual(rate_limit.outcome(502, None), rate_limit.Failed)
+        self.assertEqual(rate_limit.outcome(None, OSError()), rate_limit.Failed)
+
+    def test_retry_after(self):
+        """Check Retry-After seconds and dates are understood."""
+
+        now = time.time()
+        self.assertEqual(rate_limit.retry_after(None, now), None)
+        self.assertEqual(rate_limit.retry_after(headers(), now), None)
+        self.assertEqual(rate_limit.retry_after(headers(Retry_After='7'), now),
+                         7.0)
+        date = email.utils.formatdate(now + 30, usegmt=True)
+        wait = rate_limit.retry_after(headers(Retry_After=date), now)
+        self.assertTrue(28 < wait <= 30)
+        self.assertEqual(rate_limit.retry_after(headers(Retry_After='soon'),
+                                                now), None)
+
+    def test_token_bucket(self):
+        """Check the bucket allows a burst then the rate."""
+
+        bucket = rate_limit.TokenBucket(10, 3)
+        now = bucket._last
+        self.assertEqual([bucket.take(now) for _ in range(3)], [0.0]*3)
+        self.assertAlmostEqual(bucket.take(now), 0.1)
+        self.assertEqual(bucket.take(now + 0.15), 0.0)
+        self.assertAlmostEqual(bucket.take(now + 0.15), 0.05)
+
+        # an idle time refills no more than the burst
+        self.assertEqual([bucket.take(now + 100) for _ in range(3)], [0.0]*3)
+        self.assertTrue(bucket.take(now + 100) > 0.0)
+
+    def test_concurrency(self):
+        """Check the concurrency limit halves and recovers."""
+
+        throttle = rate_limit.ServerThrottle(8)
+        now = time.monotonic()
+        for _ in range(8):
+            self.assertEqual(throttle.try_acquire(now), 0.0)
+        self.assertEqual(throttle.try_acquire(now), None)
+
+        throttle.release(rate_limit.Throttled)
+        self.assertEqual(throttle.limit, 4)
+        throttle.release(rate_limit.Throttled)
+        self.assertEqual(throttle.limit, 2)
+        for _ in range(6):
+            throttle.release(rate_limit.Throttled)
+        self.assertEqual(throttle.limit, 1)
+        self.assertEqual(throttle.in_flight, 0)
+
+        # each round of good requests allows one more
+        throttle.backoff_until = 0.0
+        limits = []
+        for _ in range(30):
+            self.assertEqual(throttle.try_acquire(), 0.0)
+            throttle.release(rate_limit.OK)
+            limits.append(throttle.limit)
+        self.assertEqual(limits[:6], [2, 2, 3, 3, 3, 4])
+        self.assertEqual(limits[-1], 8)
+
+    def test_backoff(self):
+        """Check failures back off exponentially with jitter."""
+
+        throttle = rate_limit.ServerThrottle(2)
+        delays = []
+        for _ in range(4):
+            throttle.try_acquire(0.0)
+            throttle.backoff_until = 0.0
+            start = time.monotonic()
+            throttle.release(rate_limit.Failed)
+            delays.append(throttle.backoff_until - start)
+        for (i, delay) in enumerate(delays):
+            limit = throttle.BaseBackoff * 2**i
+            self.assertTrue(limit / 2 <= delay <= limit + 0.01, delays)
+        self.assertTrue(throttle.try_acquire() > 0.0)
+
+        # a failure doesn't shrink the concurrency, an overload does
+        self.assertEqual(throttle.limit, 2)
+
+        # a good request resets the backoff
+        throttle.backoff_until = 0.0
+        throttle.try_acquire()
+        throttle.release(rate_limit.OK)
+        self.assertEqual(throttle.failures, 0)
+
+        # the server's Retry-After is respected, up to MaxBackoff
+        start = time.monotonic()
+        throttle.release(rate_limit.Throttled, retry_after=10)
+        self.assertTrue(10 <= throttle.backoff_until - start < 10.1)
+        throttle.release(rate_limit.Throttled, retry_after=1.0e6)
+        self.assertTrue(throttle.backoff_until - start
+                            <= throttle.MaxBackoff + 0.1)
+
+    def run_threads(self, throttle, work_time):
+        """Make 60 requests from 6 threads, return (max_in_flight, seconds)."""
+
+        lock = threading.Lock()
+        counts = {'in_flight': 0, 'max_in_flight': 0, 'requests': 0}
+
+        def work():
+            for _ in range(10):
+                throttle.acquire()
+                with lock:
+                    counts['in_flight'] += 1
+                    counts['requests'] += 1
+                    counts['max_in_flight'] = max(counts['max_in_flight'],
+                                                  counts['in_flight'])
+                time.sleep(work_time)
+                with lock:
+                    counts['in_flight'] -= 1
+                throttle.release(rate_limit.OK)
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(counts['requests'], 60)
+        self.assertEqual(throttle.in_flight, 0)
+        return (counts['max_in_flight'], time.monotonic() - start)
+
+    def test_acquire(self):
+        """Check acquire() blocks threads to the limit and rate."""
+
+        (max_in_flight, _) = self.run_threads(rate_limit.ServerThrottle(3),
+                                              0.01)
+        self.assertEqual(max_in_flight, 3)
+
+        # 60 requests at 100 a second, after the first
+        throttle = rate_limit.ServerThrottle(6, rate=100, burst=1)
+        (_, elapsed) = self.run_threads(throttle, 0.0)
+        self.assertTrue(elapsed >= 0.55, elapsed)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestRateLimit, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,133 @@
+"""
+Test the expiry of server tiles after fetching and revalidating them.
+
+The cache and tiles_net need wxPython, the tests are skipped if it isn't
+installed.
+"""
+
+import time
+import shutil
+import tempfile
+import unittest
+import importlib.util
+import email.message
+import email.utils
+
+
+HaveWx = importlib.util.find_spec('wx') is not None
+
+
+def headers(**kwargs):
+    """Return response headers, keyword '_' becomes '-' in header names."""
+
+    info = email.message.Message()
+    for (name, value) in kwargs.items():
+        info[name.replace('_', '-')] = value
+    return info
+
+
+@unittest.skipUnless(HaveWx, 'needs wxPython for tiles and tiles_net')
+class TestRevalidate(unittest.TestCase):
+
+    def setUp(self):
+        import pyslip.tiles as tiles
+        import pyslip.tiles_net as tiles_net
+
+        self.tiles_net = tiles_net
+        self.floor = tiles_net.MinFreshSeconds
+        self.tiles_dir = tempfile.mkdtemp()
+        self.cache = tiles.Cache(tiles_dir=self.tiles_dir, max_lru=10)
+        self.key = (3, 1, 2)
+        self.cache._store.write_batch([(self.key, b'tile', time.time() - 10)])
+
+    def tearDown(self):
+        self.cache.close()
+        self.cache._store.close()
+        shutil.rmtree(self.tiles_dir)
+
+    def check_expires(self, validators, expected, now):
+        """Check an expiry is 'expected' seconds after 'now'."""
+
+        self.assertAlmostEqual(validators['expires'], now + expected, places=3)
+
+    def test_max_age(self):
+        """Check max-age gives the expiry and is kept."""
+
+        now = time.time()
+        validators = self.tiles_net.response_validators(
+                            headers(Cache_Control='max-age=3600'), now)
+        self.check_expires(validators, 3600, now)
+        self.assertEqual(validators['max_age'], 3600)
+
+    def test_floor(self):
+        """Check tiles the server won't have kept still stay fresh a while."""
+
+        now = time.time()
+        past = email.utils.formatdate(now - 1000, usegmt=True)
+        for info in (headers(Cache_Control='max-age=0'),
+                     headers(Cache_Control='no-cache'),
+                     headers(Cache_Control='private, no-store'),
+                     headers(Expires=past),
+                     headers(Expires='not a date')):
+            validators = self.tiles_net.response_validators(info, now)
+            self.check_expires(validators, self.floor, now)
+
+    def test_not_modified(self):
+        """Check a 304 without expiry headers reuses the saved max-age."""
+
+        now = time.time()
+        saved = {'etag': '"a"', 'expires': now - 100, 'max_age': 3600}
+        validators = self.tiles_net.response_validators(headers(), now, saved)
+        self.check_expires(validators, 3600, now)
+
+        # new headers win over the saved max-age
+        validators = self.tiles_net.response_validators(
+                            headers(Cache_Control='max-age=60'), now, saved)
+        self.check_expires(validators, self.floor, now)
+        future = email.utils.formatdate(now + 7200, usegmt=True)
+        validators = self.tiles_net.response_validators(headers(Expires=future),
+                                                        now, saved)
+        self.assertEqual(validators['max_age'], None)
+        self.assertAlmostEqual(validators['expires'], now + 7200, delta=1)
+
+        # no expiry anywhere
+        validators = self.tiles_net.response_validators(headers(), now,
+                                                        {'etag': '"a"'})
+        self.assertEqual(validators['expires'], None)
+
+    def test_revalidated(self):
+        """Check revalidating replaces a passed expiry."""
+
+        now = time.time()
+        self.cache._store.set_validators([(self.key,
+                                           {'etag': '"a"', 'last_modified': 'x',
+                                            'expires': now - 100,
+                                            'max_age': 3600})])
+        self.cache._remember_expires(self.key, now - 100)
+
+        # recomputed from the saved max-age, the ETag is kept
+        saved = self.cache.tile_validators(self.key)
+        self.cache.revalidated(self.key, self.tiles_net.response_validators(
+                                                    headers(), now, saved))
+        self.assertAlmostEqual(self.cache.tile_expires(self.key), now + 3600,
+                               places=3)
+        validators = self.cache._store.get_validators(self.key)
+        self.assertEqual(validators['etag'], '"a"')
+        self.assertEqual(validators['last_modified'], 'x')
+        self.assertAlmostEqual(validators['expires'], now + 3600, places=3)
+
+        # no expiry at all, the tile ages by its fetch date
+        self.cache.revalidated(self.key, {'etag': None, 'last_modified': None,
+                                          'expires': None, 'max_age': None})
+        self.assertEqual(self.cache.tile_expires(self.key), None)
+        validators = self.cache._store.get_validators(self.key)
+        self.assertEqual(validators['etag'], '"a"')
+        self.assertEqual(validators['expires'], None)
+        self.assertTrue(self.cache.fetch_date(self.key) >= now)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestRevalidate, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,130 @@
+"""
+Test sharing tile requests over servers by server health.
+"""
+
+import time
+import unittest
+import pyslip.rate_limit as rate_limit
+import pyslip.server_balance as server_balance
+
+
+class TestServerBalance(unittest.TestCase):
+
+    def request(self, balancer, latencies, result=rate_limit.OK):
+        """Make one request, return the server used."""
+
+        server = balancer.acquire()
+        balancer.release(server, result, latencies[server])
+        return server
+
+    def test_latency(self):
+        """Check requests go to the server with the lowest latency."""
+
+        balancer = server_balance.ServerBalancer(['a', 'b', 'c'])
+        latencies = {'a': 0.3, 'b': 0.05, 'c': 0.1}
+
+        # each server is tried before it has a latency
+        first = [self.request(balancer, latencies) for _ in range(3)]
+        self.assertEqual(sorted(first), ['a', 'b', 'c'])
+
+        servers = [self.request(balancer, latencies) for _ in range(20)]
+        self.assertEqual(servers, ['b']*20)
+
+        # the average follows a change in latency
+        latencies['b'] = 0.5
+        servers = [self.request(balancer, latencies) for _ in range(20)]
+        self.assertEqual(servers[-1], 'c')
+
+    def test_busy(self):
+        """Check slower servers are used only if the best is busy enough."""
+
+        balancer = server_balance.ServerBalancer(['fast', 'slow'])
+        balancer.health['fast'].latency = 0.1
+        balancer.health['slow'].latency = 0.25
+
+        servers = [balancer.acquire() for _ in range(4)]
+        self.assertEqual(servers, ['fast', 'fast', 'slow', 'fast'])
+
+        # a much slower server isn't used, the caller waits
+        balancer.health['slow'].latency = 10.0
+        self.assertEqual(balancer.try_acquire(), ('fast', 0.0))
+        self.assertEqual(balancer.try_acquire(), ('fast', 0.0))
+
+        throttle = rate_limit.ServerThrottle(1)
+        balancer = server_balance.ServerBalancer(['fast', 'slow'],
+                                                 {'fast': throttle})
+        balancer.health['fast'].latency = 0.1
+        balancer.health['slow'].latency = 10.0
+        self.assertEqual(balancer.try_acquire(), ('fast', 0.0))
+        self.assertEqual(balancer.try_acquire(), (None, None))
+        self.assertEqual(balancer.acquire(timeout=0.05), None)
+
+        # unless it hasn't been tried for a while
+        balancer.health['slow'].last_used -= balancer.RecheckTime
+        self.assertEqual(balancer.try_acquire(), ('slow', 0.0))
+
+        # the slow server is the best one left if the fast one is excluded
+        self.assertEqual(balancer.acquire(exclude='fast', timeout=0.05),
+                         'slow')
+        balancer.cancel('slow')
+
+    def test_throttle(self):
+        """Check a server backing off isn't used."""
+
+        throttles = {'a': rate_limit.ServerThrottle(2),
+                     'b': rate_limit.ServerThrottle(2)}
+        balancer = server_balance.ServerBalancer(['a', 'b'], throttles)
+        latencies = {'a': 0.01, 'b': 0.05}
+        for _ in range(4):
+            self.request(balancer, latencies)
+        self.assertEqual(self.request(balancer, latencies), 'a')
+
+        server = balancer.acquire()
+        balancer.release(server, rate_limit.Throttled, 0.01, retry_after=10)
+        self.assertEqual(throttles['a'].limit, 1)
+        self.assertEqual([self.request(balancer, latencies)
+                              for _ in range(3)], ['b']*3)
+
+    def test_eject(self):
+        """Check failing servers are ejected, probed and brought back."""
+
+        balancer = server_balance.ServerBalancer(['a', 'b'])
+        balancer.EjectTime = 0.05
+        latencies = {'a': 0.01, 'b': 0.05}
+        self.assertEqual(sorted(self.request(balancer, latencies)
+                                    for _ in range(2)), ['a', 'b'])
+
+        for _ in range(balancer.EjectAfter):
+            self.assertEqual(self.request(balancer, latencies,
+                                          rate_limit.Failed), 'a')
+        self.assertTrue(balancer.info()['a']['ejected'] > 0.0)
+        self.assertEqual(self.request(balancer, latencies), 'b')
+
+        # the last server in use isn't ejected
+        for _ in range(2*balancer.EjectAfter):
+            self.assertEqual(self.request(balancer, latencies,
+                                          rate_limit.Failed), 'b')
+        self.assertEqual(balancer.info()['b']['ejected'], 0.0)
+
+        # after the ejection time one probe is sent, which fails
+        time.sleep(balancer.EjectTime)
+        self.assertEqual(balancer.try_acquire(), ('a', 0.0))
+        self.assertEqual(balancer.try_acquire(), ('b', 0.0))
+        balancer.release('b', rate_limit.OK, 0.05)
+        balancer.release('a', rate_limit.Failed, 0.01)
+        self.assertTrue(balancer.info()['a']['ejected']
+                            > 1.5*balancer.EjectTime)
+
+        # a good probe brings the server back
+        time.sleep(2*balancer.EjectTime)
+        self.assertEqual(self.request(balancer, latencies), 'a')
+        self.assertEqual(balancer.info()['a']['ejected'], 0.0)
+        self.assertEqual([self.request(balancer, latencies)
+                              for _ in range(3)], ['a']*3)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestServerBalance, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,284 @@
+"""
+Test the tile cache writing tiles to disk in a background thread.
+
+The cache needs wxPython, the tests are skipped if it isn't installed.
+"""
+
+import gc
+import time
+import shutil
+import weakref
+import tempfile
+import threading
+import unittest
+import importlib.util
+import pyslip.tile_store as tile_store
+
+
+HaveWx = importlib.util.find_spec('wx') is not None
+
+
+class SlowStore(tile_store.DirectoryStore):
+    """A directory store whose writes wait until allowed."""
+
+    def __init__(self, tiles_dir):
+        super().__init__(tiles_dir)
+        self.allow = threading.Event()
+
+    def write_batch(self, tiles):
+        self.allow.wait(10)
+        super().write_batch(tiles)
+
+
+class CountingStore(tile_store.DirectoryStore):
+    """A directory store counting lookups, level indexing waits until allowed."""
+
+    def __init__(self, tiles_dir):
+        super().__init__(tiles_dir)
+        self.stats = 0
+        self.allow = threading.Event()
+
+    def stat(self, key):
+        self.stats += 1
+        return super().stat(key)
+
+    def dates(self, level):
+        self.allow.wait(10)
+        return super().dates(level)
+
+
+@unittest.skipUnless(HaveWx, 'needs wxPython for tiles')
+class TestTileCache(unittest.TestCase):
+
+    def setUp(self):
+        import pyslip.tiles as tiles
+
+        self.tiles = tiles
+        self.tiles_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tiles_dir)
+
+    def test_full_queue(self):
+        """Check a full write queue isn't waited for and loses no tiles."""
+
+        class SmallQueueCache(self.tiles.Cache):
+            MaxWriteQueue = 2
+            WriteBatchSize = 1
+
+        store = SlowStore(self.tiles_dir)
+        cache = SmallQueueCache(tiles_dir=self.tiles_dir, store=store)
+
+        # the writer takes one tile and waits, two more fill the queue
+        start = time.time()
+        for x in range(8):
+            cache.put_data((1, x, 0), b'tile %d' % x)
+        self.assertTrue(time.time() - start < 1)
+        unqueued = cache.stats.snapshot()['counters']['unqueued_writes']
+        self.assertTrue(unqueued >= 5)
+
+        # a tile waiting to be written just gets the newer data
+        cache.put_data((1, 7, 0), b'newer')
+        self.assertEqual(cache.stats.snapshot()['counters']['unqueued_writes'],
+                         unqueued)
+
+        # tiles not on the queue are still found
+        self.assertTrue(cache.tile_on_disk((1, 6, 0)))
+        self.assertEqual(cache._warm[(1, 6, 0)], b'tile 6')
+
+        # and are all written once the writer catches up
+        store.allow.set()
+        cache.flush()
+        self.assertEqual(sorted(store.keys()), [(1, x, 0) for x in range(8)])
+        self.assertEqual(store.read((1, 7, 0)), b'newer')
+        self.assertEqual(cache._pending_writes, {})
+        cache.close()
+        store.close()
+
+    def test_discarded(self):
+        """Check a cache with writer and collector threads can be collected."""
+
+        class QuickWriter(self.tiles.TileWriter):
+            IdleCheck = 0.05
+
+        class QuickCache(self.tiles.Cache):
+            CollectorInterval = 0.05
+
+        self.tiles.TileWriter, saved = QuickWriter, self.tiles.TileWriter
+        try:
+            cache = QuickCache(tiles_dir=self.tiles_dir)
+            cache.put_data((1, 0, 0), b'tile')
+            cache.flush()
+        finally:
+            self.tiles.TileWriter = saved
+        cache.set_disk_quota(10**6)
+        threads = [cache._writer, cache._collector]
+        store = cache._store
+        ref = weakref.ref(cache)
+        self.assertIs(self.tiles._open_caches[id(cache)], cache)
+
+        del cache
+        gc.collect()
+        self.assertEqual(ref(), None)
+        for thread in threads:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(store.read((1, 0, 0)), b'tile')
+        store.close()
+
+    def test_accessed(self):
+        """Check a recently read old tile survives disk cache collection."""
+
+        store = tile_store.MBTilesStore(self.tiles_dir + '/tiles.mbtiles')
+        now = time.time()
+        store.write_batch([((1, x, 0), b'%04d' % x, now - 1000 + x)
+                           for x in range(10)])
+
+        # read the oldest tile from disk, then from the warm tier
+        cache = self.tiles.Cache(tiles_dir=self.tiles_dir, store=store)
+        cache._get_from_back((1, 0, 0))
+        cache._get_from_back((1, 0, 0))
+        self.assertEqual(cache.stats.snapshot()['counters']['warm_hits'], 1)
+        cache.close()
+
+        # a new cache has nothing in memory, half the tiles must go
+        cache = self.tiles.Cache(tiles_dir=self.tiles_dir, store=store)
+        collector = self.tiles.TileCollector(cache, 20, None, 60, 100, 0)
+        self.assertEqual(collector.collect(), 6)
+        self.assertEqual(sorted(store.keys()),
+                         [(1, 0, 0)] + [(1, x, 0) for x in range(7, 10)])
+        cache.close()
+        store.close()
+
+    def test_stat_cache(self):
+        """Check lookups are remembered, even for tiles not on disk."""
+
+        class QuickStatCache(self.tiles.Cache):
+            StatCacheTTL = 0.2
+
+        store = CountingStore(self.tiles_dir)
+        store.write_batch([((1, 0, 0), b'tile', time.time())])
+        cache = QuickStatCache(tiles_dir=self.tiles_dir, store=store)
+
+        # the level isn't indexed yet, the store is asked once per tile
+        for _ in range(3):
+            self.assertTrue(cache.tile_on_disk((1, 0, 0)))
+            self.assertFalse(cache.tile_on_disk((1, 1, 0)))
+        self.assertEqual(store.stats, 2)
+
+        # a tile written behind the cache's back isn't seen until expiry
+        store.write_batch([((1, 1, 0), b'tile', time.time())])
+        self.assertFalse(cache.tile_on_disk((1, 1, 0)))
+        time.sleep(0.3)
+        self.assertTrue(cache.tile_on_disk((1, 1, 0)))
+        self.assertEqual(store.stats, 3)
+
+        # or until the lookups are forgotten
+        self.assertTrue(cache.tile_on_disk((1, 0, 0)))
+        store.delete_batch([(1, 0, 0)])
+        self.assertTrue(cache.tile_on_disk((1, 0, 0)))
+        cache.forget_stats()
+        self.assertFalse(cache.tile_on_disk((1, 0, 0)))
+        self.assertEqual(store.stats, 5)
+
+        store.allow.set()
+        cache.close()
+        store.close()
+
+    def test_raw_bytes(self):
+        """Check server bytes are written to disk unchanged."""
+
+        cache = self.tiles.Cache(tiles_dir=self.tiles_dir)
+        data = b'not decoded\x00\xff\x89PNG'
+        cache.put_data((2, 1, 3), data, {'etag': '"a"', 'last_modified': None,
+                                         'expires': None, 'max_age': None})
+        cache.flush()
+        self.assertEqual(cache._store.read((2, 1, 3)), data)
+        self.assertEqual(cache._store.get_validators((2, 1, 3))['etag'], '"a"')
+        cache.close()
+
+        # and read back unchanged by a new cache
+        cache = self.tiles.Cache(tiles_dir=self.tiles_dir)
+        self.assertEqual(cache._store.read((2, 1, 3)), data)
+        self.assertFalse(cache.in_memory((2, 1, 3)))
+        cache.close()
+        cache._store.close()
+
+    def test_warm_tier(self):
+        """Check the warm tier keeps tiles read from disk within its bytes."""
+
+        store = tile_store.DirectoryStore(self.tiles_dir)
+        store.write_batch([((1, x, 0), b'%040d' % x, time.time())
+                           for x in range(4)])
+        cache = self.tiles.Cache(tiles_dir=self.tiles_dir, store=store,
+                                 warm_bytes=100)
+
+        # a tile read from disk is kept in the warm tier
+        cache._get_from_back((1, 0, 0))
+        self.assertTrue((1, 0, 0) in cache._warm)
+        cache._get_from_back((1, 0, 0))
+        counters = cache.stats.snapshot()['counters']
+        self.assertEqual(counters['warm_hits'], 1)
+        self.assertEqual(counters['bytes_read'], 40)
+
+        # the least recently used tiles go past 'warm_bytes'
+        cache._get_from_back((1, 1, 0))
+        cache._get_from_back((1, 0, 0))
+        cache._get_from_back((1, 2, 0))
+        self.assertEqual(cache.info()['warm_bytes'], 80)
+        self.assertFalse((1, 1, 0) in cache._warm)
+        self.assertTrue((1, 0, 0) in cache._warm)
+        self.assertTrue((1, 2, 0) in cache._warm)
+
+        # and a lower limit evicts at once
+        cache.set_warm_bytes(40)
+        self.assertEqual(cache.info()['warm_entries'], 1)
+        self.assertTrue((1, 2, 0) in cache._warm)
+        cache.close()
+        store.close()
+
+    def test_index(self):
+        """Check the level index agrees with the disk after changes."""
+
+        store = CountingStore(self.tiles_dir)
+        store.write_batch([((1, x, 0), b'tile', time.time())
+                           for x in range(4)])
+        cache = self.tiles.Cache(tiles_dir=self.tiles_dir, store=store)
+        keys = [(1, x, 0) for x in range(6)]
+
+        # change the level while it's being indexed
+        self.assertTrue(cache.tile_on_disk((1, 0, 0)))
+        cache.put_data((1, 4, 0), b'tile')
+        cache.flush()
+        cache._delete_from_back([(1, 1, 0)])
+        store.allow.set()
+        for _ in range(100):
+            if 1 in cache._index:
+                break
+            time.sleep(0.05)
+        self.assertEqual(sorted(cache._index[1]), sorted(store.keys(level=1)))
+
+        # lookups now come from the index
+        stats = store.stats
+        for key in keys:
+            self.assertEqual(cache.tile_on_disk(key),
+                             store.stat(key) is not None)
+        self.assertEqual(store.stats, stats + len(keys))
+
+        # and it follows writes and deletes
+        cache.put_data((1, 5, 0), b'tile')
+        cache.flush()
+        cache._delete_from_back([(1, 0, 0), (1, 4, 0)])
+        self.assertEqual(sorted(cache._index[1]), sorted(store.keys(level=1)))
+        for key in keys:
+            self.assertEqual(cache.tile_on_disk(key),
+                             store.stat(key) is not None)
+        cache.close()
+        store.close()
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestTileCache, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
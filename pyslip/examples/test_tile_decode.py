@@ -0,0 +1,161 @@
+"""
+Test decoding tiles to raw pixels in the decode pool.
+
+The pool processes need Pillow or wxPython to decode, the tests are
+skipped if neither is installed.
+"""
+
+import os
+import sys
+import zlib
+import shutil
+import struct
+import tempfile
+import unittest
+import importlib.util
+import pyslip.tile_decode as tile_decode
+
+
+HaveDecoder = any(importlib.util.find_spec(name) is not None
+                  for name in ('PIL', 'wx'))
+
+
+def make_png(width, height, pixels, alpha):
+    """Return the bytes of a PNG file.
+
+    pixels  function returning the (r, g, b, a) colour for (x, y)
+    alpha   True if the PNG has an alpha channel
+    """
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    colour_type = 6 if alpha else 2
+    rows = []
+    for y in range(height):
+        row = bytearray([0])            # no filter
+        for x in range(width):
+            row.extend(pixels(x, y)[:4 if alpha else 3])
+        rows.append(bytes(row))
+    header = struct.pack('>IIBBBBB', width, height, 8, colour_type, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(b''.join(rows)))
+            + chunk(b'IEND', b''))
+
+
+def widget_imported():
+    """Return True if the pySlip widget module was imported, in a pool process."""
+
+    return 'pyslip.pyslip' in sys.modules
+
+
+def colour(x, y):
+    return (x * 10, y * 10, 200, 255 if x < 4 else 0)
+
+
+@unittest.skipUnless(HaveDecoder, 'needs Pillow or wxPython to decode tiles')
+class TestTileDecode(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = tile_decode.DecodePool(processes=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_rgb(self):
+        """Check an RGB tile decodes to RGB bytes and no alpha."""
+
+        data = make_png(8, 6, colour, alpha=False)
+        (width, height, rgb, alpha) = self.pool.submit(data).result(60)
+        self.assertEqual((width, height), (8, 6))
+        self.assertEqual(len(rgb), 8 * 6 * 3)
+        self.assertEqual(alpha, None)
+        offset = (5 * 8 + 3) * 3                # pixel (3, 5)
+        self.assertEqual(tuple(rgb[offset:offset+3]), (30, 50, 200))
+
+    def test_rgba(self):
+        """Check a tile with transparency decodes to RGB and alpha bytes."""
+
+        data = make_png(8, 6, colour, alpha=True)
+        (width, height, rgb, alpha) = self.pool.submit(data).result(60)
+        self.assertEqual(len(rgb), 8 * 6 * 3)
+        self.assertEqual(len(alpha), 8 * 6)
+        self.assertEqual(alpha[2], 255)
+        self.assertEqual(alpha[6], 0)
+
+    def test_bad_data(self):
+        """Check undecodable bytes give an exception from the future."""
+
+        with self.assertRaises(ValueError):
+            self.pool.submit(b'not a tile').result(60)
+
+    def test_many(self):
+        """Check many tiles can be decoded at once."""
+
+        tiles = [make_png(16, 16, lambda x, y: (i, x, y, 255), alpha=False)
+                 for i in range(50)]
+        futures = [self.pool.submit(data) for data in tiles]
+        for (i, future) in enumerate(futures):
+            self.assertEqual(future.result(60)[2][0], i)
+
+    def test_broken(self):
+        """Check a pool with a dead process is replaced by get_pool()."""
+
+        saved = (tile_decode._pool, tile_decode._restarts)
+        data = make_png(8, 6, colour, alpha=False)
+        try:
+            tile_decode._pool = tile_decode.DecodePool(processes=1)
+            tile_decode._restarts = 0
+            pool = tile_decode.get_pool()
+            self.assertEqual(pool.submit(data).result(60)[:2], (8, 6))
+
+            # kill the pool process, the pool is then broken
+            for process in list(pool._executor._processes.values()):
+                process.kill()
+            with self.assertRaises(RuntimeError):
+                pool.submit(data).result(60)
+            self.assertTrue(pool.broken)
+
+            new_pool = tile_decode.get_pool()
+            self.assertIsNot(new_pool, pool)
+            self.assertEqual(new_pool.submit(data).result(60)[:2], (8, 6))
+
+            # after too many restarts there is no pool
+            tile_decode._restarts = tile_decode.MaxRestarts
+            new_pool.close()
+            with self.assertRaises(RuntimeError):
+                new_pool.submit(data)
+            self.assertEqual(tile_decode.get_pool(), None)
+        finally:
+            tile_decode._pool.close()
+            (tile_decode._pool, tile_decode._restarts) = saved
+
+    def test_process_imports(self):
+        """Check pool processes don't import the widget or open its log."""
+
+        self.assertTrue(tile_decode.DecodePool().processes
+                            <= tile_decode.DecodePool.MaxProcesses)
+
+        cwd = os.getcwd()
+        tmp_dir = tempfile.mkdtemp()
+        os.chdir(tmp_dir)
+        pool = tile_decode.DecodePool(processes=1)
+        try:
+            data = make_png(8, 6, colour, alpha=False)
+            self.assertEqual(pool.submit(data).result(60)[:2], (8, 6))
+            self.assertFalse(pool._executor.submit(widget_imported).result(60))
+            self.assertEqual(os.listdir(tmp_dir), [])
+        finally:
+            pool.close()
+            os.chdir(cwd)
+            shutil.rmtree(tmp_dir)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestTileDecode, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,121 @@
+"""
+Test the tile request queue ordering.
+"""
+
+import time
+import threading
+import unittest
+import pyslip.tile_queue as tile_queue
+
+
+class TestTileQueue(unittest.TestCase):
+
+    def test_centre_first(self):
+        """Check tiles nearest the view centre come out first."""
+
+        q = tile_queue.TileRequestQueue()
+        q.set_view(3, 2.0, 2.0, 6.0, 6.0)
+        keys = [(3, x, y) for x in range(8) for y in range(8)]
+        for key in keys:
+            q.put(key)
+        self.assertEqual(q.qsize(), 64)
+
+        got = [q.get() for _ in range(64)]
+        self.assertEqual(sorted(got), sorted(keys))
+        self.assertEqual(set(got[:4]),
+                         {(3, 3, 3), (3, 3, 4), (3, 4, 3), (3, 4, 4)})
+        self.assertTrue(got[-1] in {(3, 0, 0), (3, 0, 7), (3, 7, 0), (3, 7, 7)})
+        self.assertTrue(q.empty())
+
+    def test_pan(self):
+        """Check moving the centre re-orders queued requests."""
+
+        q = tile_queue.TileRequestQueue()
+        q.set_view(3, 0.0, 0.0, 1.0, 1.0)
+        for x in range(8):
+            q.put((3, x, 0))
+        self.assertEqual(q.get(), (3, 0, 0))
+
+        q.set_view(3, 7.0, 0.0, 8.0, 1.0)
+        self.assertEqual([q.get() for _ in range(3)],
+                         [(3, 7, 0), (3, 6, 0), (3, 5, 0)])
+
+        # keys for another level go last
+        q.put((2, 7, 0))
+        self.assertEqual(q.get(), (3, 4, 0))
+        self.assertEqual([q.get() for _ in range(4)][-1], (2, 7, 0))
+
+    def test_recency(self):
+        """Check requests no longer asked for drop behind newer ones."""
+
+        q = tile_queue.TileRequestQueue()
+        q.AgePenalty = 100.0
+        q.set_view(3, 0.0, 0.0, 1.0, 1.0)
+        q.put((3, 0, 0))
+        q.put((3, 1, 0))
+        time.sleep(0.05)
+        q.put((3, 3, 0))
+
+        # (3, 3, 0) is further but 5 tiles of age more recent
+        self.assertEqual(q.get(), (3, 3, 0))
+
+        # asking for a key again makes it recent
+        time.sleep(0.05)
+        q.touch((3, 1, 0))
+        q.touch((3, 9, 9))          # not queued, ignored
+        self.assertEqual(q.get(), (3, 1, 0))
+        self.assertEqual(q.get(), (3, 0, 0))
+        self.assertTrue(q.empty())
+
+    def test_cancel(self):
+        """Check moving the view cancels requests for tiles left behind."""
+
+        q = tile_queue.TileRequestQueue()
+        q.set_view(4, 0.5, 0.5, 3.5, 2.5, margin=1)
+        for x in range(4):
+            for y in range(3):
+                q.put((4, x, y))
+
+        # an unchanged view cancels nothing
+        self.assertEqual(q.set_view(4, 0.5, 0.5, 3.5, 2.5, margin=1), [])
+
+        # move right two and a half tiles, columns 0 and 1 are now more
+        # than one tile outside the view
+        cancelled = q.set_view(4, 3.0, 0.5, 6.0, 2.5, margin=1)
+        self.assertEqual(sorted(cancelled),
+                         [(4, x, y) for x in range(2) for y in range(3)])
+        self.assertEqual(q.cancelled, 6)
+        self.assertEqual(q.qsize(), 6)
+        self.assertEqual(q.unfinished_tasks, 6)
+        self.assertEqual(q.get()[1], 3)
+
+        # without a margin nothing is cancelled, a level change with
+        # a margin cancels everything
+        self.assertEqual(q.set_view(4, 20.0, 20.0, 22.0, 22.0), [])
+        self.assertEqual(len(q.set_view(5, 6.0, 1.0, 8.0, 3.0, margin=1)), 5)
+        self.assertTrue(q.empty())
+        self.assertEqual(q.cancelled, 11)
+
+    def test_clear(self):
+        """Check clear() empties the queue and releases join()."""
+
+        q = tile_queue.TileRequestQueue()
+        for x in range(10):
+            q.put((1, x, 0))
+        q.get()
+        q.task_done()
+        q.clear()
+        self.assertTrue(q.empty())
+
+        joined = threading.Event()
+        t = threading.Thread(target=lambda: (q.join(), joined.set()))
+        t.daemon = True
+        t.start()
+        self.assertTrue(joined.wait(1))
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestTileQueue, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,181 @@
+"""
+Test the on-disk tile stores and migration between them.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import pyslip.tile_store as tile_store
+
+
+class TestTileStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tiles_dir = os.path.join(self.tmp_dir, 'tiles')
+        os.makedirs(self.tiles_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_store(self, store):
+        """Check the basic operations of a store."""
+
+        self.assertEqual(store.stat((2, 1, 3)), None)
+        with self.assertRaises(KeyError):
+            store.read((2, 1, 3))
+
+        tiles = [((2, x, y), b'tile %d %d' % (x, y), None)
+                 for x in range(4) for y in range(4)]
+        store.write_batch(tiles)
+
+        self.assertEqual(store.read((2, 1, 3)), b'tile 1 3')
+        self.assertTrue(store.stat((2, 1, 3)) is not None)
+        self.assertEqual(sorted(store.keys()), sorted(k for (k, _, _) in tiles))
+        self.assertEqual(list(store.keys(level=5)), [])
+
+        # rewriting a tile replaces it
+        store.write_batch([((2, 1, 3), b'new', None)])
+        self.assertEqual(store.read((2, 1, 3)), b'new')
+        self.assertEqual(len(list(store.keys())), 16)
+
+        # the fetch time is kept, and dates() indexes one level
+        store.write_batch([((2, 2, 2), b'old', 1000000000.0)])
+        self.assertEqual(store.stat((2, 2, 2)), 1000000000.0)
+        dates = store.dates(2)
+        self.assertEqual(sorted(dates.keys()), sorted(store.keys(level=2)))
+        self.assertEqual(dates[(2, 2, 2)], 1000000000.0)
+        self.assertEqual(store.dates(5), {})
+
+        # validators are kept, touching a tile changes its fetch date
+        self.assertEqual(store.get_validators((2, 1, 3)), None)
+        validators = {'etag': '"abc"', 'last_modified': None, 'expires': 5.0,
+                      'max_age': 60.0}
+        store.set_validators([((2, 1, 3), validators),
+                              ((2, 0, 0), {'etag': 'x'})])
+        self.assertEqual(store.get_validators((2, 1, 3)), validators)
+        self.assertEqual(store.expiries(2), {(2, 1, 3): 5.0})
+        store.touch_batch([((2, 1, 3), 1500000000.0)])
+        self.assertEqual(store.stat((2, 1, 3)), 1500000000.0)
+        self.assertEqual(store.read((2, 1, 3)), b'new')
+
+        # recording an access doesn't change the fetch date
+        store.access_batch([((2, 2, 2), 1600000000.0), ((7, 0, 0), 1.0)])
+        accessed = dict((key, (fetched, accessed))
+                        for (key, _, fetched, accessed) in store.entries())
+        self.assertEqual(accessed[(2, 2, 2)], (1000000000.0, 1600000000.0))
+        self.assertEqual(store.stat((2, 2, 2)), 1000000000.0)
+
+        # entries give sizes, deleting removes tiles
+        sizes = dict((key, size) for (key, size, _, _) in store.entries())
+        self.assertEqual(sizes[(2, 1, 3)], 3)
+        self.assertEqual(sizes[(2, 0, 0)], len(b'tile 0 0'))
+        store.delete_batch([(2, 0, 0), (2, 0, 1), (5, 5, 5)])
+        self.assertEqual(store.stat((2, 0, 0)), None)
+        self.assertEqual(store.get_validators((2, 0, 0)), None)
+        self.assertEqual(len(list(store.entries())), 14)
+
+    def test_directory(self):
+        """Test the one-file-per-tile store."""
+
+        store = tile_store.DirectoryStore(self.tiles_dir, 'jpg')
+        self.check_store(store)
+        self.assertTrue(os.path.isfile(os.path.join(self.tiles_dir,
+                                                    '2', '1', '3.jpg')))
+
+        # a failed write leaves the old tile and no temporary file
+        with self.assertRaises(TypeError):
+            store.write_batch([((2, 1, 3), 'not bytes', None)])
+        self.assertEqual(store.read((2, 1, 3)), b'new')
+        for (_, _, fnames) in os.walk(self.tiles_dir):
+            self.assertEqual([f for f in fnames if f.endswith('.tmp')], [])
+        store.close()
+
+    def test_mbtiles(self):
+        """Test the SQLite store, and that rows are stored TMS style."""
+
+        path = os.path.join(self.tmp_dir, 'tiles.mbtiles')
+        store = tile_store.MBTilesStore(path, 'png', name='test')
+        self.check_store(store)
+        row = store._db.execute('SELECT tile_row FROM tiles WHERE zoom_level=2 '
+                                'AND tile_column=1 AND tile_data=?',
+                                (b'tile 1 0',)).fetchone()
+        self.assertEqual(row[0], 3)
+        store.close()
+
+        # data survives reopening the file
+        store = tile_store.MBTilesStore(path, 'png')
+        self.assertEqual(store.read((2, 1, 3)), b'new')
+        self.assertEqual(store.stat((2, 0, 0)), None)
+        store.close()
+
+    def test_migrate(self):
+        """Test copying a directory store, and validators, into MBTiles."""
+
+        src = tile_store.DirectoryStore(self.tiles_dir, 'png')
+        src.write_batch([((z, x, 0), b'%d %d' % (z, x), None)
+                         for z in range(3) for x in range(2**z)])
+        src.set_validators([((1, 1, 0), {'etag': 'e', 'expires': 9.0})])
+        dst = tile_store.MBTilesStore(os.path.join(self.tmp_dir, 'm.mbtiles'))
+        count = tile_store.migrate(src, dst, batch_size=3)
+        self.assertEqual(count, 7)
+        self.assertEqual(sorted(dst.keys()), sorted(src.keys()))
+        self.assertEqual(dst.read((2, 3, 0)), b'2 3')
+        self.assertEqual(dst.stat((2, 3, 0)), src.stat((2, 3, 0)))
+        self.assertEqual(dst.expiries(1), {(1, 1, 0): 9.0})
+        dst.close()
+        src.close()
+
+    def test_migrate_unchanged(self):
+        """Test migrating a directory without validators doesn't change it."""
+
+        src = tile_store.DirectoryStore(self.tiles_dir, 'png')
+        src.write_batch([((1, x, 0), b'%d' % x, None) for x in range(2)])
+        dst = tile_store.MBTilesStore(os.path.join(self.tmp_dir, 'm.mbtiles'))
+        self.assertEqual(tile_store.migrate(src, dst), 2)
+        self.assertEqual(src.expiries(1), {})
+        src.delete_batch([(1, 0, 0)])
+        self.assertFalse(os.path.exists(os.path.join(
+                                self.tiles_dir, src.ValidatorsFile)))
+        dst.close()
+        src.close()
+
+    def test_old_mbtiles(self):
+        """Check an MBTiles file without access times is upgraded."""
+
+        path = os.path.join(self.tmp_dir, 'old.mbtiles')
+        db = sqlite3.connect(path)
+        db.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, '
+                   'tile_row INTEGER, tile_data BLOB, fetched REAL)')
+        db.execute("INSERT INTO tiles VALUES (1, 0, 1, x'00', 5.0)")
+        db.commit()
+        db.close()
+        store = tile_store.MBTilesStore(path)
+        self.assertEqual(list(store.entries()), [((1, 0, 0), 1, 5.0, 5.0)])
+        store.access_batch([((1, 0, 0), 9.0)])
+        self.assertEqual(list(store.entries()), [((1, 0, 0), 1, 5.0, 9.0)])
+        store.close()
+
+    def test_old_table(self):
+        """Check a validators table without max-age is upgraded."""
+
+        db = sqlite3.connect(':memory:')
+        db.execute('CREATE TABLE validators (level INTEGER, x INTEGER, '
+                   'y INTEGER, etag TEXT, last_modified TEXT, expires REAL)')
+        db.execute("INSERT INTO validators VALUES (1, 0, 0, 'e', NULL, 5.0)")
+        table = tile_store.ValidatorTable(db, threading.Lock())
+        self.assertEqual(table.get((1, 0, 0)),
+                         {'etag': 'e', 'last_modified': None, 'expires': 5.0,
+                          'max_age': None})
+        table.set_batch([((1, 0, 0), {'etag': 'f', 'max_age': 60})])
+        self.assertEqual(table.get((1, 0, 0))['max_age'], 60)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestTileStore, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
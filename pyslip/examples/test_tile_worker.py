@@ -0,0 +1,82 @@
+"""
+Test the TileWorker threads fetching server tiles.
+
+The workers are in tiles_net, which needs wxPython, the tests are
+skipped if it isn't installed.
+"""
+
+import queue
+import threading
+import unittest
+import importlib.util
+import pyslip.http_pool as http_pool
+import pyslip.rate_limit as rate_limit
+import pyslip.server_balance as server_balance
+from tile_server import TileServer
+
+
+HaveWx = importlib.util.find_spec('wx') is not None
+
+
+@unittest.skipUnless(HaveWx, 'needs wxPython for tiles_net')
+class TestTileWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TileServer()
+        self.url = self.server.start()
+        self.throttle = rate_limit.ServerThrottle(2)
+        self.balancer = server_balance.ServerBalancer([self.url],
+                                                      {self.url: self.throttle})
+        self.pools = {self.url: http_pool.ConnectionPool(self.url)}
+
+    def tearDown(self):
+        self.pools[self.url].close()
+        self.server.stop()
+
+    def test_errors(self):
+        """Check failing header and callback functions don't stop a worker."""
+
+        import pyslip.tiles_net as tiles_net
+
+        keys = [(3, x, 0) for x in range(6)]
+        results = {}
+        finished = threading.Event()
+
+        def headers(key):
+            if key[1] == 1:
+                raise ValueError('no headers')
+            return {}
+
+        def callback(key, server, status, info, body, exception, elapsed):
+            results[key] = (status, exception)
+            if len(results) == len(keys):
+                finished.set()
+            if key[1] == 2:
+                raise ValueError('bad tile')
+
+        # one worker, so it must survive the errors
+        requests = queue.Queue()
+        worker = tiles_net.TileWorker(0, self.balancer, '/{Z}/{X}/{Y}.png',
+                                      requests, callback, None, 'image/png',
+                                      None, None, headers, self.pools)
+        worker.start()
+        for key in keys:
+            requests.put(key)
+        self.assertTrue(finished.wait(10))
+        requests.join()
+
+        self.assertEqual(results[(3, 1, 0)][0], None)
+        self.assertTrue(isinstance(results[(3, 1, 0)][1], ValueError))
+        self.assertEqual([results[k][0] for k in keys if k[1] != 1], [200]*5)
+        self.assertTrue(worker.is_alive())
+
+        # idle workers don't hold a server
+        self.assertEqual(self.balancer.info()[self.url]['in_flight'], 0)
+        self.assertEqual(self.throttle.in_flight, 0)
+
+################################################################################
+
+if __name__ == '__main__':
+    suite = unittest.makeSuite(TestTileWorker, 'test')
+    runner = unittest.TextTestRunner()
+    runner.run(suite)
@@ -0,0 +1,121 @@
+"""
+A local HTTP tile server used by the tests here.
+
+The server answers any path with a tile, the path itself as bytes unless
+other tile data is given, or with an empty response of another status
+if one is given.  Paths starting with:
+    /missing  get a 404 response
+    /chunked  get a chunked response
+    /close    get a response closing the connection
+    /drop     get a response, then the connection is closed without
+              telling the client, like an idle timeout
+
+The server counts the connections made to it and the requests it is
+answering at once.
+"""
+
+import time
+import threading
+import http.server
+
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    """Serve a tile for any path, keeping connections alive."""
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are separate writes, don't let Nagle delay the body
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(server.delay_for(self.path))
+        with server.lock:
+            server.in_flight -= 1
+
+        data = server.data
+        if data is None:
+            data = self.path.encode()
+
+        if self.path.startswith('/missing') or server.status != 200:
+            self.send_response(404 if server.status == 200 else server.status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        elif self.path.startswith('/chunked'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(data), 3):
+                chunk = data[i:i+3]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(data)))
+            if self.path.startswith('/close'):
+                self.send_header('Connection', 'close')
+                self.close_connection = True
+            elif self.path.startswith('/drop'):
+                self.close_connection = True
+            self.end_headers()
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileServer(http.server.ThreadingHTTPServer):
+    """A local tile server counting connections and concurrent requests."""
+
+    daemon_threads = True
+
+    def __init__(self, delay=0.0, data=None, status=200):
+        """Prepare the server.
+
+        delay   seconds to wait before answering, or a function returning
+                the seconds to wait for a request path
+        data    the tile bytes returned, None means the request path
+        status  the response status, a status other than 200 is sent
+                with no tile
+        """
+
+        super().__init__(('127.0.0.1', 0), TileHandler)
+        self.delay = delay
+        self.data = data
+        self.status = status
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def delay_for(self, path):
+        """Return the seconds to wait before answering 'path'."""
+
+        if callable(self.delay):
+            return self.delay(path)
+        return self.delay
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+    def start(self):
+        """Serve requests in a thread, return the server URL."""
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def stop(self):
+        """Stop serving and close the server socket."""
+
+        self.shutdown()
+        self.server_close()
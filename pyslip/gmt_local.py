@@ -7,6 +7,11 @@ import pickle
 import pyslip.tiles as tiles
 import pyslip.log as log
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 try:
     log = log.Log('pyslip.log')
 except AttributeError:
@@ -39,7 +44,7 @@ TileLevels = range(5)
 MaxServerRequests = None
 
 # set maximum number of in-memory tiles for each level
-MaxLRU = 10000
+MaxLRU = 1000
 
 # path to the INFO file for GMT tiles
 TileInfoFilename = "tile.info"
@@ -136,6 +141,22 @@ class Tiles(tiles.BaseTiles):
 
         return (tiles_x, tiles_y)
 
+    def Geo2TileArray(self, geo):
+        """Convert an array of geo coordinates to tile fractional coordinates.
+
+        geo  NumPy array of shape (N, 2), each row (xgeo, ygeo)
+
+        Returns a NumPy array of shape (N, 2), each row (xtile, ytile).
+        """
+
+        (min_xgeo, max_xgeo, min_ygeo, max_ygeo) = self.extent
+
+        tile = numpy.empty(geo.shape)
+        tile[:,0] = (geo[:,0] - min_xgeo) * self.ppd_x / self.tile_size_x
+        tile[:,1] = (max_ygeo - geo[:,1]) * self.ppd_y / self.tile_size_y
+
+        return tile
+
     def Tile2Geo(self, tile):
         """Convert tile fractional coordinates to geo for level in use.
 
@@ -0,0 +1,129 @@
+"""
+Hedged tile requests.
+
+If a tile request hasn't finished after the Percentile latency of recent
+requests, a duplicate request is sent to another server and the first
+good response to arrive, see succeeded(), is used.  A failure is only
+used if both requests fail.  The other request is cancelled or its
+response thrown away.  This cuts the tail latency caused by an
+occasionally slow server at the cost of a few extra requests.
+
+A HedgePolicy decides when to hedge.  It keeps the latencies of recent
+requests and limits the hedged requests to 'budget' times the tile
+requests, so the extra load on the servers is capped.
+
+For each tile the fetch code calls start() to get the hedge delay, and
+try_hedge() when the delay has passed.  If no other server is free
+before the request finishes, cancel() returns the hedge to the budget.
+Each finished request is given to observe(), and won() is called if
+the hedged request gave the response used.
+"""
+
+import math
+import threading
+import collections
+
+
+def succeeded(result):
+    """Return True if a request result is a good response.
+
+    result  (status, info, body, exception, elapsed) for the request
+
+    A tile (200) or a 'not modified' (304) response is good, anything
+    else is a failure another request may still beat.
+    """
+
+    (status, _, _, exception, _) = result
+    return exception is None and status in (200, 304)
+
+
+class HedgePolicy(object):
+    """Decide when a tile request should be hedged."""
+
+    # number of recent request latencies kept
+    Window = 200
+
+    # no hedging until this many latencies are known
+    MinSamples = 20
+
+    # shortest hedge delay, in seconds
+    MinDelay = 0.01
+
+    def __init__(self, percentile=95, budget=0.05):
+        """Prepare the policy.
+
+        percentile  hedge requests slower than this percentile of recent
+                    request latencies
+        budget      maximum hedged requests as a fraction of tile requests
+        """
+
+        self.percentile = percentile
+        self.budget = budget
+
+        self.requests = 0
+        self.hedges = 0
+        self.wins = 0
+
+        self._latencies = collections.deque(maxlen=self.Window)
+        self._delay = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Note a new tile request.
+
+        Returns the seconds to wait before hedging the request, None
+        means don't hedge.
+        """
+
+        with self._lock:
+            self.requests += 1
+            return self._hedge_delay()
+
+    def _hedge_delay(self):
+        """Return the hedge delay, must hold self._lock."""
+
+        if self._delay is None and len(self._latencies) >= self.MinSamples:
+            ordered = sorted(self._latencies)
+            index = math.ceil(self.percentile / 100 * len(ordered)) - 1
+            self._delay = max(self.MinDelay,
+                              ordered[min(max(index, 0), len(ordered) - 1)])
+        return self._delay
+
+    def try_hedge(self):
+        """Return True if a request may be hedged now, counting the hedge."""
+
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def cancel(self):
+        """Forget a hedge allowed by try_hedge() but not sent."""
+
+        with self._lock:
+            self.hedges = max(0, self.hedges - 1)
+
+    def observe(self, elapsed):
+        """Note the latency of a finished request."""
+
+        with self._lock:
+            self._latencies.append(elapsed)
+            self._delay = None
+
+    def won(self):
+        """Note that a hedged request gave the response used."""
+
+        with self._lock:
+            self.wins += 1
+
+    def info(self):
+        """Return a dictionary of the 'requests', 'hedges' sent, hedge
+        'wins' and the current hedge 'delay' (None if not hedging yet).
+        """
+
+        with self._lock:
+            return {'requests': self.requests,
+                    'hedges': self.hedges,
+                    'wins': self.wins,
+                    'delay': self._hedge_delay()}
@@ -0,0 +1,140 @@
+"""
+Persistent HTTP connections to a tile server.
+
+A ConnectionPool keeps HTTP/1.1 keep-alive connections to one server
+open between requests, so each tile doesn't pay for a new TCP (and TLS)
+handshake.  Any number of threads may use one pool, each request takes
+an idle connection or opens a new one and returns it afterwards.
+
+A request on a reused connection that the server has since closed is
+retried once on a fresh connection.
+"""
+
+import threading
+import http.client
+import urllib.parse
+
+
+class ConnectionPool(object):
+    """A pool of keep-alive connections to one HTTP or HTTPS server."""
+
+    # seconds to wait for a connection or response
+    Timeout = 30
+
+    # maximum number of idle connections kept open
+    MaxIdle = 8
+
+    def __init__(self, server, timeout=Timeout, max_idle=MaxIdle):
+        """Prepare the pool.
+
+        server    the server URL, eg, 'https://a.tile.openstreetmap.org'
+        timeout   seconds to wait for a connection or response
+        max_idle  maximum number of idle connections kept open
+        """
+
+        url = urllib.parse.urlsplit(server)
+        if url.scheme == 'https':
+            self._conn_class = http.client.HTTPSConnection
+        elif url.scheme == 'http':
+            self._conn_class = http.client.HTTPConnection
+        else:
+            raise ValueError("Bad server URL '%s', expected http or https"
+                             % server)
+
+        self.server = server
+        self.host = url.netloc
+        self.base_path = url.path.rstrip('/')
+        self.timeout = timeout
+        self.max_idle = max_idle
+
+        self._idle = []
+        self._lock = threading.Lock()
+
+        # number of connections opened, useful for seeing reuse
+        self.connects = 0
+
+    def request(self, path, headers=None):
+        """Make a GET request on a pooled connection.
+
+        path     the path on the server, appended to any server URL path
+        headers  a dictionary of extra request headers
+
+        Returns (status, headers, data) where 'headers' is a
+        http.client.HTTPMessage and 'data' the response body bytes.
+        Raises OSError or http.client.HTTPException on a failed request.
+        """
+
+        url = self.base_path + path
+        headers = headers or {}
+
+        (conn, reused) = self._get_connection()
+        try:
+            response = self._send(conn, url, headers)
+        except (http.client.RemoteDisconnected,
+                http.client.BadStatusLine, ConnectionError):
+            conn.close()
+            if not reused:
+                raise
+            # the server closed an idle connection, try a fresh one
+            conn = self._new_connection()
+            try:
+                response = self._send(conn, url, headers)
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        try:
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._put_connection(conn)
+
+        return (response.status, response.msg, data)
+
+    def close(self):
+        """Close all idle connections."""
+
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for conn in idle:
+            conn.close()
+
+    def _send(self, conn, url, headers):
+        """Send a GET on 'conn' and return the response."""
+
+        conn.request('GET', url, headers=headers)
+        return conn.getresponse()
+
+    def _get_connection(self):
+        """Return (connection, reused), reused True if an idle connection."""
+
+        with self._lock:
+            if self._idle:
+                return (self._idle.pop(), True)
+        return (self._new_connection(), False)
+
+    def _new_connection(self):
+        """Return a new, unconnected, connection to the server."""
+
+        with self._lock:
+            self.connects += 1
+        return self._conn_class(self.host, timeout=self.timeout)
+
+    def _put_connection(self, conn):
+        """Return a connection to the idle list, or close it if list full."""
+
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                # most recently used is reused first, it's least likely closed
+                self._idle.append(conn)
+                return
+        conn.close()
@@ -5,6 +5,11 @@ A tile source that serves OpenStreetMap tiles from the internet.
 import math
 import pyslip.tiles_net as tiles_net
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 ###############################################################################
 # Change values below here to configure an internet tile source.
@@ -31,7 +36,7 @@ TileLevels = range(17)
 MaxServerRequests = 2
 
 # set maximum number of in-memory tiles for each level
-MaxLRU = 10000
+MaxLRU = 1000
 
 # size of tiles
 TileWidth = 256
@@ -79,6 +84,22 @@ class Tiles(tiles_net.Tiles):
 
         return (xtile, ytile)
 
+    def Geo2TileArray(self, geo):
+        """Convert an array of geo coordinates to tile fractional coordinates.
+
+        geo  NumPy array of shape (N, 2), each row (xgeo, ygeo)
+
+        Returns a NumPy array of shape (N, 2), each row (xtile, ytile).
+        """
+
+        lat_rad = numpy.radians(geo[:,1])
+        n = 2.0 ** self.level
+        tile = numpy.empty(geo.shape)
+        tile[:,0] = (geo[:,0] + 180.0) / 360.0 * n
+        tile[:,1] = ((1.0 - numpy.log(numpy.tan(lat_rad) + (1.0/numpy.cos(lat_rad))) / numpy.pi) / 2.0) * n
+
+        return tile
+
     def Tile2Geo(self, tile):
         """Convert tile fractional coordinates to geo for level in use.
 
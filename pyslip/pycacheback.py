@@ -2,9 +2,106 @@
 An extended dictionary offering limited LRU entries in the dictionary
 and an interface to an unlimited backing store.
 
+The LRU ordering is kept in an OrderedDict of keys so that a hit, an
+insert and an eviction are all O(1) operations.
+
+The in-memory store can be limited by number of entries ('max_lru'),
+by the total size of the entries in bytes ('max_bytes'), or both.
+Override _sizeof() to give the size of a stored value.
+
+The cache may be used from more than one thread.  A single lock guards
+the in-memory dictionary and LRU bookkeeping, which are O(1) operations.
+The slow backing store operations are done outside that lock, under one
+of a set of striped per-key locks, so threads working on different keys
+don't wait for each other's I/O.
+
+Each cache has a 'stats' attribute, a CacheStats object counting hits,
+misses and evictions and timing backing store reads.
+
 https://github.com/rzzzwilson/pyCacheBack
 """
 
+import time
+import bisect
+import collections
+import threading
+
+
+# marks "no new value" in calls to _reorder_lru()
+_NoValue = object()
+
+
+class CacheStats(object):
+    """Thread-safe counters and latency histograms for a cache.
+
+    Counters are created on first use.  Latencies are recorded in seconds
+    into histograms with the bucket upper bounds in LatencyBuckets, the
+    last bucket counting everything slower.
+    """
+
+    # upper bounds of latency histogram buckets, in seconds
+    LatencyBuckets = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005,
+                      0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Set all counters and histograms back to zero."""
+
+        with self._lock:
+            self._counters = collections.defaultdict(int)
+            self._latencies = {}
+            self._since = time.time()
+
+    def count(self, name, n=1):
+        """Add 'n' to the counter 'name'."""
+
+        with self._lock:
+            self._counters[name] += n
+
+    def observe(self, name, seconds):
+        """Record a latency of 'seconds' in the histogram 'name'."""
+
+        bucket = bisect.bisect_left(self.LatencyBuckets, seconds)
+        with self._lock:
+            try:
+                hist = self._latencies[name]
+            except KeyError:
+                hist = self._latencies[name] = [0, 0.0, 0.0,
+                                                [0]*(len(self.LatencyBuckets)+1)]
+            hist[0] += 1
+            hist[1] += seconds
+            hist[2] = max(hist[2], seconds)
+            hist[3][bucket] += 1
+
+    def snapshot(self):
+        """Return a copy of the current statistics.
+
+        Returns a dictionary:
+            {'since': <time of last reset>,
+             'counters': {<name>: <count>, ...},
+             'latency': {<name>: {'count': <number of latencies>,
+                                  'total': <sum of latencies>,
+                                  'max': <maximum latency>,
+                                  'buckets': [(<upper bound>, <count>), ...]},
+                         ...}}
+        The upper bound of the last bucket is None.
+        """
+
+        bounds = self.LatencyBuckets + (None,)
+        with self._lock:
+            latency = {}
+            for (name, (count, total, maximum, buckets)) in self._latencies.items():
+                latency[name] = {'count': count,
+                                 'total': total,
+                                 'max': maximum,
+                                 'buckets': list(zip(bounds, buckets))}
+            return {'since': self._since,
+                    'counters': dict(self._counters),
+                    'latency': latency}
+
 
 class pyCacheBack(dict):
     """An LRU limited in-memory store fronting an unlimited on-disk store."""
@@ -12,77 +109,202 @@ class pyCacheBack(dict):
     # default maximum number of key/value pairs for pyCacheBack
     DefaultMaxLRU = 1000
 
+    # default maximum number of bytes for pyCacheBack (None means no limit)
+    DefaultMaxBytes = None
+
     # default path to tiles directory
     DefaultTilesDir = 'tiles'
 
+    # number of striped locks guarding backing store access
+    NumKeyLocks = 32
+
     def __init__(self, *args, **kwargs):
-        self._lru_list = []
+        self.stats = CacheStats()
+        self._lock = threading.RLock()
+        self._key_locks = [threading.Lock() for _ in range(self.NumKeyLocks)]
+        # keys in LRU order, least recently used first, value is entry size
+        self._lru = collections.OrderedDict()
         self._max_lru = kwargs.pop('max_lru', self.DefaultMaxLRU)
+        self._max_bytes = kwargs.pop('max_bytes', self.DefaultMaxBytes)
         self._tiles_dir = kwargs.pop('tiles_dir', self.DefaultTilesDir)
+        self._bytes = 0
+        self._high_bytes = 0
+        self._high_entries = 0
         super().__init__(*args, **kwargs)
+        for (key, value) in super().items():
+            self._reorder_lru(key, value=value)
+        self._enforce_lru_size()
 
     def __getitem__(self, key):
-        if key in self:
-            value = super().__getitem__(key)
-        else:
-            value = self._get_from_back(key)
-        self._reorder_lru(key)
+        with self._lock:
+            if key in self:
+                self._reorder_lru(key)
+                self.stats.count('memory_hits')
+                return super().__getitem__(key)
+
+        # not in memory, only one thread reads the backing store for a key
+        with self._key_lock(key):
+            with self._lock:
+                # another thread may have got it while we waited
+                if key in self:
+                    self._reorder_lru(key)
+                    self.stats.count('memory_hits')
+                    return super().__getitem__(key)
+
+            # promote the backing store value into memory, but don't write
+            # it back to the backing store
+            start = time.perf_counter()
+            try:
+                value = self._get_from_back(key)
+            except KeyError:
+                self.stats.count('misses')
+                raise
+            self.stats.observe('get_from_back', time.perf_counter() - start)
+            self.stats.count('back_hits')
+
+            with self._lock:
+                super().__setitem__(key, value)
+                self._reorder_lru(key, value=value)
+                self._enforce_lru_size()
+
         return value
 
     def __setitem__(self, key, value):
-        super().__setitem__(key, value)
-        self._put_to_back(key, value)
-        self._reorder_lru(key)
-        self._enforce_lru_size()
+        self.put(key, value)
+
+    def put(self, key, value, back=True):
+        """Put 'value' into the cache with 'key'.
+
+        If 'back' is False the value is only stored in memory and is not
+        written to the backing store.
+        """
+
+        with self._key_lock(key):
+            with self._lock:
+                super().__setitem__(key, value)
+                self._reorder_lru(key, value=value)
+                self._enforce_lru_size()
+            if back:
+                self._put_to_back(key, value)
 
     def __delitem__(self, key):
-        super().__delitem__(key)
-        self._reorder_lru(key, remove=True)
+        with self._lock:
+            super().__delitem__(key)
+            self._reorder_lru(key, remove=True)
 
     def clear(self):
-        super().clear()
-        self._lru_list = []
+        with self._lock:
+            super().clear()
+            self._lru.clear()
+            self._bytes = 0
 
     def pop(self, *args):
         k = args[0]
-        try:
-            self._lru_list.remove(k)
-        except ValueError:
-            pass
-        return super().pop(*args)
+        with self._lock:
+            self._reorder_lru(k, remove=True)
+            return super().pop(*args)
 
     def popitem(self):
-        kv_return = super().popitem()
-        try:
-            self._lru_list.remove(kv_return[0])
-        except ValueError:
-            pass
-        return kv_return
-
-    def _reorder_lru(self, key, remove=False):
+        with self._lock:
+            kv_return = super().popitem()
+            self._reorder_lru(kv_return[0], remove=True)
+            return kv_return
+
+    def info(self):
+        """Return a dictionary describing in-memory cache usage.
+
+        The dictionary has keys:
+            'entries'       number of in-memory entries
+            'bytes'         total size of in-memory entries
+            'high_entries'  highest number of in-memory entries seen
+            'high_bytes'    highest total size of in-memory entries seen
+            'max_lru'       the entry limit (None or 0 means no limit)
+            'max_bytes'     the byte limit (None means no limit)
+        """
+
+        with self._lock:
+            return {'entries': len(self._lru),
+                    'bytes': self._bytes,
+                    'high_entries': self._high_entries,
+                    'high_bytes': self._high_bytes,
+                    'max_lru': self._max_lru,
+                    'max_bytes': self._max_bytes}
+
+    def set_max_bytes(self, max_bytes):
+        """Set the in-memory byte limit, evicting entries if required.
+
+        max_bytes  the new limit in bytes (None means no limit)
+        """
+
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._enforce_lru_size()
+
+    def _key_lock(self, key):
+        """Return the striped lock that guards backing store access for 'key'."""
+
+        return self._key_locks[hash(key) % len(self._key_locks)]
+
+    def _reorder_lru(self, key, remove=False, value=_NoValue):
         """Move key in LRU (if it exists) to 'recent' end.
 
         If 'remove' is True just remove from the LRU.
+        If 'value' is supplied the key has a new value, so update the size.
+        Must be called holding self._lock.
         """
 
-        try:
-            self._lru_list.remove(key)
-        except ValueError:
-            pass
         if remove:
+            self._bytes -= self._lru.pop(key, 0)
             return
-        self._lru_list.insert(0, key)
+
+        if value is _NoValue:
+            try:
+                self._lru.move_to_end(key)
+                return
+            except KeyError:
+                value = super().get(key)
+
+        # new value for key, account for the size change
+        size = self._sizeof(value)
+        self._bytes += size - self._lru.pop(key, 0)
+        self._lru[key] = size
 
     def _enforce_lru_size(self):
-        """Enforce LRU size limit in cache dictionary."""
+        """Enforce LRU size limits in cache dictionary.
+
+        Evicts least recently used entries one at a time until the
+        in-memory dictionary is back within the entry and byte limits.
+        The most recently used entry is never evicted by the byte limit.
+        Must be called holding self._lock.
+        """
 
         # if a limit was defined and we have blown it
-        if self._max_lru and len(self) > self._max_lru:
-            # make sure in-memory dictionary doesn't get bigger
-            for key in self._lru_list[self._max_lru:]:
-                super(pyCacheBack, self).__delitem__(key)
-            # also truncate the LRU list
-            self._lru_list = self._lru_list[:self._max_lru]
+        if self._max_lru:
+            while len(self._lru) > self._max_lru:
+                self._evict_one()
+        if self._max_bytes is not None:
+            while self._bytes > self._max_bytes and len(self._lru) > 1:
+                self._evict_one()
+
+        # remember the high-water marks
+        self._high_entries = max(self._high_entries, len(self._lru))
+        self._high_bytes = max(self._high_bytes, self._bytes)
+
+    def _evict_one(self):
+        """Evict the least recently used entry from memory."""
+
+        (key, size) = self._lru.popitem(last=False)
+        self._bytes -= size
+        super().pop(key, None)
+        self.stats.count('evictions')
+
+    def _sizeof(self, value):
+        """Return the in-memory size of 'value' in bytes.
+
+        Override this to give a real size for stored values.
+        """
+
+        return 0
 
     #####
     # override the following two methods to implement the backing cache
@@ -100,4 +322,3 @@ class pyCacheBack(dict):
         """
 
         raise KeyError
-
@@ -27,8 +27,15 @@ Some semantics:
 
 
 import sys
+import time
+import collections
 import wx
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 try:
     import pyslip.log as log
     log = log.Log('pyslip.log')
@@ -113,6 +120,17 @@ class _BufferedCanvas(wx.Panel):
 
         raise NotImplementedError('_BufferedCanvas.Draw() was not overridden!')
 
+    def DrawRegion(self, dc, region):
+        """Called when part of the canvas needs to be re-drawn.
+
+        dc      device context to draw on, clipped to 'region'
+        region  a wx.Region of the part to draw
+
+        By default the whole canvas is drawn, clipped to the region.
+        """
+
+        self.Draw(dc)
+
     def Update(self):
         """Causes the canvas to be updated."""
 
@@ -120,6 +138,62 @@ class _BufferedCanvas(wx.Panel):
         dc.Clear()      # because maybe view size > map size
         self.Draw(dc)
 
+    def UpdateRegion(self, region, copy_all=False):
+        """Causes part of the canvas to be updated.
+
+        region    a wx.Region of the part to update
+        copy_all  if True copy the whole buffer to the screen
+
+        Only the region is redrawn in the back buffer and, unless
+        'copy_all' is True, copied to the screen.
+        """
+
+        dc = wx.MemoryDC(self.buffer)
+        dc.SetDeviceClippingRegion(region)
+
+        # because maybe view size > map size
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        dc.SetBrush(wx.Brush(self.GetBackgroundColour()))
+        box = region.GetBox()
+        dc.DrawRectangle(box)
+
+        self.DrawRegion(dc, region)
+        dc.DestroyClippingRegion()
+
+        if copy_all:
+            box = wx.Rect(0, 0, self.buffer.GetWidth(), self.buffer.GetHeight())
+        wx.ClientDC(self).Blit(box.x, box.y, box.width, box.height,
+                               dc, box.x, box.y)
+        dc.SelectObject(wx.NullBitmap)
+
+    def ScrollBuffer(self, dx, dy):
+        """Move the canvas contents and draw just the uncovered parts.
+
+        dx, dy  pixels to move the contents right and down
+
+        The back buffer is shifted and only the strips along the edges
+        it uncovers are redrawn.
+        """
+
+        (width, height) = (self.buffer.GetWidth(), self.buffer.GetHeight())
+        if abs(dx) >= width or abs(dy) >= height:
+            # nothing left to keep
+            self.Update()
+            return
+
+        # move the part still in view, through a copy as it overlaps
+        kept = wx.Rect(max(0, -dx), max(0, -dy),
+                       width - abs(dx), height - abs(dy))
+        moved = self.buffer.GetSubBitmap(kept)
+        dc = wx.MemoryDC(self.buffer)
+        dc.DrawBitmap(moved, max(0, dx), max(0, dy), False)
+        dc.SelectObject(wx.NullBitmap)
+
+        uncovered = wx.Region(0, 0, width, height)
+        uncovered.Subtract(wx.Rect(max(0, dx), max(0, dy),
+                                   kept.width, kept.height))
+        self.UpdateRegion(uncovered, copy_all=True)
+
     def OnPaint(self, event):
         """Paint the canvas to the screen."""
 
@@ -182,6 +256,8 @@ class _Layer(object):
         self.name = name                # name of this layer
         self.type = ltype               # type of layer
         self.id = id                    # ID of this layer
+        self.extent = None              # cached extent, see pySlip.layer_extent()
+        self.cache = None               # cached drawing, see pySlip.draw_layer()
 
     def __str__(self):
         return ('<pyslip Layer: id=%d, name=%s, map_rel=%s, visible=%s>'
@@ -244,6 +320,28 @@ class pySlip(_BufferedCanvas):
     # panel background colour
     BackgroundColour = '#808080'
 
+    # maximum redraws per second caused by tiles arriving from a server,
+    # tiles arriving in the same frame share one redraw
+    TileRedrawFPS = 30
+
+    # if the tiles arriving in a frame cover more than this fraction of
+    # the view redraw the whole view, else redraw just those tiles
+    PartialRedrawMax = 0.5
+
+    # map-relative layers are drawn once into a bitmap covering the view
+    # and this many pixels around it, the bitmap is then just copied to
+    # the view until the level changes or the view moves off the bitmap
+    LayerCache = True
+    LayerCacheMargin = 256
+
+    # most bytes used by all layer cache bitmaps, the bitmaps of the least
+    # recently drawn layers are dropped first
+    LayerCacheBytes = 64 * 1024 * 1024
+
+    # with NumPy, lists of at least this many geo points are converted
+    # to view coordinates in one go rather than a point at a time
+    ArrayMinPoints = 16
+
     # default point attributes - map relative
     DefaultPointPlacement = 'cc'
     DefaultPointRadius = 3
@@ -362,6 +460,7 @@ class pySlip(_BufferedCanvas):
         self.last_drag_x = None                 # previous drag position (X)
         self.last_drag_y = None                 # previous drag position (Y)
         self.layer_mapping = {}                 # maps layer ID to layer data
+        self.layer_cache_lru = collections.OrderedDict() # layer ID -> cache bytes, oldest first
         self.layer_z_order = []                 # layer Z order, contains layer IDs
         self.level = None
         self.map_height = None                  # set in UseLevel()
@@ -380,6 +479,12 @@ class pySlip(_BufferedCanvas):
         self.sbox_h = None
         self.sbox_w = None
         self.shift_down = False                 # state of the SHIFT key
+        self.tile_redraw_pending = False        # True if tile redraw is scheduled
+        self.tile_redraw_keys = set()           # keys of tiles to redraw
+        self.redraw_region = None               # region being redrawn, if partial
+        self.tile_redraw_time = 0.0             # time of the last tile redraw
+        self.tile_redraws = 0                   # number of tile redraws
+        self.tile_redraws_saved = 0             # tile arrivals not needing a redraw
         self.tile_src = None                    # source of tiles
         self.tile_width = None                  # tile width
         self.tile_height = None                 # tile height
@@ -468,13 +573,55 @@ class pySlip(_BufferedCanvas):
         img    tile image
         bmp    tile bitmap
 
-        We don't use any of the above - just redraw the entire canvas.
-        This is because the new tile is already in the in-memory cache.
+        The new tile is already in the in-memory cache, so we just redraw
+        the part of the canvas it covers.
 
-        On a slow display we could just redraw the new tile.
+        Tiles often arrive in bursts, so the redraw is put off until the
+        next frame, at most TileRedrawFPS a second, and all tiles arriving
+        before then share it.
         """
 
-        self.Update()
+        if level != self.level:
+            # not in the view any more
+            self.tile_redraws_saved += 1
+            return
+
+        self.tile_redraw_keys.add((level, x, y))
+        if self.tile_redraw_pending:
+            self.tile_redraws_saved += 1
+            return
+
+        self.tile_redraw_pending = True
+        delay = self.tile_redraw_time + 1.0/self.TileRedrawFPS - time.monotonic()
+        wx.CallLater(max(1, int(delay * 1000)), self.OnTileRedraw)
+
+    def OnTileRedraw(self):
+        """Redraw the canvas for the tiles that arrived since the last frame."""
+
+        # the widget may have gone while the redraw was pending
+        if not self:
+            return
+
+        self.tile_redraw_pending = False
+        self.tile_redraw_time = time.monotonic()
+        self.tile_redraws += 1
+
+        keys = [key for key in self.tile_redraw_keys if key[0] == self.level]
+        self.tile_redraw_keys.clear()
+        if (len(keys) * self.tile_width * self.tile_height
+                > self.PartialRedrawMax * self.view_width * self.view_height):
+            self.Update()
+            return
+
+        region = wx.Region()
+        (offset_x, offset_y) = (int(self.view_offset_x), int(self.view_offset_y))
+        for (_, x, y) in keys:
+            region.Union(x * self.tile_width - offset_x,
+                         y * self.tile_height - offset_y,
+                         self.tile_width, self.tile_height)
+        region.Intersect(0, 0, self.view_width, self.view_height)
+        if not region.IsEmpty():
+            self.UpdateRegion(region)
 
     def OnEnterWindow(self, event):
         """Event handler when mouse enters widget."""
@@ -491,6 +638,10 @@ class pySlip(_BufferedCanvas):
     def OnLeaveWindow(self, event):
         """Event handler when mouse leaves widget."""
 
+        # a drag ends here, so redraw everything
+        if self.was_dragging:
+            self.Update()
+
         # turn off drag
         self.was_dragging = False
         self.last_drag_x = self.last_drag_y = None
@@ -1113,7 +1264,9 @@ class pySlip(_BufferedCanvas):
         id  the layer id
         """
 
-        self.layer_mapping[id].visible = True
+        layer = self.layer_mapping[id]
+        layer.visible = True
+        self.drop_layer_cache(layer)
         self.Update()
 
     def HideLayer(self, id):
@@ -1122,7 +1275,9 @@ class pySlip(_BufferedCanvas):
         id  the layer id
         """
 
-        self.layer_mapping[id].visible = False
+        layer = self.layer_mapping[id]
+        layer.visible = False
+        self.drop_layer_cache(layer)
         self.Update()
 
     def DeleteLayer(self, id):
@@ -1136,6 +1291,7 @@ class pySlip(_BufferedCanvas):
             # see if what we are about to remove might be visible
             layer = self.layer_mapping[id]
             visible = layer.visible
+            self.drop_layer_cache(layer)
 
             del layer
             self.layer_z_order.remove(id)
@@ -1144,6 +1300,18 @@ class pySlip(_BufferedCanvas):
             if visible:
                 self.Update()
 
+    def RefreshLayer(self, id):
+        """Redraw a layer after its data was changed in place.
+
+        id  the layer id
+        """
+
+        layer = self.layer_mapping[id]
+        layer.extent = None
+        self.drop_layer_cache(layer)
+        if layer.visible:
+            self.Update()
+
     def SetLayerShowLevels(self, id, show_levels=None):
         """Update the show_levels list for a layer.
 
@@ -1220,6 +1388,162 @@ class pySlip(_BufferedCanvas):
     # Layer drawing routines
     ######
 
+    def layer_dc(self, dc):
+        """Return a GCDC to draw a layer on 'dc', allowing transparent colours.
+
+        The GCDC is clipped to the region being redrawn, if any.
+        """
+
+        gcdc = wx.GCDC(dc)
+        if self.redraw_region is not None:
+            gcdc.SetDeviceClippingRegion(self.redraw_region)
+        return gcdc
+
+    def draw_layer(self, dc, layer):
+        """Draw a layer on 'dc'.
+
+        dc     the device context to draw on
+        layer  the _Layer object
+
+        A map-relative layer is copied from its cached bitmap, which is
+        drawn again only if it was drawn for another tileset or level, or
+        doesn't cover the view.  Only the part of the bitmap in the view,
+        or in the region being redrawn, is copied.
+        """
+
+        if not (self.LayerCache and layer.map_rel):
+            layer.painter(dc, layer.data, map_rel=layer.map_rel)
+            return
+
+        (offset_x, offset_y) = (int(self.view_offset_x), int(self.view_offset_y))
+        cache = layer.cache
+        if (cache is None or cache[0] is not self.tile_src
+                or cache[1] != self.level
+                or offset_x < cache[2] or offset_y < cache[3]
+                or offset_x + self.view_width > cache[2] + cache[4]
+                or offset_y + self.view_height > cache[3] + cache[5]):
+            cache = self.cache_layer(layer, offset_x, offset_y)
+        self.layer_cache_lru.move_to_end(layer.id)
+
+        # copy just the parts of the bitmap in the view or redrawn region
+        (_, _, map_x, map_y, width, height, bitmap) = cache
+        bounds = wx.Rect(map_x - offset_x, map_y - offset_y, width, height)
+        if self.redraw_region is None:
+            rects = [wx.Rect(0, 0, self.view_width, self.view_height)]
+        else:
+            rects = []
+            rect_iter = wx.RegionIterator(self.redraw_region)
+            while rect_iter.HaveRects():
+                rects.append(rect_iter.GetRect())
+                rect_iter.Next()
+        for rect in rects:
+            rect = rect.Intersect(bounds)
+            if rect.width > 0 and rect.height > 0:
+                part = bitmap.GetSubBitmap(wx.Rect(rect.x - bounds.x,
+                                                   rect.y - bounds.y,
+                                                   rect.width, rect.height))
+                dc.DrawBitmap(part, rect.x, rect.y, False)
+
+    def cache_layer(self, layer, offset_x, offset_y):
+        """Draw a layer into a new cache bitmap.
+
+        layer               the _Layer object
+        offset_x, offset_y  the view offset, in map pixels
+
+        Returns the new layer.cache tuple
+            (tile_src, level, map_x, map_y, width, height, bitmap)
+        where (map_x, map_y) is the map pixel at the bitmap top-left.
+        """
+
+        margin = self.LayerCacheMargin
+        (map_x, map_y) = (offset_x - margin, offset_y - margin)
+        width = self.view_width + 2*margin
+        height = self.view_height + 2*margin
+        bitmap = wx.Bitmap.FromRGBA(width, height, 0, 0, 0, 0)
+
+        # the painters draw the view, so make the view the bitmap for now
+        saved = (self.view_offset_x, self.view_offset_y,
+                 self.view_width, self.view_height, self.redraw_region)
+        (self.view_offset_x, self.view_offset_y, self.view_width,
+             self.view_height, self.redraw_region) = (map_x, map_y,
+                                                      width, height, None)
+        dc = wx.MemoryDC(bitmap)
+        try:
+            layer.painter(dc, layer.data, map_rel=True)
+        finally:
+            dc.SelectObject(wx.NullBitmap)
+            (self.view_offset_x, self.view_offset_y, self.view_width,
+                 self.view_height, self.redraw_region) = saved
+
+        layer.cache = (self.tile_src, self.level, map_x, map_y,
+                       width, height, bitmap)
+
+        # keep all the cache bitmaps within LayerCacheBytes
+        self.layer_cache_lru[layer.id] = width * height * 4
+        self.layer_cache_lru.move_to_end(layer.id)
+        while (sum(self.layer_cache_lru.values()) > self.LayerCacheBytes
+                   and len(self.layer_cache_lru) > 1):
+            (id, _) = self.layer_cache_lru.popitem(last=False)
+            if id in self.layer_mapping:
+                self.layer_mapping[id].cache = None
+
+        return layer.cache
+
+    def drop_layer_cache(self, layer):
+        """Forget the cached drawing of a layer.
+
+        layer  the _Layer object
+        """
+
+        layer.cache = None
+        self.layer_cache_lru.pop(layer.id, None)
+
+    def layer_extent(self, layer):
+        """Get the view extent of the data in a layer.
+
+        layer  the _Layer object
+
+        Returns (left, right, top, bottom) in view coordinates, or None
+        if the layer may draw anywhere in the view.
+        """
+
+        if not layer.map_rel:
+            return None
+
+        # the geo extent and a padding in pixels for the drawn size and
+        # offsets never change, so we work it out once
+        if layer.extent is None:
+            layer.extent = False
+            if layer.type == self.TypePoint:
+                geo = [d[:2] for d in layer.data]
+                pads = [2*d[3] + abs(d[5]) + abs(d[6]) for d in layer.data]
+            elif layer.type == self.TypeImage:
+                geo = [d[:2] for d in layer.data]
+                pads = [d[3] + d[4] + abs(d[6]) + abs(d[7]) + d[8]
+                            for d in layer.data]
+            elif layer.type == self.TypePolygon:
+                geo = [p for d in layer.data for p in d[0]]
+                pads = [d[2] + abs(d[7]) + abs(d[8]) for d in layer.data]
+            elif layer.type == self.TypePolyline:
+                geo = [p for d in layer.data for p in d[0]]
+                pads = [d[2] + abs(d[4]) + abs(d[5]) for d in layer.data]
+            else:
+                # text size isn't known until drawn
+                geo = None
+            if geo:
+                layer.extent = (min(g[0] for g in geo), max(g[0] for g in geo),
+                                min(g[1] for g in geo), max(g[1] for g in geo),
+                                max(pads) + 1)
+
+        if not layer.extent:
+            return None
+
+        (min_x, max_x, min_y, max_y, pad) = layer.extent
+        (x1, y1) = self.Geo2View((min_x, min_y))
+        (x2, y2) = self.Geo2View((max_x, max_y))
+        return (min(x1, x2) - pad, max(x1, x2) + pad,
+                min(y1, y2) - pad, max(y1, y2) + pad)
+
     def DrawPointLayer(self, dc, data, map_rel):
         """Draw a points layer.
 
@@ -1230,18 +1554,20 @@ class pySlip(_BufferedCanvas):
         """
 
         # allow transparent colours
-        dc = wx.GCDC(dc)
+        dc = self.layer_dc(dc)
 
         # get correct pex function
         pex = self.PexPointView
         if map_rel:
-            pex = self.PexPoint
+            pex = self.pex_point
 
         # draw points on map/view
         cache_colour = None     # speed up drawing mostly not changing colours
 
-        for (x, y, place, radius, colour, x_off, y_off, udata) in data:
-            (pt, ex) = pex(place, (x,y), x_off, y_off, radius)
+        views = self.layer_views(data, map_rel)
+        for ((x, y, place, radius, colour, x_off, y_off, udata),
+                 view) in zip(data, views):
+            (pt, ex) = pex(place, view, x_off, y_off, radius)
             if ex and radius:  # don't draw if not on screen or zero radius
                 if cache_colour != colour:
                     dc.SetPen(wx.Pen(colour))
@@ -1260,19 +1586,21 @@ class pySlip(_BufferedCanvas):
         """
 
         # allow transparent colours
-        dc = wx.GCDC(dc)
+        dc = self.layer_dc(dc)
 
         # get correct pex function
         pex = self.PexExtentView
         if map_rel:
-            pex = self.PexExtent
+            pex = self.pex_extent
 
         # draw the images
         cache_colour = None     # speed up drawing mostly unchanging colours
 
-        for (lon, lat, bmap, w, h, place,
-                 x_off, y_off, radius, colour, idata) in images:
-            (pt, ex) = pex(place, (lon, lat), x_off, y_off, w, h)
+        views = self.layer_views(images, map_rel)
+        for ((lon, lat, bmap, w, h, place,
+                  x_off, y_off, radius, colour, idata),
+                 view) in zip(images, views):
+            (pt, ex) = pex(place, view, x_off, y_off, w, h)
             if ex:
                 (ix, _, iy, _) = ex
                 dc.DrawBitmap(bmap, ix, iy, False)
@@ -1296,20 +1624,22 @@ class pySlip(_BufferedCanvas):
         """
 
         # we need the size of the DC
-        dc = wx.GCDC(dc)		# allow transparent colours
+        dc = self.layer_dc(dc)  # allow transparent colours
 
         # get correct pex function for mode (map/view)
         pex = self.PexExtentView
         if map_rel:
-            pex = self.PexExtent
+            pex = self.pex_extent
 
         # draw text on map/view
         cache_textcolour = None # speed up mostly unchanging data
         cache_font = None
         cache_colour = None
 
-        for (lon, lat, tdata, place, radius, colour,
-                textcolour, fontname, fontsize, x_off, y_off, data) in text:
+        views = self.layer_views(text, map_rel)
+        for ((lon, lat, tdata, place, radius, colour,
+                 textcolour, fontname, fontsize, x_off, y_off, data),
+                view) in zip(text, views):
 
             # set font characteristics so we calculate text width/height
             if cache_textcolour != textcolour:
@@ -1325,7 +1655,7 @@ class pySlip(_BufferedCanvas):
             (w, h, _, _) = dc.GetFullTextExtent(tdata)
 
             # get point + extent information (each can be None if off-view)
-            (pt, ex) = pex(place, (lon, lat), x_off, y_off, w, h)
+            (pt, ex) = pex(place, view, x_off, y_off, w, h)
             if ex:
                 (lx, _, ty, _) = ex
                 dc.DrawText(tdata, lx, ty)
@@ -1349,7 +1679,7 @@ class pySlip(_BufferedCanvas):
         """
 
         # allow transparent colours
-        dc = wx.GCDC(dc)
+        dc = self.layer_dc(dc)
 
         # get the correct pex function for mode (map/view)
         pex = self.PexPolygonView
@@ -1391,7 +1721,7 @@ class pySlip(_BufferedCanvas):
         """
 
         # allow transparent colours
-        dc = wx.GCDC(dc)
+        dc = self.layer_dc(dc)
 
         # get the correct pex function for mode (map/view)
         pex = self.PexPolygonView
@@ -1523,6 +1853,17 @@ class pySlip(_BufferedCanvas):
 
         return (self.level, geo)
 
+    def GetRedrawStats(self):
+        """Get counts of redraws caused by tiles arriving from a server.
+
+        Returns a dictionary with 'tile_redraws', the number of redraws
+        done, and 'tile_redraws_saved', the number of tile arrivals that
+        shared a redraw with an earlier tile.
+        """
+
+        return {'tile_redraws': self.tile_redraws,
+                'tile_redraws_saved': self.tile_redraws_saved}
+
 ######
 # Convert between geo and view coordinates
 ######
@@ -1540,6 +1881,49 @@ class pySlip(_BufferedCanvas):
         return ((tx * self.tile_src.tile_size_x) - self.view_offset_x,
                 (ty * self.tile_src.tile_size_y) - self.view_offset_y)
 
+    def Geo2ViewArray(self, geo):
+        """Convert an array of geo coords to view.
+
+        geo  NumPy array of shape (N, 2), each row (xgeo, ygeo)
+
+        Return a NumPy array of shape (N, 2) in view coordinates.
+        Needs NumPy.
+        """
+
+        view = self.tile_src.Geo2TileArray(geo)
+        view *= (self.tile_src.tile_size_x, self.tile_src.tile_size_y)
+        view -= (self.view_offset_x, self.view_offset_y)
+        return view
+
+    def Geo2ViewList(self, geos):
+        """Convert a list of geo coords to view.
+
+        geos  list of tuples (xgeo, ygeo)
+
+        Return a list of tuples (xview, yview) in view coordinates.
+        Long lists are converted with NumPy, if installed.
+        """
+
+        if numpy is not None and len(geos) >= self.ArrayMinPoints:
+            view = self.Geo2ViewArray(numpy.array(geos, dtype=float))
+            return list(zip(view[:,0].tolist(), view[:,1].tolist()))
+        return [self.Geo2View(geo) for geo in geos]
+
+    def layer_views(self, data, map_rel):
+        """Get the view coords of the objects in layer data.
+
+        data     layer data, a sequence of tuples starting (x, y)
+        map_rel  True if (x, y) are geo coords, else view coords
+
+        Returns a list of (x, y) in view coordinates, converted all
+        together if map-relative.
+        """
+
+        points = [d[:2] for d in data]
+        if map_rel:
+            return self.Geo2ViewList(points)
+        return points
+
 
     def Geo2ViewMasked(self, geo):
         """Convert a geo (lon+lat) position to view pixel coords.
@@ -1581,8 +1965,20 @@ class pySlip(_BufferedCanvas):
         The 'extent' here is the extent of the point+radius.
         """
 
-        # get point view coords
-        (xview, yview) = self.Geo2View(geo)
+        return self.pex_point(place, self.Geo2View(geo), x_off, y_off, radius)
+
+    def pex_point(self, place, view, x_off, y_off, radius):
+        """PexPoint() for a map-relative point already in view coords.
+
+        place         placement string
+        view          point position tuple (xview, yview)
+        x_off, y_off  X and Y offsets
+
+        Used when the points of a layer are converted to view coords
+        together, see layer_views().
+        """
+
+        (xview, yview) = view
         point = self.point_placement(place, xview, yview, x_off, y_off)
         (px, py) = point
 
@@ -1656,8 +2052,21 @@ class pySlip(_BufferedCanvas):
         An extent object can be either an image object or a text object.
         """
 
-        # get point view coords
-        point = self.Geo2View(geo)
+        return self.pex_extent(place, self.Geo2View(geo), x_off, y_off, w, h)
+
+    def pex_extent(self, place, view, x_off, y_off, w, h):
+        """PexExtent() for a map-relative extent already in view coords.
+
+        place         placement string
+        view          point position tuple (xview, yview)
+        x_off, y_off  X and Y offsets
+        w, h          width and height of extent in pixels
+
+        Used when the points of a layer are converted to view coords
+        together, see layer_views().
+        """
+
+        point = view
         (px, py) = point
 
         # extent = (left, right, top, bottom) in view coords
@@ -1724,6 +2133,19 @@ class pySlip(_BufferedCanvas):
         coords).  Return None for either or both if off-view.
         """
 
+        # long polygons/lines are converted, placed and culled as arrays
+        if numpy is not None and len(poly) >= self.ArrayMinPoints:
+            view = self.Geo2ViewArray(numpy.array(poly, dtype=float))
+            view += self.point_placement(place, 0, 0, x_off, y_off)
+            on_view = ((view[:,0] >= 0) & (view[:,0] < self.view_width)
+                       & (view[:,1] >= 0) & (view[:,1] < self.view_height))
+            if not on_view.any():
+                return (None, None)
+            (elx, ety) = view.min(axis=0).tolist()
+            (erx, eby) = view.max(axis=0).tolist()
+            return (list(zip(view[:,0].tolist(), view[:,1].tolist())),
+                    (elx, erx, ety, eby))
+
         # get polygon/line points in perturbed view coordinates
         view = []
         for geo in poly:
@@ -1826,6 +2248,7 @@ class pySlip(_BufferedCanvas):
                 self.was_dragging = True
                 dx = self.last_drag_x - x
                 dy = self.last_drag_y - y
+                (old_x, old_y) = (self.view_offset_x, self.view_offset_y)
 
                 # move the map in the view
                 self.view_offset_x += dx
@@ -1860,6 +2283,11 @@ class pySlip(_BufferedCanvas):
 
                 self.RecalcViewLimits()
 
+                # move what's drawn, the drag end redraws everything
+                self.ScrollView(int(old_x) - int(self.view_offset_x),
+                                int(old_y) - int(self.view_offset_y))
+                return
+
             # redraw client area
             self.Update()
 
@@ -1980,6 +2408,10 @@ class pySlip(_BufferedCanvas):
                         # user code possibly updated screen
                         delayed_paint = True
 
+        # a full redraw at the end of a drag
+        if self.was_dragging:
+            delayed_paint = True
+
         # turn off drag
         self.was_dragging = False
 
@@ -2149,32 +2581,38 @@ class pySlip(_BufferedCanvas):
         if the view is smaller than the map.
         """
 
+        # tiles go at whole pixels, rounded as in DrawRegion() and
+        # draw_layer() so a partial redraw matches a full one
+        (offset_x, offset_y) = (int(self.view_offset_x), int(self.view_offset_y))
+
         # figure out how to draw tiles
-        if self.view_offset_x < 0:
+        if offset_x < 0:
             # View > Map in X - centre in X direction
             col_list = range(self.tile_src.num_tiles_x)
-            x_pix_start = -self.view_offset_x
+            x_pix_start = -offset_x
         else:
             # Map > View - determine layout in X direction
-            start_x_tile = int(self.view_offset_x / self.tile_width)
-            stop_x_tile = int((self.view_offset_x + self.view_width
-                               + self.tile_width - 1) / self.tile_width)
+            start_x_tile = offset_x // self.tile_width
+            stop_x_tile = ((offset_x + self.view_width + self.tile_width - 1)
+                           // self.tile_width)
             stop_x_tile = min(self.tile_src.num_tiles_x-1, stop_x_tile) + 1
             col_list = range(start_x_tile, stop_x_tile)
-            x_pix_start = start_x_tile * self.tile_height - self.view_offset_x
+            x_pix_start = start_x_tile * self.tile_width - offset_x
 
-        if self.view_offset_y < 0:
+        if offset_y < 0:
             # View > Map in Y - centre in Y direction
             row_list = range(self.tile_src.num_tiles_y)
-            y_pix_start = -self.view_offset_y
+            y_pix_start = -offset_y
         else:
             # Map > View - determine layout in Y direction
-            start_y_tile = int(self.view_offset_y / self.tile_height)
-            stop_y_tile = int((self.view_offset_y + self.view_height
-                               + self.tile_height - 1) / self.tile_height)
+            start_y_tile = offset_y // self.tile_height
+            stop_y_tile = ((offset_y + self.view_height + self.tile_height - 1)
+                           // self.tile_height)
             stop_y_tile = min(self.tile_src.num_tiles_y-1, stop_y_tile) + 1
             row_list = range(start_y_tile, stop_y_tile)
-            y_pix_start = start_y_tile * self.tile_height - self.view_offset_y
+            y_pix_start = start_y_tile * self.tile_height - offset_y
+
+        self.set_tile_view()
 
         # start pasting tiles onto the view
         # use x_pix and y_pix to place tiles
@@ -2191,9 +2629,106 @@ class pySlip(_BufferedCanvas):
         for id in self.layer_z_order:
             l = self.layer_mapping[id]
             if l.visible and self.level in l.show_levels:
-                l.painter(dc, l.data, map_rel=l.map_rel)
+                self.draw_layer(dc, l)
+
+        self.draw_select_box(dc)
+
+    def DrawRegion(self, dc, region):
+        """Draw just the tiles and layers in part of the view.
+        Overrides the _BufferedCanvas.DrawRegion() method.
+
+        dc      device context to draw on, clipped to 'region'
+        region  a wx.Region of the view to draw
+
+        Only layers with data in the region are drawn, so big layers
+        elsewhere in the view aren't drawn for every tile that arrives.
+        """
+
+        box = region.GetBox()
+        (left, top) = (box.x, box.y)
+        (right, bottom) = (box.x + box.width, box.y + box.height)
+        (offset_x, offset_y) = (int(self.view_offset_x), int(self.view_offset_y))
+
+        # the rectangles making up the region, (left, right, top, bottom)
+        rects = []
+        rect_iter = wx.RegionIterator(region)
+        while rect_iter.HaveRects():
+            rect = rect_iter.GetRect()
+            rects.append((rect.x, rect.x + rect.width,
+                          rect.y, rect.y + rect.height))
+            rect_iter.Next()
+
+        # draw the tiles the region covers
+        for x in range((left + offset_x) // self.tile_width,
+                       (right + offset_x - 1) // self.tile_width + 1):
+            for y in range((top + offset_y) // self.tile_height,
+                           (bottom + offset_y - 1) // self.tile_height + 1):
+                x_pix = x * self.tile_width - offset_x
+                y_pix = y * self.tile_height - offset_y
+                if (0 <= x < self.tile_src.num_tiles_x
+                        and 0 <= y < self.tile_src.num_tiles_y
+                        and region.Contains(x_pix, y_pix, self.tile_width,
+                                            self.tile_height) != wx.OutRegion):
+                    dc.DrawBitmap(self.tile_src.GetTile(x, y), x_pix, y_pix,
+                                  False)
+
+        # draw the layers with data in the region
+        self.redraw_region = region
+        try:
+            for id in self.layer_z_order:
+                l = self.layer_mapping[id]
+                if l.visible and self.level in l.show_levels:
+                    extent = self.layer_extent(l)
+                    if extent is not None:
+                        (ex_l, ex_r, ex_t, ex_b) = extent
+                        if not any(ex_r >= r_l and ex_l < r_r
+                                       and ex_b >= r_t and ex_t < r_b
+                                   for (r_l, r_r, r_t, r_b) in rects):
+                            continue
+                    self.draw_layer(dc, l)
+        finally:
+            self.redraw_region = None
+
+        self.draw_select_box(dc)
+
+    def ScrollView(self, dx, dy):
+        """Redraw the view after the map moved in it.
+
+        dx, dy  pixels the map moved right and down
+
+        What's already drawn is moved and only the uncovered strips are
+        drawn, unless a view-relative layer is showing, as that doesn't
+        move with the map.
+        """
+
+        if dx == 0 and dy == 0:
+            return
+
+        for id in self.layer_z_order:
+            l = self.layer_mapping[id]
+            if l.visible and not l.map_rel and self.level in l.show_levels:
+                self.Update()
+                return
+
+        self.set_tile_view()
+        self.ScrollBuffer(dx, dy)
+
+    def set_tile_view(self):
+        """Tell the tile source what is in the view.
+
+        Any tiles it has to fetch are fetched from the centre outwards,
+        and tiles the view has moved away from aren't fetched.
+        """
+
+        self.tile_src.SetView(
+                self.view_offset_x / self.tile_width,
+                self.view_offset_y / self.tile_height,
+                (self.view_offset_x + self.view_width) / self.tile_width,
+                (self.view_offset_y + self.view_height) / self.tile_height)
+
+    def draw_select_box(self, dc):
+        """Draw the selection rectangle, if any."""
 
-        # draw selection rectangle, if any
         if self.sbox_1_x:
             penclr = wx.Colour(0, 0, 255)
             pen = wx.Pen(penclr, 1, wx.USER_DASH)
@@ -2326,13 +2861,15 @@ class pySlip(_BufferedCanvas):
         pex = self.PexPointView
         clickpt = pt
         if layer.map_rel:
-            pex = self.PexPoint
+            pex = self.pex_point
             clickpt = self.Geo2View(pt)
 
         # get selected point on map/view
         (xclick, yclick) = clickpt
-        for (x, y, place, radius, colour, x_off, y_off, udata) in layer.data:
-            (vp, _) = pex(place, (x,y), x_off, y_off, radius)
+        views = self.layer_views(layer.data, layer.map_rel)
+        for ((x, y, place, radius, colour, x_off, y_off, udata),
+                 view) in zip(layer.data, views):
+            (vp, _) = pex(place, view, x_off, y_off, radius)
             if vp:
                 (vx, vy) = vp
                 d = (vx - xclick)*(vx - xclick) + (vy - yclick)*(vy - yclick)
@@ -2372,13 +2909,15 @@ class pySlip(_BufferedCanvas):
         (blx, bby) = ll
         (brx, bty) = ur
         if layer.map_rel:
-            pex = self.PexPoint
+            pex = self.pex_point
             (blx, bby) = self.Geo2View(ll)
             (brx, bty) = self.Geo2View(ur)
 
         # get points selection
-        for (x, y, place, radius, colour, x_off, y_off, udata) in layer.data:
-            (vp, _) = pex(place, (x,y), x_off, y_off, radius)
+        views = self.layer_views(layer.data, layer.map_rel)
+        for ((x, y, place, radius, colour, x_off, y_off, udata),
+                 view) in zip(layer.data, views):
+            (vp, _) = pex(place, view, x_off, y_off, radius)
             if vp:
                 (vpx, vpy) = vp
                 if blx <= vpx <= brx and bby >= vpy >= bty:
@@ -2417,13 +2956,15 @@ class pySlip(_BufferedCanvas):
         pex = self.PexExtentView
         if layer.map_rel:
             clickpt = self.Geo2View(point)
-            pex = self.PexExtent
+            pex = self.pex_extent
         (xclick, yclick) = clickpt
 
         # select image
-        for (x, y, bmp, w, h, place,
-                x_off, y_off, radius, colour, udata) in layer.data:
-            (_, e) = pex(place, (x,y), x_off, y_off, w, h)
+        views = self.layer_views(layer.data, layer.map_rel)
+        for ((x, y, bmp, w, h, place,
+                 x_off, y_off, radius, colour, udata),
+                 view) in zip(layer.data, views):
+            (_, e) = pex(place, view, x_off, y_off, w, h)
             if e:
                 (lx, rx, ty, by) = e
                 if lx <= xclick <= rx and ty <= yclick <= by:
@@ -2455,7 +2996,7 @@ class pySlip(_BufferedCanvas):
         # get correct pex function and box limits in view coords
         pex = self.PexExtentView
         if layer.map_rel:
-            pex = self.PexExtent
+            pex = self.pex_extent
             ll = self.Geo2View(ll)
             ur = self.Geo2View(ur)
         (vboxlx, vboxby) = ll
@@ -2464,9 +3005,11 @@ class pySlip(_BufferedCanvas):
         # select images in map/view
         selection = []
         data = []
-        for (x, y, bmp, w, h, place,
-                x_off, y_off, radius, colour, udata) in layer.data:
-            (_, e) = pex(place, (x,y), x_off, y_off, w, h)
+        views = self.layer_views(layer.data, layer.map_rel)
+        for ((x, y, bmp, w, h, place,
+                 x_off, y_off, radius, colour, udata),
+                 view) in zip(layer.data, views):
+            (_, e) = pex(place, view, x_off, y_off, w, h)
             if e:
                 (li, ri, ti, bi) = e    # image extents (view coords)
                 if (vboxlx <= li and ri <= vboxrx
@@ -2503,14 +3046,16 @@ class pySlip(_BufferedCanvas):
         pex = self.PexPointView
         clickpt = point
         if layer.map_rel:
-            pex = self.PexPoint
+            pex = self.pex_point
             clickpt = self.Geo2View(point)
         (xclick, yclick) = clickpt
 
         # select text in map/view layer
-        for (x, y, text, place, radius, colour,
-                 tcolour, fname, fsize, x_off, y_off, data) in layer.data:
-            (vp, ex) = pex(place, (x,y), 0, 0, radius)
+        views = self.layer_views(layer.data, layer.map_rel)
+        for ((x, y, text, place, radius, colour,
+                 tcolour, fname, fsize, x_off, y_off, data),
+                 view) in zip(layer.data, views):
+            (vp, ex) = pex(place, view, 0, 0, radius)
             if vp:
                 (px, py) = vp
                 d = (px - xclick)**2 + (py - yclick)**2
@@ -2555,16 +3100,18 @@ class pySlip(_BufferedCanvas):
         # get correct pex function and box limits in view coords
         pex = self.PexPointView
         if layer.map_rel:
-            pex = self.PexPoint
+            pex = self.pex_point
             ll = self.Geo2View(ll)
             ur = self.Geo2View(ur)
         (lx, by) = ll
         (rx, ty) = ur
 
         # get texts inside box
-        for (x, y, text, place, radius, colour,
-                tcolour, fname, fsize, x_off, y_off, udata) in layer.data:
-            (vp, ex) = pex(place, (x,y), x_off, y_off, radius)
+        views = self.layer_views(layer.data, layer.map_rel)
+        for ((x, y, text, place, radius, colour,
+                 tcolour, fname, fsize, x_off, y_off, udata),
+                 view) in zip(layer.data, views):
+            (vp, ex) = pex(place, view, x_off, y_off, radius)
             if vp:
                 (px, py) = vp
                 if lx <= px <= rx and ty <= py <= by:
@@ -0,0 +1,213 @@
+"""
+Per-server request throttling for tile fetching.
+
+A ServerThrottle decides when a request may be sent to one server.  It
+combines:
+    . a token bucket limiting the request rate
+    . exponential backoff with jitter after failures, respecting any
+      Retry-After time the server sends
+    . an adaptive concurrency limit that halves when the server says
+      it's overloaded (429 or 503) and grows back by one after each
+      round of successful requests
+
+Fetch code calls acquire() (or try_acquire() from asyncio code) before
+each request and release() with the outcome() of the request after it.
+"""
+
+import time
+import random
+import threading
+import email.utils
+
+
+# request outcomes given to ServerThrottle.release()
+OK = 'ok'                   # the server answered, good or bad
+Throttled = 'throttled'     # the server is overloaded, slow down
+Failed = 'failed'           # a transient failure, try again later
+
+
+def outcome(status, exception):
+    """Return the outcome of a request.
+
+    status     the HTTP response status
+    exception  the exception if the request failed, else None
+    """
+
+    if exception is not None:
+        return Failed
+    if status in (429, 503):
+        return Throttled
+    if 500 <= status < 600:
+        return Failed
+    return OK
+
+def retry_after(info, now):
+    """Return seconds to wait from a Retry-After header, None if none.
+
+    info  the response headers, None if no response
+    now   the current time
+    """
+
+    if info is None or not info.get('Retry-After'):
+        return None
+    value = info.get('Retry-After').strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp()
+                        - now)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    """Allow 'rate' requests per second with bursts of up to 'burst'."""
+
+    def __init__(self, rate, burst):
+        """Prepare a full bucket.
+
+        rate   tokens added per second
+        burst  maximum number of tokens
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+
+    def take(self, now):
+        """Take a token if there is one.
+
+        now  the current time.monotonic()
+
+        Returns 0.0 if a token was taken, else seconds until one is due.
+        Not thread-safe, the caller must lock.
+        """
+
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / self.rate
+
+
+class ServerThrottle(object):
+    """Decide when a request may be sent to a server."""
+
+    # backoff after the first failure, in seconds
+    BaseBackoff = 0.5
+
+    # longest backoff, in seconds
+    MaxBackoff = 60.0
+
+    def __init__(self, max_requests, rate=None, burst=None):
+        """Prepare the throttle.
+
+        max_requests  the most concurrent requests, the limit never
+                      grows past this
+        rate          maximum requests per second, None means no limit
+        burst         requests allowed at once after an idle time,
+                      defaults to 'rate'
+        """
+
+        self.max_requests = max_requests
+        self.limit = max_requests
+        self.in_flight = 0
+        self.failures = 0
+        self.backoff_until = 0.0
+
+        self._successes = 0
+        self._bucket = None
+        if rate:
+            self._bucket = TokenBucket(rate, burst or max(1, rate))
+        self._cond = threading.Condition()
+        self._random = random.Random()
+
+    def try_acquire(self, now=None):
+        """Take a request slot if one is free now.
+
+        now  the current time.monotonic(), None means get it
+
+        Returns 0.0 if a slot was taken, else the seconds to wait before
+        trying again, or None if waiting for a request to finish.
+        """
+
+        if now is None:
+            now = time.monotonic()
+        with self._cond:
+            return self._try_acquire(now)
+
+    def _try_acquire(self, now):
+        """try_acquire() holding the lock."""
+
+        if now < self.backoff_until:
+            return self.backoff_until - now
+        if self.in_flight >= self.limit:
+            return None
+        if self._bucket is not None:
+            wait = self._bucket.take(now)
+            if wait > 0.0:
+                return wait
+        self.in_flight += 1
+        return 0.0
+
+    def acquire(self):
+        """Wait for and take a request slot."""
+
+        with self._cond:
+            while True:
+                wait = self._try_acquire(time.monotonic())
+                if wait == 0.0:
+                    return
+                self._cond.wait(wait)
+
+    def release(self, result, retry_after=None):
+        """Give back a request slot.
+
+        result       the outcome() of the request
+        retry_after  seconds the server asked us to wait, if any
+        """
+
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            if result == OK:
+                self.failures = 0
+                self._successes += 1
+                if self._successes >= self.limit:
+                    # a round of good requests, allow one more at once
+                    self._successes = 0
+                    self.limit = min(self.max_requests, self.limit + 1)
+            else:
+                self.failures += 1
+                self._successes = 0
+                if result == Throttled:
+                    self.limit = max(1, self.limit // 2)
+                delay = min(self.MaxBackoff,
+                            self.BaseBackoff * 2**(self.failures - 1))
+                delay = self._random.uniform(delay / 2, delay)
+                if retry_after is not None:
+                    delay = max(delay, min(retry_after, self.MaxBackoff))
+                self.backoff_until = max(self.backoff_until, now + delay)
+            self._cond.notify_all()
+
+    def cancel(self):
+        """Give back a request slot without an outcome, as for a
+        request abandoned before the server answered.
+        """
+
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self._cond.notify_all()
+
+    def info(self):
+        """Return a dictionary describing the throttle state."""
+
+        with self._cond:
+            return {'limit': self.limit,
+                    'max_requests': self.max_requests,
+                    'in_flight': self.in_flight,
+                    'failures': self.failures,
+                    'backoff': max(0.0, self.backoff_until - time.monotonic())}
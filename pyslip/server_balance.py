@@ -0,0 +1,264 @@
+"""
+Share tile requests over servers by how well each server is doing.
+
+A ServerBalancer keeps the health of each server of a tile source:
+    . an EWMA of the request latency
+    . an EWMA of the error rate
+    . the number of requests in flight
+and picks the server for each request with the lowest expected time
+
+    score = latency * (in_flight + 1) / (1 - error_rate)
+
+A server scoring much worse than the best server isn't used, so a slow
+mirror only gets requests when the better servers are busy enough.
+A server that fails EjectAfter times in a row is ejected for a while,
+unless it's the last server in use.  When the ejection time is up one
+probe request is sent.  If the probe succeeds the server is back in
+use, else it's ejected again for twice as long.
+
+Each server can have a rate_limit.ServerThrottle that must also allow
+the request.  Fetch code calls acquire() (or try_acquire() from asyncio
+code) to get the server for a request and release() after it.
+"""
+
+import time
+import threading
+import pyslip.rate_limit as rate_limit
+
+
+class ServerHealth(object):
+    """The health of one server."""
+
+    def __init__(self, server, throttle):
+        self.server = server
+        self.throttle = throttle
+        self.latency = None             # EWMA of seconds per request
+        self.error_rate = 0.0           # EWMA of failed requests
+        self.in_flight = 0
+        self.failures = 0               # failures in a row
+        self.ejections = 0              # ejections in a row
+        self.ejected_until = 0.0
+        self.probing = False            # True if a probe is in flight
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+
+    def score(self):
+        """Return the expected seconds a new request will take."""
+
+        return ((self.latency or 0.0) * (self.in_flight + 1)
+                    / max(0.1, 1.0 - self.error_rate))
+
+
+class ServerBalancer(object):
+    """Pick the server for each tile request."""
+
+    # weight of the newest request in the latency and error averages
+    Alpha = 0.3
+
+    # don't use servers scoring more than this times the best score
+    SlowFactor = 4.0
+
+    # failures in a row before a server is ejected
+    EjectAfter = 3
+
+    # seconds a server is first ejected for, and the longest ejection
+    EjectTime = 30.0
+    MaxEjectTime = 600.0
+
+    # seconds after which a server scoring badly is tried again, so
+    # its latency is measured again
+    RecheckTime = 30.0
+
+    def __init__(self, servers, throttles=None):
+        """Prepare the balancer.
+
+        servers    list of server URLs
+        throttles  dictionary mapping server URL to its
+                   rate_limit.ServerThrottle, None means no throttles
+        """
+
+        throttles = throttles or {}
+        self.servers = list(dict.fromkeys(servers))
+        self.health = {server: ServerHealth(server, throttles.get(server))
+                           for server in self.servers}
+        self._cond = threading.Condition()
+
+    def try_acquire(self, now=None, exclude=None):
+        """Pick a server for a request if one can be used now.
+
+        now      the current time.monotonic(), None means get it
+        exclude  a server not to pick, if any
+
+        Returns (server, 0.0) if a server was picked, else (None, wait)
+        where 'wait' is the seconds to wait before trying again, or None
+        if waiting for a request to finish.
+        """
+
+        if now is None:
+            now = time.monotonic()
+        with self._cond:
+            return self._try_acquire(now, exclude)
+
+    def _try_acquire(self, now, exclude=None):
+        """try_acquire() holding the lock."""
+
+        # servers ejected or backing off can't be used until 'ready'
+        usable = []
+        wait = None
+        for health in self.health.values():
+            if health.server == exclude or (health.ejections
+                                            and health.probing):
+                continue
+            ready = health.ejected_until
+            if health.throttle is not None:
+                ready = max(ready, health.throttle.backoff_until)
+            if ready > now:
+                wait = min(wait or (ready - now), ready - now)
+            else:
+                usable.append(health)
+        if not usable:
+            return (None, wait)
+
+        # try the servers best first, but not the ones much worse than
+        # the best unless they haven't been tried for a while
+        best = min(h.score() for h in usable)
+        for health in sorted(usable, key=ServerHealth.score):
+            if (health.score() > best * self.SlowFactor
+                    and now - health.last_used < self.RecheckTime):
+                continue
+            if health.throttle is not None:
+                throttle_wait = health.throttle.try_acquire(now)
+                if throttle_wait != 0.0:
+                    if throttle_wait is not None:
+                        wait = min(wait or throttle_wait, throttle_wait)
+                    continue
+            health.in_flight += 1
+            health.last_used = now
+            if health.ejections:
+                health.probing = True
+            return (health.server, 0.0)
+
+        return (None, wait)
+
+    def acquire(self, exclude=None, timeout=None):
+        """Wait for and return the server for a request.
+
+        exclude  a server not to pick, if any
+        timeout  most seconds to wait, None means wait until a server
+                 can be used
+
+        Returns None if the timeout passed before a server could be used.
+        """
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                (server, wait) = self._try_acquire(now, exclude)
+                if server is not None:
+                    return server
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = min(wait or (deadline - now), deadline - now)
+                self._cond.wait(wait)
+
+    def release(self, server, result, elapsed, retry_after=None):
+        """Record how a request to a server went.
+
+        server       the server URL from acquire()
+        result       the rate_limit.outcome() of the request
+        elapsed      seconds taken by the request
+        retry_after  seconds the server asked us to wait, if any
+        """
+
+        now = time.monotonic()
+        with self._cond:
+            health = self.health[server]
+            health.in_flight = max(0, health.in_flight - 1)
+            health.requests += 1
+            if health.throttle is not None:
+                health.throttle.release(result, retry_after)
+
+            if health.latency is None:
+                health.latency = elapsed
+            else:
+                health.latency += self.Alpha * (elapsed - health.latency)
+            failed = (result != rate_limit.OK)
+            health.error_rate += self.Alpha * (failed - health.error_rate)
+
+            if not failed:
+                health.failures = 0
+                if health.ejections:
+                    # the probe worked, the server is back in use
+                    health.ejections = 0
+                    health.probing = False
+                    health.error_rate = 0.5
+            else:
+                health.errors += 1
+                health.failures += 1
+                if health.ejections:
+                    # the probe failed, eject again for longer
+                    health.probing = False
+                    self._eject(health, now)
+                elif (health.failures >= self.EjectAfter
+                        and self._others_in_use(health)):
+                    self._eject(health, now)
+
+            self._cond.notify_all()
+
+    def cancel(self, server, elapsed=None):
+        """Forget a request abandoned before the server answered.
+
+        server   the server URL from acquire()
+        elapsed  seconds the request had taken when abandoned, if any
+
+        The server was at least 'elapsed' slow, so that goes into the
+        latency average.  Nothing else about the server changes.
+        """
+
+        with self._cond:
+            health = self.health[server]
+            health.in_flight = max(0, health.in_flight - 1)
+            if health.throttle is not None:
+                health.throttle.cancel()
+            if elapsed is not None and health.latency is not None:
+                health.latency += self.Alpha * (max(elapsed, health.latency)
+                                                    - health.latency)
+            if health.ejections:
+                health.probing = False
+            self._cond.notify_all()
+
+    def _eject(self, health, now):
+        """Stop using a server for a while."""
+
+        health.ejections += 1
+        health.ejected_until = now + min(self.MaxEjectTime,
+                                         self.EjectTime
+                                             * 2**(health.ejections - 1))
+
+    def _others_in_use(self, health):
+        """Return True if a server other than 'health' isn't ejected."""
+
+        return any(h is not health and not h.ejections
+                       for h in self.health.values())
+
+    def info(self):
+        """Return a dictionary mapping each server to a dictionary of its
+        'latency', 'error_rate', 'in_flight', 'requests', 'errors' and
+        'ejected' (seconds until it's probed, 0.0 if in use).
+        """
+
+        now = time.monotonic()
+        with self._cond:
+            return {h.server: {'latency': h.latency,
+                               'error_rate': h.error_rate,
+                               'in_flight': h.in_flight,
+                               'requests': h.requests,
+                               'errors': h.errors,
+                               'ejected': (max(0.0, h.ejected_until - now)
+                                               if h.ejections else 0.0)}
+                        for h in self.health.values()}
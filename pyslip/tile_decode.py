@@ -0,0 +1,149 @@
+"""
+Decode tile file bytes to raw pixels in a pool of processes.
+
+Decoding a PNG or JPEG tile is CPU work that holds the GIL, so decoding
+in the tile fetch threads doesn't use more than one core.  A DecodePool
+decodes tiles in separate processes and returns the raw pixels:
+
+    (width, height, rgb, alpha)
+
+where 'rgb' is width*height*3 bytes and 'alpha' is width*height bytes,
+or None if the tile has no transparency.  Making a bitmap from raw
+pixels on the GUI thread is a cheap copy, see wx.Bitmap.FromBuffer().
+
+The pool processes use Pillow to decode if it's installed, otherwise
+wx.Image.  The processes are started with the 'spawn' method so the
+GUI process is never forked, and only when tiles are decoded.  A pool
+process imports just this module, see pyslip/__init__.py, not wx or
+the widget.
+
+Use get_pool() to get the pool shared by all tile sources.  If a pool
+process dies the pool is broken, get_pool() then starts a new pool.
+"""
+
+import io
+import os
+import threading
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def decode(data):
+    """Return (width, height, rgb, alpha) for tile file bytes.
+
+    data  the PNG or JPEG file bytes
+
+    Runs in a pool process.  Raises ValueError if 'data' can't be decoded.
+    """
+
+    if Image is not None:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception as e:
+            raise ValueError("Can't decode tile: %s" % str(e))
+        alpha = None
+        if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+            image = image.convert('RGBA')
+            alpha = image.getchannel('A').tobytes()
+        rgb = image.convert('RGB').tobytes()
+        return (image.width, image.height, rgb, alpha)
+
+    import wx
+
+    image = wx.Image(io.BytesIO(data))
+    if not image.IsOk():
+        raise ValueError("Can't decode tile")
+    alpha = bytes(image.GetAlpha()) if image.HasAlpha() else None
+    return (image.GetWidth(), image.GetHeight(), bytes(image.GetData()), alpha)
+
+
+class DecodePool(object):
+    """A pool of processes decoding tile file bytes to raw pixels."""
+
+    # number of decode processes, None means the number of CPUs up to
+    # MaxProcesses
+    Processes = None
+    MaxProcesses = 4
+
+    def __init__(self, processes=Processes):
+        """Prepare the pool, processes are started as tiles are decoded.
+
+        processes  number of decode processes, None means the number of
+                   CPUs up to MaxProcesses
+        """
+
+        self.processes = processes or min(self.MaxProcesses,
+                                          os.cpu_count() or 1)
+        self.broken = False
+        context = multiprocessing.get_context('spawn')
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+                                                self.processes,
+                                                mp_context=context)
+
+    def submit(self, data):
+        """Start decoding tile bytes.
+
+        data  the tile file bytes
+
+        Returns a concurrent.futures.Future with the decode() result.
+        Raises RuntimeError, or BrokenProcessPool, if the pool is broken
+        or closed.
+        """
+
+        try:
+            future = self._executor.submit(decode, data)
+        except RuntimeError:
+            self.broken = True
+            raise
+        future.add_done_callback(self._check_broken)
+        return future
+
+    def _check_broken(self, future):
+        """Mark the pool broken if a pool process died decoding a tile."""
+
+        if (not future.cancelled()
+                and isinstance(future.exception(),
+                               concurrent.futures.process.BrokenProcessPool)):
+            self.broken = True
+
+    def close(self):
+        """Stop the pool processes."""
+
+        self._executor.shutdown(wait=False)
+
+
+# number of times a broken shared pool is replaced
+MaxRestarts = 3
+
+# the pool shared by all tile sources
+_pool = None
+_restarts = 0
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the shared DecodePool, starting it if required.
+
+    A broken pool is closed and a new one started, up to MaxRestarts
+    times.  After that None is returned and tiles should be decoded
+    without a pool.
+    """
+
+    global _pool, _restarts
+
+    with _pool_lock:
+        if _pool is not None and _pool.broken and _restarts < MaxRestarts:
+            _pool.close()
+            _pool = None
+            _restarts += 1
+        if _pool is None:
+            _pool = DecodePool()
+        if _pool.broken:
+            return None
+        return _pool
@@ -0,0 +1,171 @@
+"""
+A tile request queue that fetches the tiles nearest the view centre first
+and forgets tiles the view has moved away from.
+
+TileRequestQueue is a queue.Queue of (level, x, y) tile keys, so it can
+be used wherever the request queue was a plain FIFO Queue.  get()
+returns the queued key with the lowest priority value, where
+
+    priority = distance + AgePenalty * age
+
+'distance' is the distance in tiles from the centre of the tile to the
+centre of the view given to set_view(), and 'age' is the number of
+seconds since the tile was last asked for.  So tiles under the middle
+of the view are fetched first, and tiles the view has moved away from,
+which are no longer being asked for, drift to the back of the queue.
+
+The age term grows at the same rate for every queued key, so the order
+only changes when the view moves or a key is asked for again.
+set_view() re-orders the queue and can also cancel the requests for
+tiles more than a margin outside the view.
+"""
+
+import math
+import time
+import heapq
+import queue
+import itertools
+
+
+class TileRequestQueue(queue.Queue):
+    """A queue of tile keys ordered by distance from the view centre."""
+
+    # tiles of distance added to a request's priority for each second
+    # since the tile was last asked for
+    AgePenalty = 2.0
+
+    # distance given to keys not on the level of the view
+    OtherLevelDistance = 1.0e6
+
+    def _init(self, maxsize):
+        self._heap = []                 # [priority, seq, key, asked]
+        self._entries = {}              # key -> current heap entry
+        self._seq = itertools.count()
+        self._start = time.monotonic()
+        self._centre = None             # (level, x, y) of view centre
+        self._view = None               # the last set_view() parameters
+
+        # number of requests cancelled by set_view()
+        self.cancelled = 0
+
+    def _qsize(self):
+        return len(self._entries)
+
+    def _put(self, key):
+        self._push(key, time.monotonic() - self._start)
+
+    def _get(self):
+        while True:
+            entry = heapq.heappop(self._heap)
+            key = entry[2]
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+                return key
+
+    def _push(self, key, asked):
+        """Add an entry for 'key' asked for at time 'asked'."""
+
+        entry = [self._priority(key, asked), next(self._seq), key, asked]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _priority(self, key, asked):
+        """Return the priority of 'key' asked for at time 'asked'.
+
+        'asked' is seconds since the queue was created.  The age penalty
+        is AgePenalty * (now - asked), we drop the 'now' term as it's the
+        same for all keys.
+        """
+
+        if self._centre is None:
+            distance = 0.0
+        else:
+            (level, x, y) = key
+            (c_level, c_x, c_y) = self._centre
+            if level == c_level:
+                distance = math.hypot(x + 0.5 - c_x, y + 0.5 - c_y)
+            else:
+                distance = self.OtherLevelDistance
+        return distance - self.AgePenalty * asked
+
+    def _rebuild(self):
+        """Recompute all priorities and rebuild the heap."""
+
+        for entry in self._entries.values():
+            entry[0] = self._priority(entry[2], entry[3])
+        self._heap = list(self._entries.values())
+        heapq.heapify(self._heap)
+
+    def _forget(self, num_keys):
+        """Mark 'num_keys' removed keys as done, must hold self.mutex."""
+
+        self.unfinished_tasks -= num_keys
+        if self.unfinished_tasks <= 0:
+            self.unfinished_tasks = 0
+            self.all_tasks_done.notify_all()
+        self.not_full.notify_all()
+
+    def set_view(self, level, left, top, right, bottom, margin=None):
+        """Set the view, re-ordering the queue if it moved.
+
+        level        the level of the view
+        left         the view left edge in fractional tile coordinates
+        top          the view top edge in fractional tile coordinates
+        right        the view right edge in fractional tile coordinates
+        bottom       the view bottom edge in fractional tile coordinates
+        margin       if not None, cancel requests for tiles more than this
+                     many tiles outside the view
+
+        Returns a list of the cancelled keys.
+        """
+
+        cancelled = []
+        with self.mutex:
+            view = (level, left, top, right, bottom, margin)
+            if view == self._view:
+                return cancelled
+            self._view = view
+
+            if margin is not None:
+                (left, top) = (left - margin, top - margin)
+                (right, bottom) = (right + margin, bottom + margin)
+                for key in list(self._entries):
+                    (k_level, x, y) = key
+                    if (k_level != level or x + 1 <= left or x >= right
+                            or y + 1 <= top or y >= bottom):
+                        del self._entries[key]
+                        cancelled.append(key)
+                if cancelled:
+                    self.cancelled += len(cancelled)
+                    self._forget(len(cancelled))
+
+            self._centre = (level, (view[1] + view[3]) / 2,
+                            (view[2] + view[4]) / 2)
+            self._rebuild()
+
+        return cancelled
+
+    def touch(self, key):
+        """Note that a queued key is still wanted.
+
+        The key's age is reset.  Does nothing if 'key' isn't queued.
+        """
+
+        with self.mutex:
+            if key in self._entries:
+                self._push(key, time.monotonic() - self._start)
+
+                # drop the replaced entries if they have built up
+                if len(self._heap) > 2*len(self._entries) + 100:
+                    self._rebuild()
+
+    def clear(self):
+        """Remove all queued keys."""
+
+        with self.mutex:
+            num_keys = len(self._entries)
+            self._entries.clear()
+            self._heap = []
+
+            # the removed keys won't be processed, so mark them done
+            self._forget(num_keys)
@@ -0,0 +1,634 @@
+"""
+Backing stores for the pySlip on-disk tile cache.
+
+A store holds undecoded tile file bytes keyed by (level, x, y) and
+remembers when each tile was fetched.  tiles.Cache uses a store for all
+its disk access, so the on-disk layout can be changed by giving a
+different store to the Tiles object.
+
+A store also keeps the HTTP validators of server tiles, a dictionary:
+    {'etag': <ETag header or None>,
+     'last_modified': <Last-Modified header or None>,
+     'expires': <time the tile goes stale or None>,
+     'max_age': <Cache-Control max-age seconds or None>}
+so a stale tile can be refreshed with a conditional request.
+
+DirectoryStore  one file per tile: <tiles_dir>/{Z}/{X}/{Y}.<ext>
+MBTilesStore    all tiles in a single SQLite file using the MBTiles schema
+
+Used as a program this module copies tiles from a directory store into
+an MBTiles file.
+
+Usage: tile_store.py [-h] [-e <ext>] [-b <batch>] <tiles_dir> <mbtiles_file>
+
+where -h | --help           prints this help and stops
+      -e | --ext <ext>      the tile file extension ('png' or 'jpg', default 'png')
+      -b | --batch <batch>  number of tiles copied in each transaction
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+
+###############################################################################
+# HTTP validators for tiles, kept in a SQLite table.
+###############################################################################
+
+class ValidatorTable(object):
+    """The HTTP validators of tiles in a 'validators' table."""
+
+    def __init__(self, db, lock):
+        """Prepare the table, creating it if required.
+
+        db    the sqlite3 connection
+        lock  the lock guarding use of 'db'
+        """
+
+        self._db = db
+        self._lock = lock
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS validators '
+                             '(level INTEGER, x INTEGER, y INTEGER, '
+                             'etag TEXT, last_modified TEXT, expires REAL, '
+                             'max_age REAL)')
+            self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS validator_index '
+                             'ON validators (level, x, y)')
+            # tables made before max-age was saved don't have the column
+            columns = [row[1] for row in
+                           self._db.execute('PRAGMA table_info(validators)')]
+            if 'max_age' not in columns:
+                self._db.execute('ALTER TABLE validators '
+                                 'ADD COLUMN max_age REAL')
+
+    def get(self, key):
+        """Return the validators dictionary of a tile, None if none saved."""
+
+        with self._lock:
+            row = self._db.execute('SELECT etag, last_modified, expires, '
+                                   'max_age FROM validators WHERE level=? '
+                                   'AND x=? AND y=?', key).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'expires': row[2],
+                'max_age': row[3]}
+
+    def set_batch(self, items):
+        """Save validators in one transaction.
+
+        items  a list of (key, validators) tuples
+        """
+
+        rows = [key + (v.get('etag'), v.get('last_modified'), v.get('expires'),
+                       v.get('max_age'))
+                for (key, v) in items]
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO validators (level, x, '
+                                 'y, etag, last_modified, expires, max_age) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def expiries(self, level):
+        """Return a dictionary {key: expires} of tiles in a level with one."""
+
+        with self._lock:
+            rows = self._db.execute('SELECT x, y, expires FROM validators '
+                                    'WHERE level=? AND expires IS NOT NULL',
+                                    (level,)).fetchall()
+        return dict(((level, x, y), expires) for (x, y, expires) in rows)
+
+    def delete_batch(self, keys):
+        """Forget the validators of tiles in one transaction."""
+
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM validators WHERE level=? '
+                                 'AND x=? AND y=?', keys)
+
+###############################################################################
+# One file per tile, in a directory per level and column.
+###############################################################################
+
+class DirectoryStore(object):
+    """Store tiles as files in <tiles_dir>/{Z}/{X}/{Y}.<ext>.
+
+    Tile validators are kept in a SQLite file in the tiles directory,
+    opened when first used.  The file is only made when validators are
+    saved, so reading a directory, to migrate it say, doesn't change it.
+
+    Tiles are written to a temporary file and renamed into place, so a
+    reader never sees a partly written tile.
+    """
+
+    TilePath = '{Z}/{X}/{Y}.%s'
+
+    # name of the validators file in the tiles directory
+    ValidatorsFile = 'validators.sqlite'
+
+    def __init__(self, tiles_dir, tile_ext='png'):
+        """Prepare the store.
+
+        tiles_dir  path to the tiles directory
+        tile_ext   the tile file extension
+        """
+
+        self.tiles_dir = tiles_dir
+        self.tile_ext = tile_ext
+        self._tile_path = self.TilePath % tile_ext
+        self._db = None
+        self._validators = None
+        self._lock = threading.Lock()
+
+    def tile_path(self, key):
+        """Return path to a tile file given its key."""
+
+        (level, x, y) = key
+        return os.path.join(self.tiles_dir,
+                            self._tile_path.format(Z=level, X=x, Y=y))
+
+    def stat(self, key):
+        """Return the date a tile was fetched, or None if not in the store.
+
+        The fetch date is the file modification time.
+        """
+
+        try:
+            return os.stat(self.tile_path(key)).st_mtime
+        except OSError:
+            return None
+
+    def read(self, key):
+        """Return the bytes of a tile.
+
+        Raises KeyError if the tile isn't in the store.
+        """
+
+        try:
+            with open(self.tile_path(key), 'rb') as fd:
+                return fd.read()
+        except OSError:
+            raise KeyError("Tile with key '%s' not in store" % str(key))
+
+    def write_batch(self, tiles):
+        """Write a batch of tiles.
+
+        tiles  a list of (key, data, fetched) tuples, where 'fetched' is
+               the time the tile was fetched, None meaning now
+
+        The fetch time is kept as the file modification time.
+        """
+
+        for (key, data, fetched) in tiles:
+            tile_path = self.tile_path(key)
+            try:
+                os.makedirs(os.path.dirname(tile_path))
+            except OSError:
+                # we assume it's a "directory exists' error, which we ignore
+                pass
+            # a name no other writer uses, which keys() ignores
+            tmp_path = '%s.%d.%d.tmp' % (tile_path, os.getpid(),
+                                         threading.get_ident())
+            try:
+                with open(tmp_path, 'wb') as fd:
+                    fd.write(data)
+                if fetched is not None:
+                    os.utime(tmp_path, (fetched, fetched))
+                os.replace(tmp_path, tile_path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+    def keys(self, level=None):
+        """Generate the keys of all tiles in the store.
+
+        level  if not None, only generate keys for this level
+        """
+
+        suffix = '.' + self.tile_ext
+        levels = [str(level)] if level is not None else os.listdir(self.tiles_dir)
+        for z in levels:
+            z_path = os.path.join(self.tiles_dir, z)
+            if not z.isdigit() or not os.path.isdir(z_path):
+                continue
+            for x in os.listdir(z_path):
+                x_path = os.path.join(z_path, x)
+                if not x.isdigit() or not os.path.isdir(x_path):
+                    continue
+                for fname in os.listdir(x_path):
+                    (y, ext) = os.path.splitext(fname)
+                    if ext == suffix and y.isdigit():
+                        yield (int(z), int(x), int(y))
+
+    def entries(self):
+        """Generate (key, size, fetched, accessed) for all tiles in the store.
+
+        'fetched' is the file modification time and 'accessed' is the later
+        of the file access and modification times.  Reading a file may not
+        change its access time (see 'noatime'), access_batch() sets it.
+        """
+
+        for key in self.keys():
+            try:
+                st = os.stat(self.tile_path(key))
+            except OSError:
+                # tile deleted while we were looking
+                continue
+            yield (key, st.st_size, st.st_mtime, max(st.st_atime, st.st_mtime))
+
+    def dates(self, level):
+        """Return a dictionary {key: fetch date} of all tiles in a level."""
+
+        result = {}
+        suffix = '.' + self.tile_ext
+        z_path = os.path.join(self.tiles_dir, str(level))
+        try:
+            x_entries = list(os.scandir(z_path))
+        except OSError:
+            return result
+        for x_entry in x_entries:
+            if not x_entry.name.isdigit() or not x_entry.is_dir():
+                continue
+            x = int(x_entry.name)
+            for entry in os.scandir(x_entry.path):
+                (y, ext) = os.path.splitext(entry.name)
+                if ext == suffix and y.isdigit():
+                    try:
+                        result[(level, x, int(y))] = entry.stat().st_mtime
+                    except OSError:
+                        # tile deleted while we were looking
+                        pass
+        return result
+
+    def touch_batch(self, tiles):
+        """Set the fetch time of a batch of tiles without rewriting them.
+
+        tiles  a list of (key, fetched) tuples
+        """
+
+        for (key, fetched) in tiles:
+            try:
+                os.utime(self.tile_path(key), (fetched, fetched))
+            except OSError:
+                # tile deleted while we were looking
+                pass
+
+    def access_batch(self, tiles):
+        """Record the last access time of a batch of tiles.
+
+        tiles  a list of (key, accessed) tuples
+
+        The access time is kept as the file access time.
+        """
+
+        for (key, accessed) in tiles:
+            tile_path = self.tile_path(key)
+            try:
+                os.utime(tile_path, (accessed, os.stat(tile_path).st_mtime))
+            except OSError:
+                # tile deleted while we were looking
+                pass
+
+    def get_validators(self, key):
+        """Return the validators of a tile, None if none saved."""
+
+        table = self._validator_table(create=False)
+        if table is None:
+            return None
+        return table.get(key)
+
+    def set_validators(self, items):
+        """Save validators of tiles.
+
+        items  a list of (key, validators) tuples
+        """
+
+        self._validator_table().set_batch(items)
+
+    def expiries(self, level):
+        """Return a dictionary {key: expires} of tiles in a level with one."""
+
+        table = self._validator_table(create=False)
+        if table is None:
+            return {}
+        return table.expiries(level)
+
+    def _validator_table(self, create=True):
+        """Return the ValidatorTable, opening the file if required.
+
+        create  if False and there is no validators file return None
+                rather than make the file
+        """
+
+        with self._lock:
+            if self._validators is None:
+                path = os.path.join(self.tiles_dir, self.ValidatorsFile)
+                if not create and not os.path.exists(path):
+                    return None
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._validators = ValidatorTable(self._db, threading.Lock())
+            return self._validators
+
+    def delete_batch(self, keys):
+        """Delete a batch of tiles, ignoring tiles that don't exist."""
+
+        for key in keys:
+            try:
+                os.remove(self.tile_path(key))
+            except OSError:
+                pass
+        table = self._validator_table(create=False)
+        if table is not None:
+            table.delete_batch(keys)
+
+    def close(self):
+        """Close the validators file, if open."""
+
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+                self._validators = None
+
+###############################################################################
+# All tiles in one SQLite file.
+###############################################################################
+
+class MBTilesStore(object):
+    """Store tiles in a single SQLite file with an MBTiles-compatible schema.
+
+    The 'tiles' table has extra 'fetched' and 'accessed' columns holding
+    the times each tile was fetched and last used, and tile validators
+    are in an extra 'validators' table.  MBTiles readers ignore the
+    extras.  Note that MBTiles rows are numbered from the bottom of the
+    map (TMS), whereas pySlip keys (and the validators table) are
+    numbered from the top.
+    """
+
+    def __init__(self, path, tile_ext='png', name=None):
+        """Prepare the store, creating the file if required.
+
+        path      path to the MBTiles file
+        tile_ext  the tile file extension, recorded as the 'format' metadata
+        name      the tileset name recorded in the metadata
+        """
+
+        self.path = path
+        self.tile_ext = tile_ext
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS metadata '
+                             '(name TEXT, value TEXT)')
+            self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS metadata_name '
+                             'ON metadata (name)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS tiles '
+                             '(zoom_level INTEGER, tile_column INTEGER, '
+                             'tile_row INTEGER, tile_data BLOB, fetched REAL, '
+                             'accessed REAL)')
+            self._db.execute('CREATE UNIQUE INDEX IF NOT EXISTS tile_index '
+                             'ON tiles (zoom_level, tile_column, tile_row)')
+            # files made before accesses were recorded don't have the column
+            columns = [row[1] for row in
+                           self._db.execute('PRAGMA table_info(tiles)')]
+            if 'accessed' not in columns:
+                self._db.execute('ALTER TABLE tiles ADD COLUMN accessed REAL')
+            metadata = [('format', 'jpg' if tile_ext == 'jpg' else 'png')]
+            if name is not None:
+                metadata.append(('name', name))
+            self._db.executemany('INSERT OR REPLACE INTO metadata (name, value) '
+                                 'VALUES (?, ?)', metadata)
+        self._validators = ValidatorTable(self._db, self._lock)
+
+    @staticmethod
+    def _tms(key):
+        """Convert a pySlip key to MBTiles (zoom_level, tile_column, tile_row)."""
+
+        (level, x, y) = key
+        return (level, x, (1 << level) - 1 - y)
+
+    def stat(self, key):
+        """Return the date a tile was fetched, or None if not in the store."""
+
+        with self._lock:
+            row = self._db.execute('SELECT fetched FROM tiles WHERE zoom_level=? '
+                                   'AND tile_column=? AND tile_row=?',
+                                   self._tms(key)).fetchone()
+        if row is None:
+            return None
+        return row[0] or 0.0
+
+    def read(self, key):
+        """Return the bytes of a tile.
+
+        Raises KeyError if the tile isn't in the store.
+        """
+
+        with self._lock:
+            row = self._db.execute('SELECT tile_data FROM tiles WHERE zoom_level=? '
+                                   'AND tile_column=? AND tile_row=?',
+                                   self._tms(key)).fetchone()
+        if row is None:
+            raise KeyError("Tile with key '%s' not in store" % str(key))
+        return bytes(row[0])
+
+    def write_batch(self, tiles):
+        """Write a batch of tiles in one transaction.
+
+        tiles  a list of (key, data, fetched) tuples, where 'fetched' is
+               the time the tile was fetched, None meaning now
+        """
+
+        now = time.time()
+        rows = [self._tms(key) + (sqlite3.Binary(data),
+                                  now if fetched is None else fetched)
+                for (key, data, fetched) in tiles]
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO tiles (zoom_level, '
+                                 'tile_column, tile_row, tile_data, fetched) '
+                                 'VALUES (?, ?, ?, ?, ?)', rows)
+
+    def keys(self, level=None):
+        """Return a list of the keys of all tiles in the store.
+
+        level  if not None, only return keys for this level
+        """
+
+        sql = 'SELECT zoom_level, tile_column, tile_row FROM tiles'
+        params = ()
+        if level is not None:
+            sql += ' WHERE zoom_level=?'
+            params = (level,)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [(z, x, (1 << z) - 1 - row) for (z, x, row) in rows]
+
+    def entries(self):
+        """Return a list of (key, size, fetched, accessed) for all tiles.
+
+        'accessed' is the later of the recorded access and fetch times.
+        """
+
+        with self._lock:
+            rows = self._db.execute('SELECT zoom_level, tile_column, tile_row, '
+                                    'length(tile_data), fetched, accessed '
+                                    'FROM tiles').fetchall()
+        result = []
+        for (z, x, row, size, fetched, accessed) in rows:
+            fetched = fetched or 0.0
+            result.append(((z, x, (1 << z) - 1 - row), size, fetched,
+                           max(fetched, accessed or 0.0)))
+        return result
+
+    def dates(self, level):
+        """Return a dictionary {key: fetch date} of all tiles in a level."""
+
+        with self._lock:
+            rows = self._db.execute('SELECT tile_column, tile_row, fetched '
+                                    'FROM tiles WHERE zoom_level=?',
+                                    (level,)).fetchall()
+        top = (1 << level) - 1
+        return dict(((level, x, top - row), fetched or 0.0)
+                    for (x, row, fetched) in rows)
+
+    def touch_batch(self, tiles):
+        """Set the fetch time of a batch of tiles without rewriting them.
+
+        tiles  a list of (key, fetched) tuples
+        """
+
+        rows = [(fetched,) + self._tms(key) for (key, fetched) in tiles]
+        with self._lock, self._db:
+            self._db.executemany('UPDATE tiles SET fetched=? WHERE zoom_level=? '
+                                 'AND tile_column=? AND tile_row=?', rows)
+
+    def access_batch(self, tiles):
+        """Record the last access time of a batch of tiles in one transaction.
+
+        tiles  a list of (key, accessed) tuples
+        """
+
+        rows = [(accessed,) + self._tms(key) for (key, accessed) in tiles]
+        with self._lock, self._db:
+            self._db.executemany('UPDATE tiles SET accessed=? '
+                                 'WHERE zoom_level=? AND tile_column=? '
+                                 'AND tile_row=?', rows)
+
+    def get_validators(self, key):
+        """Return the validators of a tile, None if none saved."""
+
+        return self._validators.get(key)
+
+    def set_validators(self, items):
+        """Save validators of tiles.
+
+        items  a list of (key, validators) tuples
+        """
+
+        self._validators.set_batch(items)
+
+    def expiries(self, level):
+        """Return a dictionary {key: expires} of tiles in a level with one."""
+
+        return self._validators.expiries(level)
+
+    def delete_batch(self, keys):
+        """Delete a batch of tiles in one transaction."""
+
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM tiles WHERE zoom_level=? '
+                                 'AND tile_column=? AND tile_row=?',
+                                 [self._tms(key) for key in keys])
+        self._validators.delete_batch(keys)
+
+    def close(self):
+        """Close the SQLite file."""
+
+        with self._lock:
+            self._db.close()
+
+###############################################################################
+# Copy tiles between stores.
+###############################################################################
+
+def migrate(src, dst, batch_size=500):
+    """Copy all tiles, and their validators, from one store to another.
+
+    src         the store to copy from
+    dst         the store to copy to
+    batch_size  number of tiles written in each batch
+
+    Returns the number of tiles copied.
+    """
+
+    count = 0
+    batch = []
+    validators = []
+    for key in src.keys():
+        try:
+            batch.append((key, src.read(key), src.stat(key)))
+        except KeyError:
+            # tile disappeared while we were copying
+            continue
+        tile_validators = src.get_validators(key)
+        if tile_validators is not None:
+            validators.append((key, tile_validators))
+        if len(batch) >= batch_size:
+            dst.write_batch(batch)
+            dst.set_validators(validators)
+            count += len(batch)
+            batch = []
+            validators = []
+    if batch:
+        dst.write_batch(batch)
+        dst.set_validators(validators)
+        count += len(batch)
+
+    return count
+
+
+if __name__ == '__main__':
+    import sys
+    import getopt
+
+    # print some usage information
+    def usage(msg=None):
+        if msg:
+            print(msg+'\n')
+        print(__doc__)        # module docstring used
+
+    try:
+        (opts, args) = getopt.getopt(sys.argv[1:], 'he:b:',
+                                     ['help', 'ext=', 'batch='])
+    except getopt.error:
+        usage()
+        sys.exit(1)
+
+    tile_ext = 'png'
+    batch_size = 500
+    for (opt, param) in opts:
+        if opt in ['-h', '--help']:
+            usage()
+            sys.exit(0)
+        elif opt in ('-e', '--ext'):
+            tile_ext = param.lower()
+        elif opt in ('-b', '--batch'):
+            batch_size = int(param)
+
+    if len(args) != 2:
+        usage()
+        sys.exit(1)
+    (tiles_dir, mbtiles_file) = args
+
+    if not os.path.isdir(tiles_dir):
+        usage("Tiles directory '%s' doesn't exist" % tiles_dir)
+        sys.exit(1)
+
+    src = DirectoryStore(tiles_dir, tile_ext)
+    dst = MBTilesStore(mbtiles_file, tile_ext)
+    start = time.time()
+    count = migrate(src, dst, batch_size)
+    dst.close()
+    print('Copied %d tiles in %.1fs' % (count, time.time() - start))
@@ -7,11 +7,24 @@ For example, see gmt_local.py (local tiles) and open_street_map.py
 """
 
 import os
+import io
 import math
+import time
+import queue
+import atexit
+import weakref
+import threading
+import collections
 import wx
 import pyslip.pycacheback as pycacheback
+import pyslip.tile_store as tile_store
 import pyslip.log as log
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 try:
     log = log.Log('pyslip.log')
 except AttributeError:
@@ -24,6 +37,231 @@ except AttributeError:
 # if 'None', never re-request tiles after first satisfied request
 RefreshTilesAfterDays = 60
 
+# put on a write queue to wake the writer to save recorded tile accesses
+# and write tiles that didn't fit on the queue
+WakeWriter = 'wake'
+
+# id -> cache with a writer thread, closed at exit so waiting tiles get
+# to disk (caches are dictionaries, so can't be in a WeakSet)
+_open_caches = weakref.WeakValueDictionary()
+
+def _close_caches():
+    """Close the caches with a writer thread, called at exit."""
+
+    for cache in list(_open_caches.values()):
+        cache.close()
+
+atexit.register(_close_caches)
+
+
+################################################################################
+# Writer thread for the disk cache.
+################################################################################
+
+class TileWriter(threading.Thread):
+    """Thread class that gets tile keys from a queue and writes them to disk."""
+
+    # seconds between checks that an idle writer's cache still exists
+    IdleCheck = 5
+
+    def __init__(self, cache, writes, batch_size):
+        """Prepare the tile writer.
+
+        cache       the Cache object owning the tiles to write
+        writes      the queue of tile keys to write (None means stop,
+                    WakeWriter means only save tile accesses and
+                    tiles not on the queue)
+        batch_size  maximum number of tiles written in one batch
+
+        Only a weak reference to the cache is kept, so a running writer
+        doesn't keep a discarded cache alive.  An idle writer stops once
+        its cache is gone.
+        """
+
+        threading.Thread.__init__(self)
+
+        self.cache = weakref.ref(cache)
+        self.writes = writes
+        self.batch_size = batch_size
+        self.daemon = True
+
+    def run(self):
+        while True:
+            # wait for a write, then take what else is waiting to make a batch
+            try:
+                keys = [self.writes.get(timeout=self.IdleCheck)]
+            except queue.Empty:
+                if self.cache() is None:
+                    return
+                continue
+            while len(keys) < self.batch_size:
+                try:
+                    keys.append(self.writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in keys
+            cache = self.cache()
+            try:
+                if cache is not None:
+                    cache._write_batch([k for k in keys
+                                        if k not in (None, WakeWriter)])
+                    cache._write_unqueued()
+                    cache._write_accesses()
+            except Exception as e:
+                log('%s exception writing %d tiles to disk'
+                        % (type(e).__name__, len(keys)))
+            finally:
+                cache = None
+                for _ in keys:
+                    self.writes.task_done()
+
+            if stop:
+                return
+
+################################################################################
+# Garbage collector for the disk cache.
+################################################################################
+
+class TileCollector(threading.Thread):
+    """Thread class that keeps the disk cache within a size quota.
+
+    Every 'interval' seconds the collector looks at every tile in the
+    store.  Tiles older than 'max_age' seconds are deleted first, then
+    least recently accessed tiles until the store is down to LowWater of
+    the quota.  Tiles in the in-memory cache count as just accessed and
+    are never deleted for age.
+    The collector sleeps 'pause' seconds after every 'batch' tiles looked
+    at or deleted, so it doesn't compete with tile fetching and drawing.
+    """
+
+    # fraction of the quota we reduce the store to when over quota
+    LowWater = 0.9
+
+    def __init__(self, cache, quota, max_age, interval, batch, pause):
+        """Prepare the tile collector.
+
+        cache     the Cache object owning the store
+        quota     maximum bytes of tiles in the store
+        max_age   tiles older than this many seconds are deleted
+                  (None means don't delete by age)
+        interval  seconds between collections
+        batch     number of tiles handled between pauses
+        pause     seconds to sleep between batches
+
+        Only a weak reference to the cache is kept, as for TileWriter,
+        and the collector stops once the cache is gone.
+        """
+
+        threading.Thread.__init__(self)
+
+        self.cache = weakref.ref(cache)
+        self.quota = quota
+        self.max_age = max_age
+        self.interval = interval
+        self.batch = batch
+        self.pause = pause
+        self.stop_event = threading.Event()
+        self.daemon = True
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.cache() is None:
+                return
+            try:
+                self.collect()
+            except Exception as e:
+                log('%s exception collecting disk cache tiles'
+                        % type(e).__name__)
+            self.stop_event.wait(self.interval)
+
+    def collect(self):
+        """Do one collection, return the number of tiles deleted."""
+
+        cache = self.cache()
+        if cache is None:
+            return 0
+
+        now = time.time()
+        old = []
+        entries = []
+        total = 0
+        for (n, entry) in enumerate(cache._store.entries()):
+            (key, size, fetched, accessed) = entry
+            if cache.in_memory(key):
+                accessed = now
+            elif self.max_age is not None and fetched < now - self.max_age:
+                old.append(key)
+                continue
+            entries.append((accessed, size, key))
+            total += size
+            if n % self.batch == self.batch - 1 and self._sleep():
+                return 0
+
+        # delete the least recently accessed tiles if over quota
+        doomed = old
+        if self.quota is not None and total > self.quota:
+            entries.sort()
+            target = self.quota * self.LowWater
+            for (_, size, key) in entries:
+                if total <= target:
+                    break
+                doomed.append(key)
+                total -= size
+
+        for i in range(0, len(doomed), self.batch):
+            cache._delete_from_back(doomed[i:i+self.batch])
+            if self._sleep():
+                break
+
+        return len(doomed)
+
+    def _sleep(self):
+        """Pause between batches, return True if we have been stopped."""
+
+        return self.stop_event.wait(self.pause)
+
+################################################################################
+# Loader for the in-memory index of on-disk tiles.
+################################################################################
+
+class IndexLoader(threading.Thread):
+    """Thread class that reads the fetch dates of one level's on-disk tiles."""
+
+    def __init__(self, cache, level):
+        """Prepare the index loader.
+
+        cache  the Cache object owning the index
+        level  the level to load
+        """
+
+        threading.Thread.__init__(self)
+
+        self.cache = cache
+        self.level = level
+        self.daemon = True
+
+    def run(self):
+        try:
+            dates = self.cache._store.dates(self.level)
+            expiries = self.cache._store.expiries(self.level)
+        except Exception as e:
+            log('%s exception indexing level %d of disk cache'
+                    % (type(e).__name__, self.level))
+            (dates, expiries) = (None, None)
+        self.cache._index_loaded(self.level, dates, expiries)
+
+################################################################################
+# In-memory cache of undecoded tile file bytes.
+################################################################################
+
+class DataCache(pycacheback.pyCacheBack):
+    """LRU in-memory cache of tile file bytes, limited by total bytes."""
+
+    def _sizeof(self, data):
+        """Return the size of cached tile bytes."""
+
+        return len(data)
 
 ################################################################################
 # Define a cache for tiles.  This is an in-memory cache backed to disk.
@@ -34,25 +272,381 @@ class Cache(pycacheback.pyCacheBack):
 
     Instance variables we use from pyCacheBack:
         self._tiles_dir  path to the on-disk cache directory
+
+    All disk access goes through a tile store (see tile_store.py) given
+    by the 'store' keyword parameter.  The default is a DirectoryStore
+    in the tiles directory.
+
+    The first lookup of a tile in a level starts an IndexLoader thread
+    that reads the fetch dates of all that level's on-disk tiles into an
+    in-memory index.  Once a level is indexed, existence and date checks
+    are dictionary lookups.  Until then the results of looking for tiles
+    on disk are remembered for a short time, so repeated checks for the
+    same tile don't each go to the filesystem.  Writing or deleting a
+    tile updates the index and what we remember.
+
+    If WriteBehind is True tiles are written to disk by a TileWriter
+    thread, so the caller never waits for the disk write.
+    Tiles waiting to be written are still found by _get_from_back().
+    Tiles still waiting when the program ends without close() being
+    called are not on disk, and are fetched again on the next run.
+
+    Tiles fetched from a server are written to disk as the bytes the
+    server sent (see put_data()), with the file extension given by the
+    'tile_ext' keyword parameter.
+
+    The in-memory cache has two tiers.  The pyCacheBack dictionary is a
+    small "hot" tier of decoded bitmaps.  Behind it is a larger "warm"
+    DataCache of undecoded tile bytes, limited to 'warm_bytes' bytes.
+    Tiles read from disk or fetched from a server go into the warm tier,
+    and a warm tile is decoded and promoted to the hot tier when used.
+
+    set_disk_quota() starts a TileCollector thread to keep the store
+    within a size limit.  Tiles read from the warm tier or disk have the
+    access recorded in the store, saved in batches by the writer thread,
+    so the collector keeps recently used tiles.
     """
 
     PicExtension = 'png'
-    TilePath = '{Z}/{X}/{Y}.%s' % PicExtension
-    TileDiskFormat = wx.BITMAP_TYPE_PNG
+
+    # the wx bitmap type used to write wx images for each file extension
+    TileDiskFormats = {'png': wx.BITMAP_TYPE_PNG,
+                       'jpg': wx.BITMAP_TYPE_JPEG,
+                      }
+
+    # maximum number of remembered on-disk lookups
+    MaxStatCache = 10000
+
+    # number of seconds an on-disk lookup result is trusted
+    StatCacheTTL = 60
+
+    # True if tiles are written to disk by a background thread
+    WriteBehind = True
+
+    # maximum number of tiles waiting to be written to disk
+    MaxWriteQueue = 1000
+
+    # maximum number of tiles written to disk in one batch
+    WriteBatchSize = 32
+
+    # default maximum bytes in the warm tier of undecoded tiles
+    DefaultWarmBytes = 128 * 1024 * 1024
+
+    # seconds between disk cache collections
+    CollectorInterval = 10 * 60
+
+    # number of tiles the collector handles between pauses
+    CollectorBatch = 200
+
+    # seconds the collector sleeps between batches
+    CollectorPause = 0.05
+
+    def __init__(self, *args, **kwargs):
+        # the warm tier of undecoded tile bytes
+        self._warm = DataCache(max_lru=None,
+                               max_bytes=kwargs.pop('warm_bytes',
+                                                    self.DefaultWarmBytes))
+
+        # the on-disk tile file extension, format and store
+        self._tile_ext = kwargs.pop('tile_ext', self.PicExtension)
+        self._disk_format = self.TileDiskFormats[self._tile_ext]
+        self._store = kwargs.pop('store', None)
+        if self._store is None:
+            self._store = tile_store.DirectoryStore(kwargs.get('tiles_dir',
+                                                               self.DefaultTilesDir),
+                                                    self._tile_ext)
+
+        # tile key -> (expiry time, tile date or None if tile not on disk)
+        self._stat_cache = collections.OrderedDict()
+        self._stat_lock = threading.Lock()
+
+        # level -> {tile key: fetch date} for indexed levels
+        self._index = {}
+
+        # level -> {tile key: fetch date or None} of changes while indexing
+        self._index_changes = {}
+
+        # tile key -> time tile goes stale, for tiles the server gave one
+        self._expires = {}
+
+        # tile key -> image or bytes waiting to be written to disk
+        self._pending_writes = {}
+
+        # tile key -> validators to save with a waiting tile
+        self._pending_validators = {}
+
+        # tile key -> None for waiting tiles that didn't fit on the write
+        # queue, in the order they arrived
+        self._unqueued = {}
+
+        # tile key -> time the tile was last read from the warm tier or disk
+        self._pending_accesses = {}
+        self._write_lock = threading.Lock()
+        self._write_queue = queue.Queue(maxsize=self.MaxWriteQueue)
+        self._writer = None
+        self._collector = None
+
+        super().__init__(*args, **kwargs)
+
+    def _sizeof(self, bitmap):
+        """Return the in-memory size of a cached bitmap in bytes."""
+
+        try:
+            depth = bitmap.GetDepth()
+            if depth <= 0:
+                depth = 32
+            return bitmap.GetWidth() * bitmap.GetHeight() * ((depth + 7) // 8)
+        except AttributeError:
+            # not a bitmap, we don't know how big it is
+            return 0
+
+    def info(self):
+        """Return a dictionary describing in-memory cache usage.
+
+        As for pyCacheBack.info() with extra keys:
+            'warm_entries'     number of tiles in the warm tier
+            'warm_bytes'       total bytes in the warm tier
+            'warm_high_bytes'  highest total bytes in the warm tier seen
+            'warm_max_bytes'   the warm tier byte limit
+        """
+
+        result = super().info()
+        warm = self._warm.info()
+        result.update({'warm_entries': warm['entries'],
+                       'warm_bytes': warm['bytes'],
+                       'warm_high_bytes': warm['high_bytes'],
+                       'warm_max_bytes': warm['max_bytes']})
+        return result
+
+    def set_warm_bytes(self, max_bytes):
+        """Set the warm tier byte limit, evicting tiles if required."""
+
+        self._warm.set_max_bytes(max_bytes)
 
     def tile_date(self, key):
-        """Return the creation date of a tile given its key."""
+        """Return the fetch date of a tile given its key.
+
+        Raises FileNotFoundError if the tile isn't on disk.
+        """
+
+        tile_date = self._stat(key)
+        if tile_date is None:
+            raise FileNotFoundError("Tile with key '%s' not found in on-disk cache"
+                                    % str(key))
+        return tile_date
+
+    def tile_on_disk(self, key):
+        """Return True if the tile with the given key is on disk."""
+
+        return self._stat(key) is not None
+
+    def fetch_date(self, key):
+        """Return the fetch date of a tile, or None if the tile isn't on disk."""
+
+        return self._stat(key)
+
+    def tile_expires(self, key):
+        """Return the time a tile goes stale, None if the server gave none.
+
+        Only known once the tile's level is indexed.
+        """
+
+        with self._stat_lock:
+            return self._expires.get(key)
+
+    def tile_validators(self, key):
+        """Return the HTTP validators of a tile on disk, None if none.
+
+        See tile_store.py for the validators dictionary.
+        """
+
+        if self._stat(key) is None:
+            return None
+        with self._write_lock:
+            validators = self._pending_validators.get(key)
+        if validators is not None:
+            return validators
+        return self._store.get_validators(key)
+
+    def revalidated(self, key, validators=None):
+        """Mark a tile on disk as freshly fetched without rewriting it.
+
+        key         the tile key
+        validators  new validators from the server, None if none
+
+        Used when the server says a tile hasn't changed.  A new ETag or
+        Last-Modified replaces the saved one.  The expiry is always the
+        new one, None means the tile ages like one with no expiry, as
+        keeping a passed expiry would make the tile stale again at once.
+        """
+
+        now = time.time()
+        if validators:
+            old = self._store.get_validators(key) or {}
+            validators = dict(validators)
+            for name in ('etag', 'last_modified'):
+                if validators.get(name) is None:
+                    validators[name] = old.get(name)
+            self._store.set_validators([(key, validators)])
+            self._remember_expires(key, validators.get('expires'))
+        self._store.touch_batch([(key, now)])
+        self._remember_stat(key, now)
+        self.stats.count('revalidations')
+
+    def _remember_expires(self, key, expires):
+        """Remember the time a tile goes stale, None if no time given."""
+
+        with self._stat_lock:
+            if expires is None:
+                self._expires.pop(key, None)
+            else:
+                self._expires[key] = expires
+
+    def flush(self):
+        """Wait until all tiles waiting to be written are on disk."""
+
+        if self._writer is not None:
+            self._write_queue.join()
+
+    def close(self):
+        """Write all waiting tiles to disk and stop background threads."""
+
+        self.set_disk_quota(None)
+        with self._write_lock:
+            writer = self._writer
+            self._writer = None
+        if writer is not None:
+            self._write_queue.put(None)
+            writer.join()
+
+    def set_disk_quota(self, quota, max_age=None):
+        """Limit the size of the on-disk cache.
+
+        quota    maximum bytes of tiles in the store, None means no limit
+        max_age  tiles older than this many seconds are deleted
+                 (None means don't delete by age)
+
+        A TileCollector thread enforces the limits.  If both 'quota' and
+        'max_age' are None the collector is stopped.
+        """
+
+        with self._write_lock:
+            collector = self._collector
+            self._collector = None
+            if quota is not None or max_age is not None:
+                self._collector = TileCollector(self, quota, max_age,
+                                                self.CollectorInterval,
+                                                self.CollectorBatch,
+                                                self.CollectorPause)
+                self._collector.start()
+        if collector is not None:
+            collector.stop_event.set()
+
+    def in_memory(self, key):
+        """Return True if the tile with the given key is in memory."""
 
-        tile_path = self.tile_path(key)
-        return os.path.getctime(tile_path)
+        return key in self or key in self._warm
+
+    def forget_stats(self):
+        """Forget all remembered on-disk lookups.
+
+        Use this if the disk cache is changed by something other than
+        this Cache object.
+        """
+
+        with self._stat_lock:
+            self._stat_cache.clear()
+            self._index.clear()
+            self._index_changes.clear()
+            self._expires.clear()
+
+    def _stat(self, key):
+        """Return fetch date of tile on disk, or None if not on disk.
+
+        Looks in the level index if it's loaded, otherwise starts loading
+        it.  A result from the store is remembered for StatCacheTTL seconds.
+        """
+
+        level = key[0]
+        now = time.monotonic()
+        with self._stat_lock:
+            try:
+                return self._index[level].get(key)
+            except KeyError:
+                pass
+
+            if level not in self._index_changes:
+                self._index_changes[level] = {}
+                IndexLoader(self, level).start()
+
+            try:
+                (expiry, tile_date) = self._stat_cache[key]
+                if expiry > now:
+                    return tile_date
+            except KeyError:
+                pass
+
+        tile_date = self._store.stat(key)
+        self._remember_stat(key, tile_date)
+
+        return tile_date
+
+    def _remember_stat(self, key, tile_date):
+        """Remember the on-disk state of a tile.
+
+        key        the tile key
+        tile_date  the tile fetch date, None if tile isn't on disk
+        """
+
+        level = key[0]
+        with self._stat_lock:
+            if level in self._index:
+                if tile_date is None:
+                    self._index[level].pop(key, None)
+                else:
+                    self._index[level][key] = tile_date
+            elif level in self._index_changes:
+                self._index_changes[level][key] = tile_date
+
+            self._stat_cache.pop(key, None)
+            self._stat_cache[key] = (time.monotonic() + self.StatCacheTTL,
+                                     tile_date)
+            while len(self._stat_cache) > self.MaxStatCache:
+                self._stat_cache.popitem(last=False)
+
+    def _index_loaded(self, level, dates, expiries):
+        """Install a loaded level index.
+
+        level     the level loaded
+        dates     dictionary {tile key: fetch date}, None if the load failed
+        expiries  dictionary {tile key: time tile goes stale}
+
+        Changes made while the level was loading are applied to 'dates'.
+        Called from the IndexLoader thread.
+        """
+
+        with self._stat_lock:
+            changes = self._index_changes.pop(level, None)
+            if dates is None or changes is None:
+                # load failed, or the index was forgotten while loading
+                return
+            for (key, expires) in expiries.items():
+                # an expiry set while loading is newer
+                self._expires.setdefault(key, expires)
+            for (key, tile_date) in changes.items():
+                if tile_date is None:
+                    dates.pop(key, None)
+                else:
+                    dates[key] = tile_date
+            self._index[level] = dates
 
     def tile_path(self, key):
-        """Return path to a tile file given its key."""
+        """Return path to a tile file given its key.
 
-        (level, x, y) = key
-        file_path = os.path.join(self._tiles_dir,
-                                 self.TilePath.format(Z=level, X=x, Y=y))
-        return file_path
+        Only meaningful if the tile store is a DirectoryStore.
+        """
+
+        return self._store.tile_path(key)
 
     def _get_from_back(self, key):
         """Retrieve value for 'key' from backing storage.
@@ -64,15 +658,60 @@ class Cache(pycacheback.pyCacheBack):
         Raises KeyError if tile not found.
         """
 
+        # look in the warm tier first
+        try:
+            data = self._warm[key]
+            self.stats.count('warm_hits')
+            self._record_access(key)
+            return self._decode(data)
+        except KeyError:
+            pass
+
         # look for item in disk cache
-        file_path = self.tile_path(key)
-        if not os.path.exists(file_path):
+        if not self.tile_on_disk(key):
             # tile not there, raise KeyError
             raise KeyError("Item with key '%s' not found in on-disk cache"
                            % str(key))
 
+        # the tile may still be waiting to be written
+        with self._write_lock:
+            image = self._pending_writes.get(key)
+        if isinstance(image, bytes):
+            return self._decode(image)
+        if image is not None:
+            return image.ConvertToBitmap()
+
         # we have the tile file - read into memory & return
-        return wx.Image(file_path, Cache.TileDiskFormat).ConvertToBitmap()
+        try:
+            data = self._store.read(key)
+        except KeyError:
+            # tile has gone from the store
+            self._remember_stat(key, None)
+            raise
+        self.stats.count('bytes_read', len(data))
+        self._record_access(key)
+        self._warm.put(key, data, back=False)
+        return self._decode(data)
+
+    def _decode(self, data):
+        """Return a bitmap decoded from tile file bytes."""
+
+        return wx.Image(io.BytesIO(data), wx.BITMAP_TYPE_ANY).ConvertToBitmap()
+
+    def put_data(self, key, data, validators=None):
+        """Put the undecoded bytes of a tile into the on-disk cache.
+
+        key         a tuple: (level, x, y)
+        data        the tile file bytes, written to disk unchanged
+        validators  the HTTP validators of the tile, if any
+
+        The bytes are also kept in the warm in-memory tier.
+        """
+
+        self._warm.put(key, data, back=False)
+        self._remember_expires(key, validators and validators.get('expires'))
+        with self._key_lock(key):
+            self._queue_write(key, data, validators)
 
     def _put_to_back(self, key, image):
         """Put a image into on-disk cache.
@@ -81,20 +720,206 @@ class Cache(pycacheback.pyCacheBack):
                 where level  level for image
                       x      integer tile coordinate
                       y      integer tile coordinate
-        image   the wx.Image to save
+        image   the wx.Bitmap or wx.Image to save
         """
 
-        (level, x, y) = key
-        tile_path = os.path.join(self._tiles_dir,
-                                 self.TilePath.format(Z=level, X=x, Y=y))
-        dir_path = os.path.dirname(tile_path)
-        try:
-            os.makedirs(dir_path)
-        except OSError:
-            # we assume it's a "directory exists' error, which we ignore
-            pass
+        # bitmaps are GUI objects, convert to a wx.Image for the writer thread
+        if self.WriteBehind and isinstance(image, wx.Bitmap):
+            image = image.ConvertToImage()
+
+        self._queue_write(key, image)
+
+    def _queue_write(self, key, image, validators=None):
+        """Write a tile to disk, or queue it for the writer thread.
+
+        key         a tuple: (level, x, y)
+        image       the wx.Image or bytes to write
+        validators  the HTTP validators of the tile, if any
+
+        If WriteBehind is set the tile is queued for the writer thread.
+        If the write queue is full the tile is kept waiting, without
+        waiting for the writer, and the writer writes it once it has
+        caught up.  These are counted in the 'unqueued_writes' statistic.
+        """
+
+        if not self.WriteBehind:
+            self._store.write_batch([(key, self._encode(image), None)])
+            if validators:
+                self._store.set_validators([(key, validators)])
+            self._remember_stat(key, time.time())
+            return
+
+        with self._write_lock:
+            self._start_writer()
+            queued = key in self._pending_writes
+            self._pending_writes[key] = image
+            if validators:
+                self._pending_validators[key] = validators
+            else:
+                self._pending_validators.pop(key, None)
+
+        # a key already waiting just gets the newer data
+        if not queued:
+            try:
+                self._write_queue.put_nowait(key)
+            except queue.Full:
+                # the writer is behind, leave the tile for it to find
+                # when it has written the tiles on the queue
+                with self._write_lock:
+                    self._unqueued[key] = None
+                self.stats.count('unqueued_writes')
+
+                # wake the writer in case it emptied the queue meanwhile,
+                # if the queue is still full the writer will find the tile
+                try:
+                    self._write_queue.put_nowait(WakeWriter)
+                except queue.Full:
+                    pass
+        self._remember_stat(key, time.time())
+
+    def _start_writer(self):
+        """Start the writer thread if not running, hold _write_lock."""
+
+        if self._writer is None:
+            self._writer = TileWriter(self, self._write_queue,
+                                      self.WriteBatchSize)
+            self._writer.start()
+            _open_caches[id(self)] = self
+
+    def _record_access(self, key):
+        """Record that a tile was read, for the disk cache collector.
+
+        key  the tile key
+
+        If WriteBehind is set accesses are saved in batches by the writer
+        thread, otherwise saved now.
+        """
+
+        now = time.time()
+        if not self.WriteBehind:
+            self._store.access_batch([(key, now)])
+            return
+
+        with self._write_lock:
+            self._start_writer()
+            wake = not self._pending_accesses
+            self._pending_accesses[key] = now
+        if wake:
+            try:
+                self._write_queue.put_nowait(WakeWriter)
+            except queue.Full:
+                # the writer is busy and will save the accesses
+                pass
+
+    def _write_unqueued(self):
+        """Write the waiting tiles that didn't fit on the write queue.
+
+        Called from the TileWriter thread.
+        """
+
+        while True:
+            with self._write_lock:
+                keys = list(self._unqueued)[:self.WriteBatchSize]
+                for key in keys:
+                    del self._unqueued[key]
+            if not keys:
+                return
+            self._write_batch(keys)
+
+    def _write_accesses(self):
+        """Save the recorded tile accesses to the store.
+
+        Called from the TileWriter thread.
+        """
+
+        with self._write_lock:
+            accesses = list(self._pending_accesses.items())
+            self._pending_accesses.clear()
+        if accesses:
+            self._store.access_batch(accesses)
 
-        image.SaveFile(tile_path, Cache.TileDiskFormat)
+    def _write_batch(self, keys):
+        """Write a batch of waiting tiles to the tile store.
+
+        keys  list of keys of tiles to write
+
+        Called from the TileWriter thread.
+        """
+
+        while keys:
+            # get the tiles still waiting to be written
+            with self._write_lock:
+                batch = [(key, self._pending_writes[key]) for key in keys
+                         if key in self._pending_writes]
+                validators = [(key, self._pending_validators[key])
+                              for (key, _) in batch
+                              if key in self._pending_validators]
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            tiles = []
+            for (key, image) in batch:
+                try:
+                    tiles.append((key, self._encode(image), None))
+                except Exception as e:
+                    log('%s exception encoding tile %s'
+                            % (type(e).__name__, str(key)))
+                    self._remember_stat(key, None)
+                    self.stats.count('write_errors')
+            try:
+                self._store.write_batch(tiles)
+                if validators:
+                    self._store.set_validators(validators)
+                self.stats.count('writes', len(tiles))
+                self.stats.count('bytes_written',
+                                 sum(len(data) for (_, data, _) in tiles))
+            except Exception as e:
+                log('%s exception writing %d tiles to disk'
+                        % (type(e).__name__, len(tiles)))
+                for (key, _, _) in tiles:
+                    self._remember_stat(key, None)
+                self.stats.count('write_errors', len(tiles))
+            self.stats.observe('write', time.perf_counter() - start)
+
+            # forget written tiles, unless a newer one arrived while writing
+            keys = []
+            with self._write_lock:
+                for (key, image) in batch:
+                    if self._pending_writes.get(key) is image:
+                        del self._pending_writes[key]
+                        self._pending_validators.pop(key, None)
+                    else:
+                        keys.append(key)
+
+    def _delete_from_back(self, keys):
+        """Delete tiles from the tile store.
+
+        keys  list of keys of tiles to delete
+
+        Tiles waiting to be written are not deleted.
+        """
+
+        with self._write_lock:
+            keys = [key for key in keys if key not in self._pending_writes]
+        self._store.delete_batch(keys)
+        for key in keys:
+            self._remember_stat(key, None)
+        self.stats.count('disk_evictions', len(keys))
+
+    def _encode(self, image):
+        """Return the file bytes for a tile.
+
+        image  the wx.Bitmap, wx.Image or file bytes of the tile
+        """
+
+        if isinstance(image, bytes):
+            return image
+        if isinstance(image, wx.Bitmap):
+            image = image.ConvertToImage()
+        stream = io.BytesIO()
+        image.SaveFile(stream, self._disk_format)
+        return stream.getvalue()
 
 ###############################################################################
 # Base class for a tile source - handles access to a source of tiles.
@@ -106,8 +931,16 @@ class BaseTiles(object):
     # maximum number of in-memory cached tiles
     MaxLRU = 1000
 
+    # maximum number of bytes used by in-memory cached tiles (None is no limit)
+    MaxBytes = None
+
+    # maximum number of bytes used by in-memory undecoded tiles
+    WarmBytes = Cache.DefaultWarmBytes
+
     def __init__(self, levels, tile_width, tile_height,
-                       tiles_dir, max_lru=MaxLRU):
+                       tiles_dir, max_lru=MaxLRU, max_bytes=MaxBytes,
+                       tile_ext=Cache.PicExtension, warm_bytes=WarmBytes,
+                       store=None, disk_quota=None, max_disk_age=None):
         """Initialise a Tiles instance.
 
         levels       a list of level numbers that are to be served
@@ -115,6 +948,15 @@ class BaseTiles(object):
         tile_height  height of each tile in pixels
         tiles_dir    path to on-disk tile cache directory
         max_lru      maximum number of cached in-memory tiles
+        max_bytes    maximum bytes used by cached in-memory tiles
+                     (None means no limit)
+        tile_ext     file extension of on-disk tiles ('png' or 'jpg')
+        warm_bytes   maximum bytes used by in-memory undecoded tiles
+        store        the on-disk tile store (see tile_store.py), if None
+                     use a DirectoryStore in 'tiles_dir'
+        disk_quota   maximum bytes of tiles on disk (None means no limit)
+        max_disk_age on-disk tiles older than this many days are deleted
+                     if there is a disk quota
         """
 
         # save params
@@ -123,6 +965,7 @@ class BaseTiles(object):
         self.tile_size_y = tile_height
         self.tiles_dir = tiles_dir
         self.max_lru = max_lru
+        self.max_bytes = max_bytes
 
         # set min and max tile levels and current level
         self.min_level = min(self.levels)
@@ -134,7 +977,11 @@ class BaseTiles(object):
 #        self.wrap_y = False
 
         # setup the tile cache
-        self.cache = Cache(tiles_dir=tiles_dir, max_lru=max_lru)
+        self.cache = Cache(tiles_dir=tiles_dir, max_lru=max_lru,
+                           max_bytes=max_bytes, tile_ext=tile_ext,
+                           warm_bytes=warm_bytes, store=store)
+        self.max_disk_age = max_disk_age
+        self.SetDiskQuota(disk_quota)
 
         #####
         # Now finish setting up
@@ -202,6 +1049,21 @@ class BaseTiles(object):
             raise KeyError("Can't find tile for key '%s'"
                            % str((self.level, x, y)))
 
+    def SetView(self, left, top, right, bottom):
+        """Tell the tile source what part of the map is in the view.
+
+        left    the view left edge in fractional tile coordinates
+        top     the view top edge in fractional tile coordinates
+        right   the view right edge in fractional tile coordinates
+        bottom  the view bottom edge in fractional tile coordinates
+
+        Called before the tiles for a view are drawn.  Local tiles ignore
+        this, server tiles use it to fetch the tiles nearest the centre
+        first and to forget tiles the view has moved away from.
+        """
+
+        pass
+
     def GetInfo(self, level):
         """Get tile info for a particular level.
 
@@ -232,6 +1094,73 @@ class BaseTiles(object):
 
         return self.extent
 
+    def GetCacheInfo(self):
+        """Get in-memory tile cache usage.
+
+        Returns a dictionary with keys 'entries', 'bytes', 'high_entries',
+        'high_bytes', 'max_lru' and 'max_bytes' for the decoded bitmap tier
+        and 'warm_entries', 'warm_bytes', 'warm_high_bytes' and
+        'warm_max_bytes' for the undecoded tile bytes tier.
+        """
+
+        return self.cache.info()
+
+    def GetStats(self):
+        """Get a snapshot of tile cache statistics.
+
+        Returns the dictionary described in pycacheback.CacheStats.snapshot().
+        Counters include 'memory_hits', 'warm_hits', 'back_hits', 'misses',
+        'evictions', 'bytes_read', 'bytes_written' and 'writes'.  Server
+        tile sources add 'requests', 'fetches', 'fetch_errors',
+        'decode_errors', 'bytes_fetched', 'cancelled' (requests dropped
+        as the view moved away from the tile), 'not_modified',
+        'revalidations' (stale tiles the server said were unchanged),
+        'retries' (failed requests queued again) and 'throttled'
+        (responses saying the server is overloaded).
+        """
+
+        return self.cache.stats.snapshot()
+
+    def ResetStats(self):
+        """Set all tile cache statistics back to zero."""
+
+        self.cache.stats.reset()
+
+    def SetCacheMaxBytes(self, max_bytes):
+        """Set the maximum bytes used by in-memory cached tiles.
+
+        max_bytes  the new limit in bytes (None means no limit)
+
+        Tiles are evicted from memory if the cache is over the new limit.
+        """
+
+        self.max_bytes = max_bytes
+        self.cache.set_max_bytes(max_bytes)
+
+    def SetDiskQuota(self, quota):
+        """Set the maximum bytes of tiles kept on disk.
+
+        quota  the limit in bytes, None means no limit
+
+        The limit is enforced by a background thread that deletes the
+        least recently used tiles, after any tiles older than the
+        'max_disk_age' given to the constructor.
+        """
+
+        self.disk_quota = quota
+        max_age = None
+        if quota is not None and self.max_disk_age:
+            max_age = self.max_disk_age * 24 * 60 * 60
+        self.cache.set_disk_quota(quota, max_age)
+
+    def SetWarmCacheMaxBytes(self, max_bytes):
+        """Set the maximum bytes used by in-memory undecoded tiles.
+
+        max_bytes  the new limit in bytes (None means no limit)
+        """
+
+        self.cache.set_warm_bytes(max_bytes)
+
     def tile_on_disk(self, level, x, y):
         """Return True if tile at (level, x, y) is on-disk."""
 
@@ -260,6 +1189,20 @@ class BaseTiles(object):
         msg = 'You must override BaseTiles.Geo2Tile(xgeo, ygeo)'
         raise NotImplementedError(msg)
 
+    def Geo2TileArray(self, geo):
+        """Convert an array of geo coordinates to tile fractional coordinates.
+
+        geo  NumPy array of shape (N, 2), each row (xgeo, ygeo)
+
+        Returns a NumPy array of shape (N, 2), each row (xtile, ytile).
+
+        This converts one point at a time, tile sources should override
+        it to convert the whole array at once.
+        """
+
+        return numpy.array([self.Geo2Tile(tuple(g)) for g in geo.tolist()],
+                           dtype=float).reshape(-1, 2)
+
     def Tile2Geo(self, xtile, ytile):
         """Convert tile fractional coordinates to geo for level in use.
 
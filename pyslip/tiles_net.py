@@ -8,15 +8,25 @@ For example, see open_street_map.py.
 import sys
 import os
 import io
+import re
 import time
 import math
+import email.utils
 import threading
 import traceback
+import concurrent.futures
+import concurrent.futures.process
 import urllib
 import urllib.request as request
-import queue
 import wx
 import pyslip.tiles as tiles
+import pyslip.http_pool as http_pool
+import pyslip.async_fetch as async_fetch
+import pyslip.tile_queue as tile_queue
+import pyslip.tile_decode as tile_decode
+import pyslip.rate_limit as rate_limit
+import pyslip.server_balance as server_balance
+import pyslip.hedge as hedge
 import pyslip.sys_tile_data as std
 import pyslip.log as log
 
@@ -31,12 +41,86 @@ except AttributeError:
 # if 'None', never re-request tiles after first satisfied request.
 RefreshTilesAfterDays = 60
 
+# the least number of seconds a fetched or revalidated tile stays fresh,
+# whatever the server says
+MinFreshSeconds = 300
+
 # define the error messages for various failures
 StatusError = {401: 'Looks like you need to be authorised for this server.',
                404: 'You might need to check the tile addressing for this server.',
                429: 'You are asking for too many tiles.',
               }
 
+################################################################################
+# Check a server response to a tile request.
+################################################################################
+
+def tile_data(key, server, status, info, body, content_type):
+    """Return the tile bytes from a server response, None if not a tile.
+
+    key           the (level, x, y) tile key
+    server        the server URL
+    status        the HTTP response status
+    info          the response headers
+    body          the response body bytes
+    content_type  expected Content-Type string
+    """
+
+    if status != 200:
+        # show error tile, don't cache returned error tile
+        log('Error: status %d getting tile (%d,%d,%d) from %s'
+                % ((status,) + key + (server,)))
+        return None
+    if info.get_content_type() != content_type:
+        # show error tile, don't cache returned error tile
+        return None
+
+    return body
+
+def response_validators(info, now, saved=None):
+    """Return the validators dictionary for a tile from response headers.
+
+    info   the response headers
+    now    the time the response arrived
+    saved  the validators saved with the tile, None if none
+
+    The tile goes stale after the Cache-Control max-age, or at the
+    Expires time.  A 304 response often has neither, then the saved
+    max-age is used again.  'no-cache' or 'no-store' count as a max-age
+    of 0, but any expiry is at least MinFreshSeconds away so a server
+    that never wants its tiles kept doesn't get a request at every
+    repaint.  'expires' is None if there is no expiry at all.
+    """
+
+    cache_control = info.get('Cache-Control', '')
+    max_age = re.search(r'max-age\s*=\s*(\d+)', cache_control)
+    if max_age:
+        max_age = int(max_age.group(1))
+    elif re.search(r'no-cache|no-store', cache_control):
+        max_age = 0
+    elif info.get('Expires'):
+        max_age = None
+    elif saved:
+        max_age = saved.get('max_age')
+
+    expires = None
+    if max_age is not None:
+        expires = now + max_age
+    elif info.get('Expires'):
+        try:
+            expires = email.utils.parsedate_to_datetime(
+                                            info.get('Expires')).timestamp()
+        except (TypeError, ValueError):
+            # an invalid date means already expired
+            expires = now
+    if expires is not None:
+        expires = max(expires, now + MinFreshSeconds)
+
+    return {'etag': info.get('ETag'),
+            'last_modified': info.get('Last-Modified'),
+            'expires': expires,
+            'max_age': max_age}
+
 ################################################################################
 # Worker class for server tile retrieval
 ################################################################################
@@ -44,29 +128,41 @@ StatusError = {401: 'Looks like you need to be authorised for this server.',
 class TileWorker(threading.Thread):
     """Thread class that gets request from queue, loads tile, calls callback."""
 
-    def __init__(self, id_num, server, tilepath, requests, callback,
+    # seconds between checks that a request waiting to be hedged is done
+    HedgePoll = 0.05
+
+    def __init__(self, id_num, balancer, tilepath, requests, callback,
                  error_tile, content_type, rerequest_age, error_image,
-                 user_agent):
+                 headers, pools, hedge=None, executor=None):
         """Prepare the tile worker.
 
         id_num         a unique numer identifying the worker instance
-        server         server URL
+        balancer       the server_balance.ServerBalancer picking the server
+                       for each request
         tilepath       path to tile on server
         requests       the request queue
-        callback       function to call after tile available
+        callback       function called after each request as
+                       callback(key, server, status, info, body,
+                                exception, elapsed)
         error_tile     image of error tile
         content_type   expected Content-Type string
         rerequest_age  number of days in tile age before re-requesting
                        (0 means don't update tiles)
         error_image    the image to return on some error
-
-        Results are returned in the callback() params.
+        headers        function returning the request headers for a key
+        pools          dictionary mapping server URL to the
+                       http_pool.ConnectionPool for the server
+        hedge          the hedge.HedgePolicy, None means don't hedge
+        executor       the thread pool making hedged requests
+
+        Results are returned in the callback() params.  The callback is
+        called in the worker thread.
         """
 
         threading.Thread.__init__(self)
 
         self.id_num = id_num
-        self.server = server
+        self.balancer = balancer
         self.tilepath = tilepath
         self.requests = requests
         self.callback = callback
@@ -75,41 +171,121 @@ class TileWorker(threading.Thread):
         self.rerequest_age = rerequest_age
         self.error_image = error_image
         self.daemon = True
-        self.user_agent = user_agent
+        self.headers = headers
+        self.pools = pools
+        self.hedge = hedge
+        self.executor = executor
 
     def run(self):
         while True:
             # get zoom level and tile coordinates to retrieve
-            (level, x, y) = self.requests.get()
+            key = self.requests.get()
 
-            # try to retrieve the image
-            error = False
-            pixmap = self.error_image
             try:
-                tile_url = self.server + self.tilepath.format(Z=level, X=x, Y=y)
-                headers = {}
-                if self.user_agent is not None:
-                    headers['User-Agent'] = self.user_agent
-                response = request.urlopen(request.Request(tile_url,
-                                           headers=headers))
-                content_type = response.info().get_content_type()
-                if content_type == self.content_type:
-                    data = io.BytesIO(response.read())
-                    pixmap = wx.Image(data, content_type).ConvertToBitmap()
-                else:
-                    # show error tile, don't cache returned error tile
-                    error = True
-            except Exception as e:
-                error = True
-                log('%s exception getting tile (%d,%d,%d)'
-                        % (type(e).__name__, level, x, y))
+                self.fetch(key)
+            except Exception:
+                # the worker must keep going whatever happens
+                log('Unexpected exception fetching tile (%d,%d,%d)' % key)
+                log(''.join(traceback.format_exc()))
+            finally:
+                # remove request from queue
+                self.requests.task_done()
+
+    def fetch(self, key):
+        """Fetch one tile and pass the result to the callback."""
+
+        # wait for a server that may be sent the request
+        server = self.balancer.acquire()
+
+        # try to retrieve the image, a request that can't be made
+        # is passed to the callback as failed
+        try:
+            headers = self.headers(key)
+        except Exception as e:
+            self.balancer.cancel(server)
+            log('%s exception getting headers for tile (%d,%d,%d)'
+                    % ((type(e).__name__,) + key))
+            result = (None, None, None, e, 0.0)
+        else:
+            if self.hedge is None:
+                result = self.request(server, key, headers)
+            else:
+                (server, result) = self.hedged_request(server, key, headers)
+
+        # call the callback function passing the response
+        self.callback(key, server, *result)
+
+    def request(self, server, key, headers):
+        """Fetch a tile from a server the balancer picked.
 
-            # call the callback function passing level, x, y and pixmap data
-            # error is False if we want to cache this tile on-disk
-            wx.CallAfter(self.callback, level, x, y, pixmap, error)
+        Returns (status, info, body, exception, elapsed).
+        """
+
+        (level, x, y) = key
+        start = time.perf_counter()
+        (status, info, body, exception) = (None, None, None, None)
+        try:
+            tile_path = self.tilepath.format(Z=level, X=x, Y=y)
+            (status, info, body) = self.pools[server].request(tile_path,
+                                                              headers)
+        except Exception as e:
+            exception = e
+        elapsed = time.perf_counter() - start
+
+        # let the balancer see how the server coped
+        self.balancer.release(server, rate_limit.outcome(status, exception),
+                              elapsed, rate_limit.retry_after(info, time.time()))
+        if self.hedge is not None and exception is None:
+            self.hedge.observe(elapsed)
+
+        return (status, info, body, exception, elapsed)
+
+    def hedged_request(self, server, key, headers):
+        """Fetch a tile, hedging with another server if it's slow.
+
+        Returns (server, result) for the first good response to arrive,
+        where 'result' is as for request(), or the failure of the first
+        request if both fail.  A slower response is thrown away when it
+        arrives.
+        """
 
-            # finally, remove request from queue
-            self.requests.task_done()
+        first = self.executor.submit(self.request, server, key, headers)
+        futures = {first: server}
+        delay = self.hedge.start()
+        if delay is not None:
+            (done, _) = concurrent.futures.wait([first], timeout=delay)
+            if not done and self.hedge.try_hedge():
+                # hedge as soon as another server is free, unless the
+                # request finishes first
+                other = None
+                while other is None and not first.done():
+                    other = self.balancer.acquire(exclude=server,
+                                                  timeout=self.HedgePoll)
+                if other is None:
+                    self.hedge.cancel()
+                elif first.done():
+                    self.balancer.cancel(other)
+                    self.hedge.cancel()
+                else:
+                    future = self.executor.submit(self.request, other,
+                                                  key, headers)
+                    futures[future] = other
+
+        # wait for a good response, a fast failure from one server mustn't
+        # beat a slower tile from the other
+        pending = set(futures)
+        good = []
+        while pending and not good:
+            (done, pending) = concurrent.futures.wait(pending,
+                                return_when=concurrent.futures.FIRST_COMPLETED)
+            good = [f for f in done if hedge.succeeded(f.result())]
+
+        if not good:
+            return (server, first.result())
+        winner = first if first in good else good[0]
+        if winner is not first:
+            self.hedge.won()
+        return (futures[winner], winner.result())
 
 ###############################################################################
 # Class for a server tile source.  Extend the BaseTiles class.
@@ -124,6 +300,37 @@ class Tiles(tiles.BaseTiles):
     # maximum number of in-memory cached tiles
     MaxLRU = 1000
 
+    # how tiles are fetched from servers:
+    #     'threads'  TileWorker threads for each server
+    #     'asyncio'  the shared async_fetch.FetchEngine thread
+    FetchEngine = 'threads'
+    FetchEngines = ('threads', 'asyncio')
+
+    # queued requests for tiles more than this many tiles outside the
+    # view are cancelled when the view moves (None means never cancel)
+    CancelMargin = 1
+
+    # if True decode server tiles in the shared tile_decode.DecodePool
+    # processes, started when the first tile is fetched, else decode in
+    # the fetch threads
+    DecodeInPool = True
+
+    # maximum requests per second to one server (None means no limit)
+    # and the number of requests allowed at once after an idle time
+    ServerRate = 10
+    ServerBurst = 20
+
+    # number of times a request failing with a server overload or a
+    # transient error is queued again before showing the error tile
+    MaxRetries = 4
+
+    # if True a request slower than the HedgePercentile latency of recent
+    # requests is hedged with a request to another server, keeping hedged
+    # requests under HedgeBudget times the tile requests
+    HedgeRequests = False
+    HedgePercentile = 95
+    HedgeBudget = 0.05
+
     # allowed file types and associated values
     AllowedFileTypes = {
                         'png': 'PNG',
@@ -135,7 +342,10 @@ class Tiles(tiles.BaseTiles):
 
     def __init__(self, levels, tile_width, tile_height, tiles_dir, max_lru,
                  servers, url_path, max_server_requests,
-                 refetch_days=RefreshTilesAfterDays, user_agent=None):
+                 refetch_days=RefreshTilesAfterDays, user_agent=None,
+                 max_bytes=tiles.BaseTiles.MaxBytes,
+                 warm_bytes=tiles.BaseTiles.WarmBytes, store=None,
+                 disk_quota=None, fetch_engine=None):
         """Initialise a Tiles instance.
 
         levels               a list of level numbers that are to be served
@@ -150,17 +360,54 @@ class Tiles(tiles.BaseTiles):
                              (0 means don't ever update tiles)
         user_agent           User agent added to headers in requests.
                              It may be required by some tile providers.
+        max_bytes            maximum bytes used by cached in-memory tiles
+                             (None means no limit)
+        warm_bytes           maximum bytes used by in-memory undecoded tiles
+        store                the on-disk tile store (see tile_store.py),
+                             if None use a DirectoryStore in 'tiles_dir'
+        disk_quota           maximum bytes of tiles on disk (None means no
+                             limit), if set tiles older than 'refetch_days'
+                             are also deleted from disk
+        fetch_engine         'threads' or 'asyncio', None means use the
+                             FetchEngine class attribute
         """
 
+        if fetch_engine is None:
+            fetch_engine = self.FetchEngine
+        if fetch_engine not in self.FetchEngines:
+            raise TypeError("Bad fetch_engine value, got '%s', "
+                            "expected one of %s"
+                            % (str(fetch_engine), str(self.FetchEngines)))
+
         # prepare the tile cache directory, if required
         # we have to do this *before* the base class initialization!
-        for level in levels:
-            level_dir = os.path.join(tiles_dir, '%d' % level)
-            if not os.path.isdir(level_dir):
-                os.makedirs(level_dir)
+        if store is None:
+            for level in levels:
+                level_dir = os.path.join(tiles_dir, '%d' % level)
+                if not os.path.isdir(level_dir):
+                    os.makedirs(level_dir)
+        elif not os.path.isdir(tiles_dir):
+            os.makedirs(tiles_dir)
+
+        # figure out tile filename extension from 'url_path'
+        tile_extension = os.path.splitext(url_path)[1][1:]
+        tile_extension_lower = tile_extension.lower()      # ensure lower case
+
+        # determine the file bitmap type
+        try:
+            self.filetype = self.AllowedFileTypes[tile_extension_lower]
+        except KeyError as e:
+            raise TypeError("Bad tile_extension value, got '%s', "
+                            "expected one of %s"
+                            % (str(tile_extension),
+                               str(self.AllowedFileTypes.keys())))
 
         # perform the base class initialization
-        super().__init__(levels, tile_width, tile_height, tiles_dir, max_lru)
+        # tiles are stored on disk in the format the server sends
+        super().__init__(levels, tile_width, tile_height, tiles_dir, max_lru,
+                         max_bytes=max_bytes, tile_ext=tile_extension_lower,
+                         warm_bytes=warm_bytes, store=store,
+                         disk_quota=disk_quota, max_disk_age=refetch_days)
 
         # save params not saved in super()
         self.servers = servers
@@ -178,19 +425,6 @@ class Tiles(tiles.BaseTiles):
         # tiles extent for tile data (left, right, top, bottom)
         self.extent = (-180.0, 180.0, -85.0511, 85.0511)
 
-        # figure out tile filename extension from 'url_path'
-        tile_extension = os.path.splitext(url_path)[1][1:]
-        tile_extension_lower = tile_extension.lower()      # ensure lower case
-
-        # determine the file bitmap type
-        try:
-            self.filetype = self.AllowedFileTypes[tile_extension_lower]
-        except KeyError as e:
-            raise TypeError("Bad tile_extension value, got '%s', "
-                            "expected one of %s"
-                            % (str(tile_extension),
-                               str(self.AllowedFileTypes.keys())))
-
         # compose the expected 'Content-Type' string on request result
         # if we get here we know the extension is in self.AllowedFileTypes
         if tile_extension_lower == 'jpg':
@@ -232,16 +466,62 @@ class Tiles(tiles.BaseTiles):
             log(''.join(traceback.format_exc()))
             raise RuntimeError
 
-        # set up the request queue and worker threads
-        self.request_queue = queue.Queue()  # entries are (level, x, y)
+        self.user_agent = user_agent
+
+        # each server has a throttle limiting the request rate, backing
+        # off and reducing concurrent requests if the server is overloaded
+        self.throttles = {server: rate_limit.ServerThrottle(self.max_requests,
+                                                            self.ServerRate,
+                                                            self.ServerBurst)
+                          for server in self.servers}
+
+        # requests go to the server expected to answer soonest, servers
+        # that keep failing are ejected for a while
+        self.balancer = server_balance.ServerBalancer(self.servers,
+                                                      self.throttles)
+
+        # slow requests may be hedged if there's another server
+        self.hedge = None
+        if self.HedgeRequests and len(self.balancer.servers) > 1:
+            self.hedge = hedge.HedgePolicy(self.HedgePercentile,
+                                           self.HedgeBudget)
+
+        # the number of times each failed request has been retried
+        self.retries = {}
+        self.retries_lock = threading.Lock()
+
+        # set up the request queue and the fetch engine or worker threads
+        # each server has a pool of keep-alive connections
+        # requests nearest the view centre are fetched first
+        self.request_queue = tile_queue.TileRequestQueue()  # (level, x, y)
+        self.fetch_engine = fetch_engine
+        self.fetch_source = None
+        self.pools = {}
         self.workers = []
-        for server in self.servers:
-            for num_thread in range(self.max_requests):
-                worker = TileWorker(num_thread, server, self.url_path,
-                                    self.request_queue, self.tile_is_available,
+        if fetch_engine == 'asyncio':
+            engine = async_fetch.get_engine()
+            self.fetch_source = engine.add_source(self.request_queue,
+                                                  self.servers, self.url_path,
+                                                  self.fetch_done,
+                                                  self.request_headers,
+                                                  self.max_requests,
+                                                  self.balancer, self.hedge)
+        else:
+            for server in self.balancer.servers:
+                self.pools[server] = http_pool.ConnectionPool(server,
+                                                max_idle=self.max_requests)
+            num_workers = self.max_requests * len(self.balancer.servers)
+            executor = None
+            if self.hedge is not None:
+                # room for each worker's request, its hedge and a late reply
+                executor = concurrent.futures.ThreadPoolExecutor(3*num_workers)
+            for num_thread in range(num_workers):
+                worker = TileWorker(num_thread, self.balancer, self.url_path,
+                                    self.request_queue, self.fetch_done,
                                     self.error_tile, self.content_type,
                                     self.rerequest_age, self.error_tile,
-                                    user_agent)
+                                    self.request_headers, self.pools,
+                                    self.hedge, executor)
                 self.workers.append(worker)
                 worker.start()
 
@@ -292,10 +572,8 @@ class Tiles(tiles.BaseTiles):
         try:
             # get tile from cache
             tile = self.cache[(self.level, x, y)]
-            if self.tile_on_disk(self.level, x, y):
-                tile_date = self.cache.tile_date((self.level, x, y))
-                if self.rerequest_age and (tile_date < self.rerequest_age):
-                    self.get_server_tile(self.level, x, y)
+            if self.tile_is_stale((self.level, x, y)):
+                self.get_server_tile(self.level, x, y)
         except KeyError as e:
             # not cached, start process of getting tile from 'net, return 'pending' image
             self.get_server_tile(self.level, x, y)
@@ -303,6 +581,24 @@ class Tiles(tiles.BaseTiles):
 
         return tile
 
+    def tile_is_stale(self, key):
+        """Return True if the on-disk tile 'key' should be refreshed.
+
+        A tile is stale after the time the server said it expires or, if
+        the server didn't say, when older than the refetch age.  Nothing
+        is stale if refetching is turned off.
+        """
+
+        if not self.rerequest_age:
+            return False
+        tile_date = self.cache.fetch_date(key)
+        if tile_date is None:
+            return False
+        expires = self.cache.tile_expires(key)
+        if expires is not None:
+            return time.time() > expires
+        return tile_date < self.rerequest_age
+
     def GetInfo(self, level):
         """Get tile info for a particular level.
 
@@ -327,14 +623,69 @@ class Tiles(tiles.BaseTiles):
 
         return (self.num_tiles_x, self.num_tiles_y, None, None)
 
+    def SetView(self, left, top, right, bottom):
+        """Tell the tile source what part of the map is in the view.
+
+        left    the view left edge in fractional tile coordinates
+        top     the view top edge in fractional tile coordinates
+        right   the view right edge in fractional tile coordinates
+        bottom  the view bottom edge in fractional tile coordinates
+
+        Queued tile requests are re-ordered so the tiles nearest the
+        centre are fetched first.  Requests for tiles more than
+        CancelMargin tiles outside the view are cancelled.
+        """
+
+        cancelled = self.request_queue.set_view(self.level, left, top,
+                                                right, bottom,
+                                                self.CancelMargin)
+        if cancelled:
+            for key in cancelled:
+                self.queued_requests.pop(key, None)
+            self.cache.stats.count('cancelled', len(cancelled))
+
     def FlushRequests(self):
         """Delete any outstanding tile requests."""
 
         # if we are serving server tiles ...
         if self.servers:
-            with self.request_queue.mutex:
-                self.request_queue.queue.clear()
+            self.request_queue.clear()
             self.queued_requests.clear()
+            with self.retries_lock:
+                self.retries.clear()
+
+    def GetThrottleInfo(self):
+        """Get the state of the request throttle for each server.
+
+        Returns a dictionary mapping server URL to the dictionary from
+        rate_limit.ServerThrottle.info(), including the current 'limit'
+        on concurrent requests and the seconds of 'backoff' left.
+        """
+
+        return {server: throttle.info()
+                    for (server, throttle) in self.throttles.items()}
+
+    def GetServerInfo(self):
+        """Get the health of each server.
+
+        Returns a dictionary mapping server URL to the dictionary from
+        server_balance.ServerBalancer.info(), including the average
+        'latency' and 'error_rate' and the seconds until an ejected
+        server is tried again.
+        """
+
+        return self.balancer.info()
+
+    def GetHedgeInfo(self):
+        """Get the state of request hedging.
+
+        Returns the dictionary from hedge.HedgePolicy.info(), with the
+        number of 'hedges' sent and 'wins', or None if not hedging.
+        """
+
+        if self.hedge is None:
+            return None
+        return self.hedge.info()
 
     def get_server_tile(self, level, x, y):
         """Start the process to get a server tile.
@@ -344,19 +695,244 @@ class Tiles(tiles.BaseTiles):
         If we don't already have this tile (or getting it), queue a request and
         also put the request into a 'queued request' dictionary.  We
         do this since we can't peek into a queue to see what's there.
+        If the request is already queued, note that it's still wanted.
         """
 
         tile_key = (level, x, y)
-        if tile_key not in self.queued_requests:
+        if tile_key in self.queued_requests:
+            self.request_queue.touch(tile_key)
+        else:
             # add tile request to the server request queue
             self.request_queue.put(tile_key)
             self.queued_requests[tile_key] = True
+            self.cache.stats.count('requests')
+            if self.fetch_source:
+                self.fetch_source.wake()
+
+    def request_headers(self, key):
+        """Return the headers for a request for tile 'key'.
+
+        If we have the tile on disk the request is conditional, so the
+        server can just tell us if the tile hasn't changed.
+        Called in a fetch thread.
+        """
+
+        headers = {}
+        if self.user_agent is not None:
+            headers['User-Agent'] = self.user_agent
+        validators = self.cache.tile_validators(key)
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def fetch_done(self, key, server, status, info, body, exception, elapsed):
+        """Called by the fetch engine when a request finishes.
+
+        key        the (level, x, y) key of the tile
+        server     the server URL
+        status     the HTTP response status
+        info       the response headers
+        body       the response body bytes
+        exception  the exception if the request failed, else None
+        elapsed    seconds taken by the request
+
+        Called in a TileWorker thread or fetch engine executor thread.
+        An unexpected exception shows the error tile.
+        """
+
+        try:
+            self.handle_response(key, server, status, info, body, exception,
+                                 elapsed)
+        except Exception:
+            log('Unexpected exception handling tile (%d,%d,%d)' % key)
+            log(''.join(traceback.format_exc()))
+            wx.CallAfter(self.tile_is_available, *key, self.error_tile, True,
+                         None)
+
+    def handle_response(self, key, server, status, info, body, exception,
+                        elapsed):
+        """Handle the result of a tile request, see fetch_done()."""
+
+        stats = self.cache.stats
+        (level, x, y) = key
+        stats.observe('fetch', elapsed)
+
+        result = rate_limit.outcome(status, exception)
+        if result == rate_limit.Throttled:
+            stats.count('throttled')
+        if result != rate_limit.OK and self.retry_request(key):
+            return
+        with self.retries_lock:
+            self.retries.pop(key, None)
+
+        if exception is None and status == 304:
+            # our tile on disk is still good
+            stats.count('not_modified')
+            validators = response_validators(info, time.time(),
+                                             self.cache.tile_validators(key))
+            self.cache.revalidated(key, validators)
+            wx.CallAfter(self.tile_revalidated, level, x, y)
+            return
+
+        data = None
+        if exception is None:
+            data = tile_data(key, server, status, info, body,
+                             self.content_type)
+        else:
+            log('%s exception getting tile (%d,%d,%d)'
+                    % (type(exception).__name__, level, x, y))
+        if data is None:
+            stats.count('fetch_errors')
+        else:
+            stats.count('fetches')
+            stats.count('bytes_fetched', len(data))
+
+        validators = None
+        if data is not None:
+            validators = response_validators(info, time.time())
+        self.tile_fetched(level, x, y, data, validators)
+
+    def retry_request(self, key):
+        """Queue a failed request for tile 'key' again.
+
+        Returns False if the request has been retried MaxRetries times.
+        The request goes back through the priority queue and is sent
+        once the server throttle has finished backing off.  Requests
+        for tiles no longer wanted are quietly dropped.
+        Called in a fetch thread.
+        """
+
+        if key not in self.queued_requests:
+            # cancelled or flushed while in flight
+            with self.retries_lock:
+                self.retries.pop(key, None)
+            return True
+
+        with self.retries_lock:
+            retries = self.retries.get(key, 0)
+            if retries >= self.MaxRetries:
+                return False
+            self.retries[key] = retries + 1
+
+        self.cache.stats.count('retries')
+        self.request_queue.put(key)
+        if self.fetch_source:
+            self.fetch_source.wake()
+        return True
+
+    def tile_revalidated(self, level, x, y):
+        """Called in the GUI thread when the server says a tile is unchanged."""
+
+        # note that it may not be there - a level change can flush the dict
+        self.queued_requests.pop((level, x, y), None)
+
+    def tile_fetched(self, level, x, y, data, validators=None):
+        """Called when a tile request finishes.
+
+        level, x, y  identify the tile
+        data         the tile bytes from the server, None on error
+        validators   the HTTP validators of the tile
+
+        Called in a fetch thread.  The tile is decoded here, or in the
+        decode pool, and passed to tile_is_available() in the GUI thread.
+        """
+
+        if data is None:
+            wx.CallAfter(self.tile_is_available, level, x, y,
+                         self.error_tile, True, None)
+            return
+
+        # the pool is started by the first tile decoded in it
+        pool = tile_decode.get_pool() if self.DecodeInPool else None
+        if pool is not None:
+            def decoded(future):
+                wx.CallAfter(self.tile_decoded, level, x, y, data, future,
+                             validators)
+            try:
+                pool.submit(data).add_done_callback(decoded)
+                return
+            except RuntimeError as e:
+                # BrokenProcessPool is a RuntimeError, decode this tile
+                # in the GUI thread, get_pool() restarts the pool later
+                log('%s exception starting decode of tile (%d,%d,%d)'
+                        % (type(e).__name__, level, x, y))
+                wx.CallAfter(self.tile_undecoded, level, x, y, data,
+                             validators)
+                return
+
+        (pixmap, error, data) = self.decode_tile(level, x, y, data)
+        wx.CallAfter(self.tile_is_available, level, x, y,
+                     pixmap, error, data, validators)
+
+    def decode_tile(self, level, x, y, data):
+        """Decode tile bytes with wx.
+
+        level, x, y  identify the tile
+        data         the tile bytes from the server
+
+        Returns (pixmap, error, data), the error tile and None data if
+        the bytes can't be decoded.
+        """
+
+        try:
+            pixmap = wx.Image(io.BytesIO(data),
+                              self.content_type).ConvertToBitmap()
+            return (pixmap, False, data)
+        except Exception as e:
+            self.cache.stats.count('decode_errors')
+            log('%s exception decoding tile (%d,%d,%d)'
+                    % (type(e).__name__, level, x, y))
+            return (self.error_tile, True, None)
+
+    def tile_undecoded(self, level, x, y, data, validators=None):
+        """Called in the GUI thread to decode a tile the decode pool can't.
+
+        level, x, y  identify the tile
+        data         the tile bytes from the server
+        validators   the HTTP validators of the tile
+        """
+
+        (pixmap, error, data) = self.decode_tile(level, x, y, data)
+        self.tile_is_available(level, x, y, pixmap, error, data, validators)
+
+    def tile_decoded(self, level, x, y, data, future, validators=None):
+        """Called in the GUI thread when the decode pool has a tile.
+
+        level, x, y  identify the tile
+        data         the tile bytes from the server
+        future       the decode pool future, result (w, h, rgb, alpha)
+        validators   the HTTP validators of the tile
+        """
+
+        try:
+            (width, height, rgb, alpha) = future.result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # a pool process died, decode here, get_pool() restarts the pool
+            log('%s exception decoding tile (%d,%d,%d)'
+                    % (type(e).__name__, level, x, y))
+            self.tile_undecoded(level, x, y, data, validators)
+            return
+        except Exception as e:
+            self.cache.stats.count('decode_errors')
+            log('%s exception decoding tile (%d,%d,%d)'
+                    % (type(e).__name__, level, x, y))
+            self.tile_is_available(level, x, y, self.error_tile, True, None,
+                                   validators)
+            return
+
+        if alpha is None:
+            pixmap = wx.Bitmap.FromBuffer(width, height, rgb)
+        else:
+            pixmap = wx.Bitmap.FromBufferAndAlpha(width, height, rgb, alpha)
+        self.tile_is_available(level, x, y, pixmap, False, data, validators)
 
     def tile_on_disk(self, level, x, y):
         """Return True if tile at (level, x, y) is on-disk."""
 
-        tile_path = self.cache.tile_path((level, x, y))
-        return os.path.exists(tile_path)
+        return self.cache.tile_on_disk((level, x, y))
 
     def setCallback(self, callback):
         """Set the "tile available" callback.
@@ -366,20 +942,26 @@ class Tiles(tiles.BaseTiles):
 
         self.callback = callback
 
-    def tile_is_available(self, level, x, y, image, error):
+    def tile_is_available(self, level, x, y, image, error, data=None,
+                          validators=None):
         """Callback routine - a 'net tile is available.
 
-        level   level for the tile
-        x       x coordinate of tile
-        y       y coordinate of tile
-        image   tile image data
-        error   True if image is 'error' image, don't cache in that case
+        level       level for the tile
+        x           x coordinate of tile
+        y           y coordinate of tile
+        image       tile image data
+        error       True if image is 'error' image, don't cache in that case
+        data        the undecoded tile bytes from the server, if any
+        validators  the HTTP validators of the tile, if any
         """
 
         # put image into in-memory cache, but error images don't go to disk
-        self.cache[(level, x, y)] = image
-        if not error:
-            self.cache._put_to_back((level, x, y), image)
+        # the server bytes are written to disk as-is, no re-encoding
+        if error or data is None:
+            self.cache.put((level, x, y), image, back=not error)
+        else:
+            self.cache.put((level, x, y), image, back=False)
+            self.cache.put_data((level, x, y), data, validators)
 
         # remove the request from the queued requests
         # note that it may not be there - a level change can flush the dict
@@ -411,3 +993,8 @@ class Tiles(tiles.BaseTiles):
         # recalculate this instance's age threshold in UNIX time
         self.rerequest_age = (time.time() -
                                   RefreshTilesAfterDays * self.SecondsInADay)
+
+        # tiles this old are also deleted from a size-limited disk cache
+        self.max_disk_age = num_days
+        if self.disk_quota is not None:
+            self.SetDiskQuota(self.disk_quota)